@@ -1,8 +1,19 @@
 from fasthtml.common import *
 from openai import OpenAI
-from services.search_service import search_knowledge_base, search_doctors
+from services.search_service import search_knowledge_base, search_doctors, embed_with_str, warm_up_embedder
+from services.answer_cache import answer_cache, is_single_turn
+from services.streaming import MessageStream
+from services.context_builder import context_builder
+from services.session_store import SessionStore, session_id
+from services.tracing import span, StreamTimer, metrics_text, registry
+from services.prefetch import ThreadPrefetch
+from services.generations import Generation, Generations
+from services.fragment_cache import fragment_cache
+from services.collection_versions import KNOWLEDGE_BASE_COLLECTION, DOCTOR_COLLECTION
+from models.chat import ChatState
 from config.settings import settings
 import json
+import time
 from threading import Thread
 
 # Set up the app with TailwindCSS
@@ -10,26 +21,34 @@ app = FastHTML(
     hdrs=(
         Script(src="https://cdn.tailwindcss.com"),
         MarkdownJS(),
+        Script(src="https://unpkg.com/htmx-ext-sse@2.2.2/sse.js"),
         Script(src="static/js/sources.js")
     ), 
-    exts='ws'
+    exts='ws',
+    on_startup=[warm_up_embedder]
     )
 
 # Initialize OpenAI client
 client = OpenAI(
     api_key=settings.DASHSCOPE_API_KEY,
-    base_url="https://dashscope-intl.aliyuncs.com/compatible-mode/v1",
+    base_url=settings.DASHSCOPE_COMPATIBLE_BASE_URL,
 )
 
-# Global state
-messages = [
-    {
-        "role": "system",
-        "content": settings.SYSTEM_PROMPT
-    }
-]
+# Per-session chat state
+sessions = SessionStore(
+    lambda: ChatState(settings.SYSTEM_PROMPT),
+    max_session_bytes=settings.SESSION_MAX_BYTES,
+    max_total_bytes=settings.SESSION_STORE_MAX_BYTES,
+    idle_ttl=settings.SESSION_IDLE_TTL
+)
+sessions.register_metrics(registry, app="qwen")
+fragment_cache.register_metrics(registry)
+
+# Live token streams of messages that are still generating, keyed by (session id, message index)
+streams = {}
 
-current_message_idx = 0
+# The answer each session is generating, cancelled by a newer message
+generations = Generations("qwen")
 
 tools = [
     # Tool 1: obtain the current time
@@ -104,23 +123,33 @@ def SourcesPanel():
         hx_trigger="messageSelected from:body"
     )
 
-def ChatMessage(msg_idx):
+def ChatMessage(msg_idx, messages):
     """Render a chat message with click handler to update sources"""
     if msg_idx >= len(messages):
         return ""
     
     msg = messages[msg_idx]
     generating = msg.get('generating', False)
-    text = msg.get('content', '')
+    # The SSE subscription replays everything generated so far, so the
+    # content div starts empty rather than showing it twice
+    text = "" if generating else msg.get('content', '')
     is_user = msg['role'] == 'user'
     is_marked = "marked" if not generating else ""
     align_class = "ml-auto" if is_user else "mr-auto"
     bg_class = "bg-blue-500 text-white" if is_user else "bg-gray-200 text-gray-800"
     
+    # While generating, new tokens are pushed over SSE and appended to the
+    # content div; the "done" event swaps in the final rendered message.
     stream_args = {
-        "hx_trigger": "every 50ms",
-        "hx_swap": "outerHTML",
-        "hx_get": f"/chat_message/{msg_idx}"
+        "hx_ext": "sse",
+        "sse_connect": f"/chat_stream/{msg_idx}",
+        "sse_swap": "done",
+        "sse_close": "done",
+        "hx_swap": "outerHTML"
+    } if generating else {}
+    content_args = {
+        "sse_swap": "delta",
+        "hx_swap": "beforeend"
     } if generating else {}
     
     return Div(
@@ -128,7 +157,8 @@ def ChatMessage(msg_idx):
             Div(msg['role'].title(), cls="text-xs text-gray-500 mb-1"),
             Div(text,
                 cls=f"px-4 py-2 rounded-lg {bg_class} {is_marked} max-w-[80%] break-words cursor-pointer",
-                _=f"on click trigger messageSelected with {{msgIdx: {msg_idx}}}"),
+                _=f"on click trigger messageSelected with {{msgIdx: {msg_idx}}}",
+                **content_args),
             cls=f"{align_class} max-w-[80%]"
         ),
         cls="mb-4",
@@ -148,64 +178,88 @@ def ChatInput():
     )
 
 @app.get("/chat_message/{msg_idx}")
-def get_chat_message(msg_idx: int):
-    return ChatMessage(msg_idx)
+def get_chat_message(msg_idx: int, session):
+    return ChatMessage(msg_idx, sessions.get(session_id(session)).messages)
+
+@app.get("/chat_stream/{msg_idx}")
+async def chat_stream(msg_idx: int, session):
+    """Server-Sent Events stream of a generating message: the content so far, then new deltas"""
+    sid = session_id(session)
+    messages = sessions.get(sid).messages
+
+    async def events():
+        stream = streams.get((sid, msg_idx))
+        if stream is not None:
+            async for event, data in stream.subscribe():
+                yield sse_message(Span(data), event=event)
+        with span("render", component="message"):
+            done = sse_message(ChatMessage(msg_idx, messages), event="done")
+        yield done
+
+    return EventStream(events())
+
+def KnowledgeCard(source):
+    """Card of a knowledge base article, rendered once per article and collection version"""
+    key = ("qwen", source['source_link'], source['title'], source['content_preview'])
+    return fragment_cache.render(key, (KNOWLEDGE_BASE_COLLECTION,), lambda: Div(
+        H4(source['title'], cls="font-semibold text-lg"),
+        P(source['content_preview'], cls="mt-1"),
+        A("Source Link",
+          href=source['source_link'],
+          cls="inline-block mt-2 text-blue-500 hover:text-blue-700"),
+        cls="mb-4 border-b border-gray-200 pb-4"
+    ))
+
+def DoctorCard(source):
+    """Card of a doctor, rendered once per doctor and collection version"""
+    key = ("qwen", source['appointment_link'], source['doctor_name'], source['specialization'], source['description'])
+    return fragment_cache.render(key, (DOCTOR_COLLECTION,), lambda: Div(
+        H4(source['doctor_name'], cls="font-semibold text-lg"),
+        P(f"Specialization: {source['specialization']}", cls="text-gray-600"),
+        P(source['description'], cls="mt-1"),
+        A("Book Appointment",
+          href=source['appointment_link'],
+          cls="inline-block mt-2 text-blue-500 hover:text-blue-700"),
+        cls="mb-4 border-b border-gray-200 pb-4"
+    ))
 
 @app.get("/sources/knowledge")
-def get_knowledge_sources():
+def get_knowledge_sources(session):
     """Get knowledge sources for current message"""
-    global current_message_idx
-    if current_message_idx >= len(messages):
+    state = sessions.get(session_id(session))
+    if state.current_message_idx >= len(state.messages):
         return P("No message selected", cls="text-gray-500 text-center")
     
-    sources = messages[current_message_idx].get('knowledge_sources', [])
+    sources = state.messages[state.current_message_idx].get('knowledge_sources', [])
     
-    return Div(
-        *(
-            Div(
-                H4(source['title'], cls="font-semibold text-lg"),
-                P(source['content_preview'], cls="mt-1"),
-                A("Source Link",
-                  href=source['source_link'],
-                  cls="inline-block mt-2 text-blue-500 hover:text-blue-700"),
-                cls="mb-4 border-b border-gray-200 pb-4"
-            )
-            for source in sources
-        ) if sources else P("No knowledge base entries found", cls="text-gray-500 text-center")
-    )
+    with span("render", component="knowledge_sources"):
+        return to_xml(Div(
+            *(KnowledgeCard(source) for source in sources)
+            if sources else P("No knowledge base entries found", cls="text-gray-500 text-center")
+        ))
 
 @app.get("/sources/doctors")
-def get_doctor_sources():
+def get_doctor_sources(session):
     """Get doctor sources for current message"""
-    global current_message_idx
-    if current_message_idx >= len(messages):
+    state = sessions.get(session_id(session))
+    if state.current_message_idx >= len(state.messages):
         return P("No message selected", cls="text-gray-500 text-center")
     
-    sources = messages[current_message_idx].get('doctor_sources', [])
+    sources = state.messages[state.current_message_idx].get('doctor_sources', [])
     
-    return Div(
-        *(
-            Div(
-                H4(source['doctor_name'], cls="font-semibold text-lg"),
-                P(f"Specialization: {source['specialization']}", cls="text-gray-600"),
-                P(source['description'], cls="mt-1"),
-                A("Book Appointment",
-                  href=source['appointment_link'],
-                  cls="inline-block mt-2 text-blue-500 hover:text-blue-700"),
-                cls="mb-4 border-b border-gray-200 pb-4"
-            )
-            for source in sources
-        ) if sources else P("No medical experts found", cls="text-gray-500 text-center")
-    )
+    with span("render", component="doctor_sources"):
+        return to_xml(Div(
+            *(DoctorCard(source) for source in sources)
+            if sources else P("No medical experts found", cls="text-gray-500 text-center")
+        ))
 
 @app.get("/update_current_message/{msg_idx}")
-def update_current_message(msg_idx: int):
+def update_current_message(msg_idx: int, session):
     """Update the current message index"""
-    global current_message_idx
-    current_message_idx = msg_idx
+    sessions.get(session_id(session)).current_message_idx = msg_idx
     return ""
 
-def process_sources(response, msg_idx):
+def process_sources(response, messages, msg_idx, prefetch=None):
     """Process sources from tools and update message"""
     print('response', response)
     if 'tool_calls' in response:
@@ -213,55 +267,113 @@ def process_sources(response, msg_idx):
             name = tool_call['function']['name']
             args = json.loads(tool_call['function']['arguments'])
             
-            if name == 'search_knowledge_base':
-                sources, _ = search_knowledge_base(args['query'])
-                messages[msg_idx]['knowledge_sources'] = sources
-            elif name == 'search_doctors':
-                sources, _ = search_doctors(args['query'])
-                messages[msg_idx]['doctor_sources'] = sources
+            with span("tool", tool=name):
+                prefetched = prefetch.get(name, args) if prefetch is not None else None
+                if name == 'search_knowledge_base':
+                    sources = prefetched if prefetched is not None else search_knowledge_base(args['query'])
+                    messages[msg_idx]['knowledge_sources'] = sources
+                elif name == 'search_doctors':
+                    sources = prefetched if prefetched is not None else search_doctors(
+                        args['query'],
+                        specialization=args.get('specialization'),
+                        available_only=args.get('available_only', False)
+                    )
+                    messages[msg_idx]['doctor_sources'] = sources
 
-def process_stream(msg_idx):
+def process_stream(state, sid, msg_idx, cache_entry=None, started=None, prefetch=None, generation=None):
     """Process streaming response from OpenAI"""
+    generation = generation or Generation()
     try:
-        response = client.chat.completions.create(
-            model=settings.QWEN_MODEL,
-            messages=[{"role": m["role"], "content": m["content"]} for m in messages[:-1]],
-            tools=tools,
-            stream=True
-        )
-        
-        current_msg = ""
-        for chunk in response:
-            print(chunk)
-            if chunk.choices[0].delta.tool_calls:
-                print(chunk.choices[0].delta.tool_calls)
-                process_sources(chunk.choices[0].delta.model_dump(), msg_idx)
+        with span("chat", app="qwen"):
+            stream_answer(state, sid, msg_idx, cache_entry, StreamTimer("qwen", started), generation, prefetch)
+    finally:
+        generations.finish(sid, generation)
 
-            if chunk.choices[0].delta.content:
-                print(chunk.choices[0].delta.content, end="", flush=True)
-                current_msg += chunk.choices[0].delta.content
-                messages[msg_idx]['content'] = current_msg
+def stream_answer(state, sid, msg_idx, cache_entry, timer, generation, prefetch=None):
+    """Stream one answer into messages[msg_idx] and its MessageStream"""
+    messages = state.messages
+    # Kept so a reset conversation does not get this answer's last writes
+    message = messages[msg_idx]
+    stream = streams[(sid, msg_idx)]
+    try:
+        with span("completion") as completion_span:
+            response = client.chat.completions.create(
+                model=settings.QWEN_MODEL,
+                messages=context_builder.build(messages[:-1]),
+                tools=tools,
+                stream=True
+            )
+            # Cancelling closes the response, which also ends a read that is waiting for the next chunk
+            generation.on_cancel(response.close)
             
-            # Process tool calls if present
+            current_msg = ""
+            try:
+                for chunk in response:
+                    if generation.cancelled.is_set():
+                        break
+                    print(chunk)
+                    if chunk.choices[0].delta.tool_calls:
+                        print(chunk.choices[0].delta.tool_calls)
+                        process_sources(chunk.choices[0].delta.model_dump(), messages, msg_idx, prefetch)
+
+                    if chunk.choices[0].delta.content:
+                        print(chunk.choices[0].delta.content, end="", flush=True)
+                        timer.token()
+                        current_msg += chunk.choices[0].delta.content
+                        message['content'] = current_msg
+                        stream.publish(chunk.choices[0].delta.content)
+                    
+                    # Process tool calls if present
+            except Exception:
+                # Reading a response closed by a cancellation fails; that is no error
+                if not generation.cancelled.is_set():
+                    raise
+            finally:
+                response.close()
+            completion_span.set(cancelled=generation.cancelled.is_set())
+        timer.finish()
                 
-        messages[msg_idx]['generating'] = False
+        message['generating'] = False
+
+        if cache_entry is not None and not generation.cancelled.is_set():
+            query, query_vector, cache_versions = cache_entry
+            answer_cache.store(
+                query, query_vector, current_msg, cache_versions,
+                sources={k: message[k] for k in ('knowledge_sources', 'doctor_sources') if k in message}
+            )
         
     except Exception as e:
-        messages[msg_idx]['content'] = f"Error: {str(e)}"
-        messages[msg_idx]['generating'] = False
+        message['content'] = f"Error: {str(e)}"
+        message['generating'] = False
+    finally:
+        if prefetch is not None:
+            prefetch.discard()
+        stream.close()
+        streams.pop((sid, msg_idx), None)
+        sessions.enforce(sid)
+
+def lookup_cached_answer(query):
+    """Look a query up in the answer cache; returns (entry to store on a miss, cached answer)"""
+    cache_versions = answer_cache.versions()
+    try:
+        query_vector = embed_with_str(query)
+    except Exception as e:
+        print(f"Answer cache lookup failed: {e}")
+        return None, None
+    return (query, query_vector, cache_versions), answer_cache.lookup(query_vector)
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics of this worker"""
+    return Response(metrics_text(), media_type="text/plain; version=0.0.4")
 
 @app.route("/")
-def get():
+def get(session):
     """Render the main page"""
-    global current_message_idx
-    current_message_idx = 0
-    
-    # Reset messages
-    messages.clear()
-    messages.append({
-        "role": "system",
-        "content": settings.SYSTEM_PROMPT
-    })
+    # Stop and reset this session's conversation
+    sid = session_id(session)
+    generations.cancel(sid, "reset")
+    sessions.reset(sid)
     
     page = Body(
         # Add hyperscript for message selection
@@ -314,8 +426,12 @@ def get():
     return Title('AI Health Assistant'), page
 
 @app.post("/")
-def post(text: str):
+def post(text: str, session):
     """Handle chat form submission"""
+    started = time.perf_counter()
+    sid = session_id(session)
+    state = sessions.get(sid)
+    messages = state.messages
     user_idx = len(messages)
     assistant_idx = user_idx + 1
     
@@ -323,6 +439,19 @@ def post(text: str):
         "role": "user",
         "content": text.strip()
     })
+
+    # Single-turn questions may be answered from the semantic cache without any LLM call
+    cache_entry = None
+    if settings.ENABLE_CACHE and settings.QWEN_CACHE and is_single_turn(messages):
+        cache_entry, cached = lookup_cached_answer(text.strip())
+        if cached is not None:
+            messages.append({"role": "assistant", "content": cached.answer, **cached.sources})
+            sessions.enforce(sid)
+            return (
+                ChatMessage(user_idx, messages),
+                ChatMessage(assistant_idx, messages),
+                ChatInput()
+            )
     
     messages.append({
         "role": "assistant",
@@ -330,11 +459,17 @@ def post(text: str):
         "content": ""
     })
     
-    Thread(target=process_stream, args=(assistant_idx,), daemon=True).start()
+    sessions.enforce(sid)
+    streams[(sid, assistant_idx)] = MessageStream()
+    # Search with the raw message while the model decides what to search for
+    prefetch = ThreadPrefetch(text.strip()) if settings.SPECULATIVE_SEARCH else None
+    generation = Generation()
+    generations.start(sid, generation)
+    Thread(target=process_stream, args=(state, sid, assistant_idx, cache_entry, started, prefetch, generation), daemon=True).start()
     
     return (
-        ChatMessage(user_idx),
-        ChatMessage(assistant_idx),
+        ChatMessage(user_idx, messages),
+        ChatMessage(assistant_idx, messages),
         ChatInput()
     )
 
@@ -38,6 +38,14 @@ class Settings(BaseSettings):
     # MODEL settings
     DASHSCOPE_API_KEY: str = os.getenv("DASHSCOPE_API_KEY", "")
     DASHSCOPE_HTTP_BASE_URL: str = os.getenv("DASHSCOPE_HTTP_BASE_URL", "")
+    DASHSCOPE_COMPATIBLE_BASE_URL: str = os.getenv(
+        "DASHSCOPE_COMPATIBLE_BASE_URL", "https://dashscope-intl.aliyuncs.com/compatible-mode/v1"
+    )
+    DASHSCOPE_EMBEDDING_BASE_URL: str = os.getenv(
+        "DASHSCOPE_EMBEDDING_BASE_URL", "https://dashscope-intl.aliyuncs.com/api/v1"
+    )
+    # Serve every LLM and embedding call from one host, e.g. loadtest.replay
+    UPSTREAM_OVERRIDE_URL: str = os.getenv("UPSTREAM_OVERRIDE_URL", "")
     QWEN_MODEL: str = os.getenv("QWEN_MODEL", "")
     QWEN_CACHE: bool = os.getenv("QWEN_CACHE", "True").lower() == "true"
     QWEN_STREAMING: bool = os.getenv("QWEN_STREAMING", "True").lower() == "true"
@@ -50,17 +58,78 @@ class Settings(BaseSettings):
 
     # QDRANT settings
     QDRANT_URL: str = os.getenv("QDRANT_URL", "")
+    QDRANT_PROFILE: str = os.getenv("QDRANT_PROFILE", "default")
+    QDRANT_HNSW_M: int = int(os.getenv("QDRANT_HNSW_M", 0))
+    QDRANT_HNSW_EF_CONSTRUCT: int = int(os.getenv("QDRANT_HNSW_EF_CONSTRUCT", 0))
+    QDRANT_HNSW_EF: int = int(os.getenv("QDRANT_HNSW_EF", 0))
+    QDRANT_OVERSAMPLING: float = float(os.getenv("QDRANT_OVERSAMPLING", 0))
+    EMBEDDED_SEARCH_MAX_POINTS: int = int(os.getenv("EMBEDDED_SEARCH_MAX_POINTS", 10000))
+    EMBEDDED_SEARCH_DIR: str = os.getenv("EMBEDDED_SEARCH_DIR", ".cache/embedded")
+    EMBEDDED_SEARCH_RECHECK_INTERVAL: float = float(os.getenv("EMBEDDED_SEARCH_RECHECK_INTERVAL", 60))
+    SEARCH_SINGLE_FLIGHT: bool = os.getenv("SEARCH_SINGLE_FLIGHT", "True").lower() == "true"
 
     # EMBEDDING settings
     EMBEDDING_MODEL: str = os.getenv("EMBEDDING_MODEL", "")
+    EMBEDDING_DIMENSION: int = int(os.getenv("EMBEDDING_DIMENSION", 1024))
+    EMBEDDING_BACKEND: str = os.getenv("EMBEDDING_BACKEND", "torch")
+    EMBEDDING_QUANTIZE: bool = os.getenv("EMBEDDING_QUANTIZE", "False").lower() == "true"
+    EMBEDDING_ONNX_FILE: str = os.getenv("EMBEDDING_ONNX_FILE", "")
+    EMBEDDING_BATCH_SIZE: int = int(os.getenv("EMBEDDING_BATCH_SIZE", 32))
+    EMBEDDING_WARMUP: bool = os.getenv("EMBEDDING_WARMUP", "True").lower() == "true"
+    EMBEDDING_HTTP_POOL_SIZE: int = int(os.getenv("EMBEDDING_HTTP_POOL_SIZE", 10))
+    EMBEDDING_HTTP_CONNECT_TIMEOUT: float = float(os.getenv("EMBEDDING_HTTP_CONNECT_TIMEOUT", 5))
+    EMBEDDING_HTTP_READ_TIMEOUT: float = float(os.getenv("EMBEDDING_HTTP_READ_TIMEOUT", 30))
+    EMBEDDING_HTTP2: bool = os.getenv("EMBEDDING_HTTP2", "False").lower() == "true"
+    EMBEDDING_CACHE_ENABLED: bool = os.getenv("EMBEDDING_CACHE_ENABLED", "True").lower() == "true"
+    EMBEDDING_CACHE_SIZE: int = int(os.getenv("EMBEDDING_CACHE_SIZE", 4096))
+    EMBEDDING_CACHE_TTL: int = int(os.getenv("EMBEDDING_CACHE_TTL", 86400))
+    EMBEDDING_CACHE_PATH: str = os.getenv("EMBEDDING_CACHE_PATH", ".cache/embeddings.sqlite3")
+
+    # KNOWLEDGE BASE settings
+    KB_CHUNK_TOKENS: int = int(os.getenv("KB_CHUNK_TOKENS", 256))
+    KB_CHUNK_OVERLAP: int = int(os.getenv("KB_CHUNK_OVERLAP", 32))
+    KB_PASSAGES_PER_ARTICLE: int = int(os.getenv("KB_PASSAGES_PER_ARTICLE", 2))
 
     # CACHING settings
     ENABLE_CACHE: bool = os.getenv("ENABLE_CACHE", "True").lower() == "true"
+    SEMANTIC_CACHE_THRESHOLD: float = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.95))
+    SEMANTIC_CACHE_SIZE: int = int(os.getenv("SEMANTIC_CACHE_SIZE", 1000))
+    SEMANTIC_CACHE_TTL: int = int(os.getenv("SEMANTIC_CACHE_TTL", 86400))
+
+    # CONTEXT settings
+    CONTEXT_TOKEN_BUDGET: int = int(os.getenv("CONTEXT_TOKEN_BUDGET", 6000))
+    CONTEXT_ENCODING: str = os.getenv("CONTEXT_ENCODING", "cl100k_base")
+
+    # TOOL settings
+    TOOL_CALL_TIMEOUT: float = float(os.getenv("TOOL_CALL_TIMEOUT", 10))
+    SPECULATIVE_SEARCH: bool = os.getenv("SPECULATIVE_SEARCH", "False").lower() == "true"
+    SPECULATIVE_SEARCH_THRESHOLD: float = float(os.getenv("SPECULATIVE_SEARCH_THRESHOLD", 0.9))
+
+    # STREAMING settings
+    STREAM_DELTA_FRAMES: bool = os.getenv("STREAM_DELTA_FRAMES", "True").lower() == "true"
+    STREAM_FRAME_INTERVAL_MS: int = int(os.getenv("STREAM_FRAME_INTERVAL_MS", 40))
+    STREAM_FRAME_MAX_CHARS: int = int(os.getenv("STREAM_FRAME_MAX_CHARS", 1024))
+
+    # SESSION settings
+    SESSION_MAX_BYTES: int = int(os.getenv("SESSION_MAX_BYTES", 256 * 1024))
+    SESSION_STORE_MAX_BYTES: int = int(os.getenv("SESSION_STORE_MAX_BYTES", 256 * 1024 * 1024))
+    SESSION_IDLE_TTL: int = int(os.getenv("SESSION_IDLE_TTL", 1800))
+
+    # OBSERVABILITY settings
+    TRACE_EXPORT_PATH: str = os.getenv("TRACE_EXPORT_PATH", "")
 
     #xAI settings 
     XAI_API_KEY: str = os.getenv("XAI_API_KEY", "")
     XAI_BASE_URL: str = os.getenv("XAI_BASE_URL", "")
 
+    def model_post_init(self, __context):
+        if self.UPSTREAM_OVERRIDE_URL:
+            base = self.UPSTREAM_OVERRIDE_URL.rstrip("/")
+            self.XAI_BASE_URL = f"{base}/v1"
+            self.DASHSCOPE_HTTP_BASE_URL = f"{base}/v1"
+            self.DASHSCOPE_COMPATIBLE_BASE_URL = f"{base}/v1"
+            self.DASHSCOPE_EMBEDDING_BASE_URL = f"{base}/api/v1"
+
     @property
     def SYSTEM_PROMPT(self) -> str:
         return """
@@ -1,9 +1,22 @@
 from fasthtml.common import *
+import asyncio
+import time
 from openai import OpenAI, AsyncOpenAI
 import json
 from threading import Thread
 from config.settings import settings
-from services.search_service import search_doctors, search_knowledge_base
+from services.async_search_service import search_doctors, search_knowledge_base, aembed_with_str
+from services.search_service import warm_up_embedder
+from services.answer_cache import answer_cache, is_single_turn
+from services.streaming import DeltaCoalescer
+from services.context_builder import context_builder
+from services.session_store import SessionStore, session_id
+from services.tracing import span, StreamTimer, metrics_text, stage_errors, registry
+from services.prefetch import AsyncPrefetch
+from services.generations import Generation, Generations
+from services.fragment_cache import fragment_cache
+from services.collection_versions import KNOWLEDGE_BASE_COLLECTION, DOCTOR_COLLECTION
+from models.chat import ChatState
 
 # Initialize app with required headers
 app, rt = fast_app(
@@ -12,7 +25,8 @@ app, rt = fast_app(
     hdrs=(
         Script(src="https://cdn.tailwindcss.com"),
         MarkdownJS(),
-    )
+    ),
+    on_startup=[warm_up_embedder],
 )
 
 # Initialize OpenAI client and global state
@@ -26,12 +40,18 @@ async_client = AsyncOpenAI(
     base_url=settings.XAI_BASE_URL
 )
 
-messages = [
-    {
-        "role": "system",
-        "content": settings.SYSTEM_PROMPT
-    }
-]
+# Per-session chat state
+sessions = SessionStore(
+    lambda: ChatState(settings.SYSTEM_PROMPT),
+    max_session_bytes=settings.SESSION_MAX_BYTES,
+    max_total_bytes=settings.SESSION_STORE_MAX_BYTES,
+    idle_ttl=settings.SESSION_IDLE_TTL
+)
+sessions.register_metrics(registry, app="grok")
+fragment_cache.register_metrics(registry)
+
+# The answer each session is generating, cancelled by a newer message
+generations = Generations("grok")
 
 # Tool definitions
 tools_definition = [
@@ -58,6 +78,8 @@ tools_definition = [
                 "type": "object",
                 "properties": {
                     "query": {"type": "string", "description": "The user query, e.g. recommend me a doctor for diabetes"},
+                    "specialization": {"type": "string", "description": "Only doctors in this medical field, e.g. Endocrinology. Omit if the user did not ask for one."},
+                    "available_only": {"type": "boolean", "description": "Only doctors currently taking appointments."},
                 },
                 "required": ["query"]
             }
@@ -71,7 +93,7 @@ tool_maps = {
 }
 
 # Define component functions
-def ChatMessage(msg_idx):
+def ChatMessage(msg_idx, messages):
     """Render a chat message with sources"""
     if msg_idx >= len(messages):
         return ""
@@ -84,7 +106,8 @@ def ChatMessage(msg_idx):
         Div(
             Div(msg['role'].title(), cls="text-xs text-gray-500 mb-1"),
             Div(text,
-                cls=f"px-4 py-2 rounded-lg {'bg-blue-500 text-white' if is_user else 'bg-gray-200 text-gray-800'} max-w-[80%] break-words marked"),
+                cls=f"px-4 py-2 rounded-lg {'bg-blue-500 text-white' if is_user else 'bg-gray-200 text-gray-800'} max-w-[80%] break-words marked",
+                id=f"chat-content-{msg_idx}"),
             cls=f"{'ml-auto' if is_user else 'mr-auto'} max-w-[80%]"
         ),
         cls="mb-4",
@@ -102,46 +125,43 @@ def ChatInput():
         hx_swap_oob="true"
     )
 
-def format_sources(sources):
-    """Format sources for a specific message"""
-
-    formatted_sources = []
-
+def format_source(source):
+    """Card of one source, rendered once per source and collection version"""
+    if 'doctor_name' in source:  # Doctor source
+        key = ("grok", source['appointment_link'], source['doctor_name'], source['specialization'], source['description'])
+        return fragment_cache.render(key, (DOCTOR_COLLECTION,), lambda: Div(
+            H4(source['doctor_name'], cls="font-semibold text-lg"),
+            P(f"Specialization: {source['specialization']}", cls="text-gray-600"),
+            P(source['description'], cls="mt-1"),
+            A("Book Appointment",
+              href=source['appointment_link'],
+              cls="inline-block mt-2 text-blue-500 hover:text-blue-700",
+              target="_blank"),
+            cls="mb-4 border-b border-gray-200 pb-4"
+        ))
+    # Knowledge base source; the preview depends on which passages matched
+    key = ("grok", source['source_link'], source['title'], source['content_preview'])
+    return fragment_cache.render(key, (KNOWLEDGE_BASE_COLLECTION,), lambda: Div(
+        H4(source['title'].title(), cls="font-semibold text-lg"),
+        P(source['content_preview'], cls="mt-1"),
+        A("Source Link",
+          href=source['source_link'],
+          cls="inline-block mt-2 text-blue-500 hover:text-blue-700",
+          target="_blank"),
+        cls="mb-4 border-b border-gray-200 pb-4"
+    ))
 
-    for source in json.loads(sources):
-        if 'doctor_name' in source:  # Doctor source
-            formatted_sources.append(
-                Div(
-                    H4(source['doctor_name'], cls="font-semibold text-lg"),
-                    P(f"Specialization: {source['specialization']}", cls="text-gray-600"),
-                    P(source['description'], cls="mt-1"),
-                    A("Book Appointment",
-                      href=source['appointment_link'],
-                      cls="inline-block mt-2 text-blue-500 hover:text-blue-700",
-                      target="_blank"),
-                    cls="mb-4 border-b border-gray-200 pb-4"
-                )
-            )
-        else:  # Knowledge base source
-            formatted_sources.append(
-                Div(
-                    H4(source['title'].title(), cls="font-semibold text-lg"),
-                    P(source['content_preview'], cls="mt-1"),
-                    A("Source Link",
-                      href=source['source_link'],
-                      cls="inline-block mt-2 text-blue-500 hover:text-blue-700",
-                      target="_blank"),
-                    cls="mb-4 border-b border-gray-200 pb-4"
-                )
-            )
-    
-    return formatted_sources
+def format_sources(sources):
+    """Cards of the sources in one tool result, each cached on its own fields by format_source"""
+    return tuple(format_source(source) for source in json.loads(sources))
 
 # Route handlers
 @rt("/")
-def get():
+def get(session):
     """Main page handler"""
-    messages.clear()
+    sid = session_id(session)
+    generations.cancel(sid, "reset")
+    sessions.reset(sid)
     
     page = Main(
         H1('AI Health Assistant', cls="text-3xl font-bold text-gray-800 mb-6 px-4"),
@@ -184,11 +204,14 @@ def get():
 
 
 @rt("/chat")
-def post(text: str = ""):
+def post(session, text: str = ""):
     """Handle chat submission"""
     if not text.strip():
         return ""
 
+    sid = session_id(session)
+    messages = sessions.get(sid).messages
+
     # Add user message
     user_msg_idx = len(messages)
     messages.append({"role": "user", "content": text.strip()})
@@ -198,11 +221,12 @@ def post(text: str = ""):
     messages.append({"role": "assistant", "content": "", "generating": True})
     
     # Process in background
+    sessions.enforce(sid)
     Thread(target=process_response, args=(messages, assistant_msg_idx), daemon=True).start()
     
     return (
-        ChatMessage(user_msg_idx),
-        ChatMessage(assistant_msg_idx),
+        ChatMessage(user_msg_idx, messages),
+        ChatMessage(assistant_msg_idx, messages),
         ChatInput()
     )
 
@@ -261,38 +285,210 @@ def format_suggestions(suggestions):
         hx_swap_oob="innerHTML"
     )
 
-async def process_tool_call(tool_call):
-    """Process tool calls from the AI"""
-    fn_name = tool_call.function.name
-    fn_args = json.loads(tool_call.function.arguments)
-
-    print(f"Processing tool {fn_name} with args: {fn_args}")
-    
-    result = tool_maps[fn_name](**fn_args)
-
-    print(len(result))
+async def call_tool(fn_name, fn_args, prefetch=None):
+    """Result of a tool, taken from the speculative prefetch when it searched the same thing"""
+    if prefetch is not None:
+        result = await prefetch.get(fn_name, fn_args)
+        if result is not None:
+            return result
+    return await tool_maps[fn_name](**fn_args)
+
+async def process_tool_call(tool_call, prefetch=None):
+    """Run one tool call from the AI and return its tool message"""
+    fn_name = tool_call['function']['name']
+    fn_args = {}
+
+    start = time.perf_counter()
+    with span("tool", tool=fn_name) as tool_span:
+        try:
+            fn_args = json.loads(tool_call['function']['arguments'] or "{}")
+            print(f"Processing tool {fn_name} with args: {fn_args}")
+            result = await asyncio.wait_for(call_tool(fn_name, fn_args, prefetch), timeout=settings.TOOL_CALL_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"Tool {fn_name} timed out after {settings.TOOL_CALL_TIMEOUT}s")
+            tool_span.set(timed_out=True)
+            result = []
+        except Exception as e:
+            # Every tool call needs its tool message, and one failing tool must not drop the others' results
+            print(f"Tool {fn_name} failed: {e!r}")
+            tool_span.set(failed=True)
+            stage_errors.inc(stage="tool")
+            result = []
+        tool_span.set(results=len(result))
+    elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+
+    print(f"Tool {fn_name} returned {len(result)} results in {elapsed_ms} ms")
 
     if len(result) > 0:
-        messages.append({
+        return {
             "role": "tool",
             "content": json.dumps(result),
             "tool_name": fn_name,
-            "tool_call_id": tool_call.id,
-            "result_length": len(result)
+            "tool_call_id": tool_call['id'],
+            "result_length": len(result),
+            "elapsed_ms": elapsed_ms
+        }
+    return {
+        "role": "tool",
+        "content": f"No result for {fn_name} with argument {fn_args}",
+        "tool_name": fn_name,
+        "tool_call_id": tool_call['id'],
+        "result_length": 0,
+        "elapsed_ms": elapsed_ms
+    }
+
+def collect_tool_call_deltas(tool_calls, deltas):
+    """Merge streamed tool call deltas into complete calls keyed by their index"""
+    for delta in deltas:
+        index = delta.index if delta.index is not None else len(tool_calls)
+        call = tool_calls.setdefault(index, {
+            "id": "",
+            "type": "function",
+            "function": {"name": "", "arguments": ""}
         })
+        if delta.id:
+            call['id'] = delta.id
+        if delta.function is not None:
+            if delta.function.name:
+                call['function']['name'] = delta.function.name
+            if delta.function.arguments:
+                call['function']['arguments'] += delta.function.arguments
+
+async def run_tool_calls(tool_calls, prefetch=None):
+    """Run every tool call of one assistant turn concurrently, keeping the call order"""
+    start = time.perf_counter()
+    tool_messages = await asyncio.gather(*(process_tool_call(call, prefetch) for call in tool_calls))
+    print(f"Ran {len(tool_calls)} tool calls in {(time.perf_counter() - start) * 1000:.1f} ms")
+    return tool_messages
+
+def message_update(msg_idx, messages):
+    """Full re-render of a message, swapped in place"""
+    return to_xml(Div(
+        ChatMessage(msg_idx, messages),
+        hx_swap_oob="outerHTML",
+        id=f"chat-message-{msg_idx}"
+    ))
+
+def message_delta(msg_idx, text):
+    """Append-only frame adding text to a message that is still streaming"""
+    return to_xml(Div(text, id=f"chat-content-{msg_idx}", hx_swap_oob="beforeend"))
+
+async def stream_completion(response, messages, msg_idx, send, tool_calls=None, timer=None):
+    """Stream a completion into messages[msg_idx] and push it to the client"""
+    if settings.STREAM_DELTA_FRAMES:
+        coalescer = DeltaCoalescer(
+            send,
+            lambda text: message_delta(msg_idx, text),
+            interval=settings.STREAM_FRAME_INTERVAL_MS / 1000,
+            max_chars=settings.STREAM_FRAME_MAX_CHARS
+        )
     else:
-        messages.append({
-            "role": "tool",
-            "content": f"No result for {fn_name} with argument {fn_args}",
-            "tool_name": fn_name,
-            "tool_call_id": tool_call.id,
-            "result_length": 0 
-        })
+        # Legacy mode: re-render the whole message for every chunk
+        coalescer = DeltaCoalescer(send, lambda text: message_update(msg_idx, messages), interval=0)
+
+    # Closing the response releases its connection even when the answer is cancelled
+    async with response:
+        async for chunk in response:
+            delta = chunk.choices[0].delta
+            if delta.content is not None:
+                messages[msg_idx]['content'] += delta.content
+                if timer is not None and delta.content:
+                    timer.token()
+                await coalescer.push(delta.content)
+
+            if delta.tool_calls and tool_calls is not None:
+                print(delta.tool_calls)
+                collect_tool_call_deltas(tool_calls, delta.tool_calls)
+
+    await coalescer.flush()
+    if settings.STREAM_DELTA_FRAMES and coalescer.tokens:
+        # Send the complete message once so it gets rendered as markdown
+        with span("render", component="message"):
+            frame = message_update(msg_idx, messages)
+        await coalescer.send_frame(frame)
+
+    print(f"Streamed message {msg_idx}: {coalescer.summary()}")
+
+async def send_sources(tool_results, send):
+    """Replace the sources panel with the cards of the given tool results"""
+    with span("render", component="sources"):
+        formatted_sources = [format_sources(content) for content in tool_results]
+        panel = to_xml(Div(
+            *formatted_sources,
+            id="sources-panel",
+            hx_swap_oob="innerHTML"
+        )) if formatted_sources else None
+    if panel is not None:
+        await send(panel)
+
+async def lookup_cached_answer(query):
+    """Embed the query and look it up in the answer cache; returns (embedding, cached answer)"""
+    try:
+        query_vector = await aembed_with_str(query)
+    except Exception as e:
+        print(f"Answer cache lookup failed: {e}")
+        return None, None
+    return query_vector, answer_cache.lookup(query_vector)
+
+async def replay_cached_answer(cached, messages, send):
+    """Send a cached answer, its sources and suggestions as if it was just generated"""
+    messages.append({
+        "role": "assistant",
+        "content": cached.answer
+    })
+    await send(Div(
+        ChatMessage(len(messages) - 1, messages),
+        hx_swap_oob="beforeend",
+        id="chatlist"
+    ))
+    await send_sources(cached.sources.get("tool_results", []), send)
+    if cached.suggestions:
+        await send(format_suggestions(cached.suggestions))
+    print(f"Answered from cache: {cached.query!r} ({answer_cache.stats()})")
+
+@rt("/metrics")
+def get():
+    """Prometheus metrics of this worker"""
+    return Response(metrics_text(), media_type="text/plain; version=0.0.4")
+
+async def ws_disconnect(ws, session):
+    """Stop the answer a closed websocket was waiting for"""
+    generations.cancel(session_id(session), "disconnect", owner=ws)
 
-@app.ws('/ws')
-async def ws(msg: str, send):
+@app.ws('/ws', disconn=ws_disconnect)
+async def ws(msg: str, send, session, ws):
     """Web socket handler to stream the AI response."""
-    
+    started = time.perf_counter()
+    # Answer in a task, so the socket keeps receiving and a newer message can cancel it
+    sid = session_id(session)
+    generation = Generation(owner=ws)
+    previous = generations.start(sid, generation)
+    generation.task = asyncio.create_task(run_answer(msg, send, session, started, generation, previous))
+
+async def run_answer(msg, send, session, started, generation, previous=None):
+    """Answer a message once the session's previous answer has stopped"""
+    if previous is not None:
+        await previous.wait()
+    if generation.cancelled.is_set():
+        return
+    try:
+        with span("chat", app="grok"):
+            await answer(msg, send, session, started)
+    except asyncio.CancelledError:
+        print(f"Cancelled answer to {msg.strip()!r}")
+    finally:
+        generations.finish(session_id(session), generation)
+
+def drop_unanswered_tool_calls(messages):
+    """Tool calls without their results would make every later request of the session invalid"""
+    if messages[-1].get('tool_calls'):
+        del messages[-1]['tool_calls']
+
+async def answer(msg, send, session, started):
+    """Answer one message of a websocket chat"""
+    sid = session_id(session)
+    messages = sessions.get(sid).messages
+
     # Add user message
     messages.append({
         "role": "user",
@@ -302,7 +498,7 @@ async def ws(msg: str, send):
 
     # Send user message to chat
     await send(Div(
-        ChatMessage(user_msg_idx),
+        ChatMessage(user_msg_idx, messages),
         hx_swap_oob="beforeend",
         id="chatlist"
     ))
@@ -310,55 +506,57 @@ async def ws(msg: str, send):
     # Reset chat input
     await send(ChatInput())
 
+    # Single-turn questions may be answered from the semantic cache without any LLM call
+    use_cache = settings.ENABLE_CACHE and is_single_turn(messages)
+    if use_cache:
+        cache_versions = answer_cache.versions()
+        query_vector, cached = await lookup_cached_answer(msg.strip())
+        if cached is not None:
+            await replay_cached_answer(cached, messages, send)
+            sessions.enforce(sid)
+            return
+
+    tool_results = []
+    timer = StreamTimer("grok", started)
+    # Search with the raw message while the model decides what to search for
+    prefetch = AsyncPrefetch(msg.strip()) if settings.SPECULATIVE_SEARCH else None
     try:
-        # First, call tools if needed
-        response = await async_client.chat.completions.create(
-            model="grok-2-1212",
-            messages=messages,
-            tools=tools_definition,
-            tool_choice="auto",
-            stream=True
-        )
+        tool_calls = {}
+        with span("completion", round=1):
+            # First, call tools if needed
+            response = await async_client.chat.completions.create(
+                model="grok-2-1212",
+                messages=context_builder.build(messages),
+                tools=tools_definition,
+                tool_choice="auto",
+                stream=True
+            )
 
-        # Add initial assistant message
-        messages.append({
-            "role": "assistant",
-            "content": ""
-        })
-        assistant_msg_idx = len(messages) - 1
+            # Add initial assistant message
+            messages.append({
+                "role": "assistant",
+                "content": ""
+            })
+            assistant_msg_idx = len(messages) - 1
 
-        # Show initial loading state
-        await send(Div(
-            ChatMessage(assistant_msg_idx),
-            hx_swap_oob="beforeend",
-            id="chatlist"
-        ))
+            # Show initial loading state
+            await send(Div(
+                ChatMessage(assistant_msg_idx, messages),
+                hx_swap_oob="beforeend",
+                id="chatlist"
+            ))
 
-        async for chunk in response:
-            print(chunk)
-            if chunk.choices[0].delta.content is not None:
-                messages[assistant_msg_idx]['content'] += chunk.choices[0].delta.content
-                # Update the current message
-                await send(Div(
-                    ChatMessage(assistant_msg_idx),
-                    hx_swap_oob="outerHTML",
-                    id=f"chat-message-{assistant_msg_idx}"
-                ))
-
-            if chunk.choices[0].delta.tool_calls:
-                print(chunk.choices[0].delta.tool_calls)
-                for tool_call in chunk.choices[0].delta.tool_calls:
-                    print('tool call')
-                    await process_tool_call(tool_call)
-
-                    if messages[-1]['role'] == 'tool' and messages[-1]['result_length'] > 0:
-                        formatted_sources = format_sources(messages[-1]['content'])
-                        if len(formatted_sources) > 0:
-                            await send(Div(
-                                *formatted_sources,
-                                id="sources-panel",
-                                hx_swap_oob="innerHTML"
-                            ))
+            await stream_completion(response, messages, assistant_msg_idx, send, tool_calls, timer)
+
+        if tool_calls:
+            ordered_calls = [tool_calls[index] for index in sorted(tool_calls)]
+            messages[assistant_msg_idx]['tool_calls'] = ordered_calls
+            tool_messages = await run_tool_calls(ordered_calls, prefetch)
+            messages.extend(tool_messages)
+
+            tool_results = [m['content'] for m in tool_messages if m['result_length'] > 0]
+            if tool_results:
+                await send_sources(tool_results, send)
 
         # If last message was a tool response, get another completion
         if messages[-1]['role'] == 'tool':
@@ -371,43 +569,53 @@ async def ws(msg: str, send):
 
             # Show loading state for new message
             await send(Div(
-                ChatMessage(assistant_msg_idx),
+                ChatMessage(assistant_msg_idx, messages),
                 hx_swap_oob="beforeend",
                 id="chatlist"
             ))
 
-            response = await async_client.chat.completions.create(
-                model="grok-2-1212",
-                messages=messages[:-1],  # Exclude empty assistant message
-                tools=tools_definition,
-                tool_choice="auto",
-                stream=True
-            )
-
-            async for chunk in response:
-                if chunk.choices[0].delta.content is not None:
-                    messages[assistant_msg_idx]['content'] += chunk.choices[0].delta.content
-                    await send(Div(
-                        ChatMessage(assistant_msg_idx),
-                        hx_swap_oob="outerHTML",
-                        id=f"chat-message-{assistant_msg_idx}"
-                    ))
+            with span("completion", round=2):
+                response = await async_client.chat.completions.create(
+                    model="grok-2-1212",
+                    messages=context_builder.build(messages[:-1]),  # Exclude empty assistant message
+                    tools=tools_definition,
+                    tool_choice="auto",
+                    stream=True
+                )
+                await stream_completion(response, messages, assistant_msg_idx, send, timer=timer)
+        timer.finish()
 
         # Generate and send suggestions after completion
-        suggestions = await get_next_questions(messages[-1]['content'])
+        with span("suggestions"):
+            suggestions = await get_next_questions(messages[-1]['content'])
         await send(format_suggestions(suggestions))
 
+        if use_cache:
+            answer_cache.store(
+                msg.strip(), query_vector, messages[-1]['content'], cache_versions,
+                sources={"tool_results": tool_results},
+                suggestions=suggestions
+            )
+
+    except asyncio.CancelledError:
+        drop_unanswered_tool_calls(messages)
+        raise
     except Exception as e:
+        drop_unanswered_tool_calls(messages)
         # Add error message
         messages.append({
             "role": "assistant",
             "content": f"I apologize, but I encountered an error: {str(e)}"
         })
         await send(Div(
-            ChatMessage(len(messages)-1),
+            ChatMessage(len(messages)-1, messages),
             hx_swap_oob="beforeend",
             id="chatlist"
         ))
+    finally:
+        if prefetch is not None:
+            prefetch.discard()
+        sessions.enforce(sid)
 
 def process_response(messages, idx):
     """Process AI response in background"""
@@ -415,7 +623,7 @@ def process_response(messages, idx):
         while True:
             response = client.chat.completions.create(
                 model="grok-2-1212",  # Replace with your model
-                messages=messages[:-1],
+                messages=context_builder.build(messages[:-1]),
                 tools=tools_definition,
                 tool_choice="auto",
                 stream=True
@@ -437,7 +645,7 @@ def process_response(messages, idx):
                 
                 response = client.chat.completions.create(
                     model="grok-2-1212",  # Replace with your model
-                    messages=messages[:-1],
+                    messages=context_builder.build(messages[:-1]),
                     tools=tools_definition,
                     tool_choice="auto",
                     stream=True
@@ -1,18 +1,54 @@
 from fasthtml.common import *
+import asyncio
 import json
 import httpx
-from datetime import datetime
+from models.chat import ChatState
+from services.session_store import SessionStore, session_id
+from services.streaming import MessageStream
+from ui.components.sources import format_source as cached_source
+
+API_URI = os.getenv("API_URI", "")
+# Seconds allowed for a whole answer, on top of the per-read timeout
+API_STREAM_TIMEOUT = float(os.getenv("API_STREAM_TIMEOUT", 300))
+
+# One pooled keep-alive client for every answer. Once all connections are
+# streaming, new messages wait up to API_POOL_TIMEOUT seconds for a free one
+# instead of opening more upstream streams, then fail with an error message.
+upstream = httpx.AsyncClient(
+    timeout=httpx.Timeout(
+        connect=float(os.getenv("API_CONNECT_TIMEOUT", 5)),
+        read=float(os.getenv("API_READ_TIMEOUT", 60)),
+        write=10.0,
+        pool=float(os.getenv("API_POOL_TIMEOUT", 30))
+    ),
+    limits=httpx.Limits(
+        max_connections=int(os.getenv("API_POOL_SIZE", 20)),
+        max_keepalive_connections=int(os.getenv("API_POOL_SIZE", 20))
+    )
+)
+
+async def close_upstream():
+    await upstream.aclose()
 
 # Set up the app with Tailwind 
 app = FastHTML(hdrs=(
     Script(src="https://cdn.tailwindcss.com"),
-    MarkdownJS()
-), exts='ws')
+    MarkdownJS(),
+    Script(src="https://unpkg.com/htmx-ext-sse@2.2.2/sse.js")
+), exts='ws', on_shutdown=[close_upstream])
+
+# Live token streams of messages that are still generating, keyed by (session id, message index)
+streams = {}
+# Strong references, so running proxy tasks are not garbage collected
+proxy_tasks = set()
 
-# Store messages, current sources, and history
-messages = []
-current_sources = {"knowledge_base": [], "doctors": []}
-search_history = []
+# Messages, current sources and history are kept per session
+sessions = SessionStore(
+    ChatState,
+    max_session_bytes=int(os.getenv("SESSION_MAX_BYTES", 256 * 1024)),
+    max_total_bytes=int(os.getenv("SESSION_STORE_MAX_BYTES", 256 * 1024 * 1024)),
+    idle_ttl=int(os.getenv("SESSION_IDLE_TTL", 1800))
+)
 
 def format_historical_source(source, timestamp):
     """Format a historical source result"""
@@ -34,7 +70,11 @@ def format_historical_source(source, timestamp):
     )
 
 def format_source(source, source_type):
-    """Format source information for display"""
+    """This app's card of a source, cached by ui.components.sources"""
+    return cached_source(source, source_type, card=source_card)
+
+def source_card(source, source_type):
+    """Card of a knowledge base article or doctor"""
     if source_type == "search_knowledge_base":
         return Div(
             Div(
@@ -74,7 +114,7 @@ def format_source(source, source_type):
             cls="bg-white rounded-lg shadow-sm hover:shadow-md transition-shadow duration-200"
         )
 
-def HistoryPanel():
+def HistoryPanel(search_history):
     """Render the search history panel"""
     if not search_history:
         return Div(
@@ -89,7 +129,7 @@ def HistoryPanel():
         cls="space-y-4"
     )
 
-def Sources():
+def Sources(current_sources):
     """Render sources panel with history toggle"""
     kb_sources = [format_source(s, "search_knowledge_base") 
                  for s in current_sources["knowledge_base"]]
@@ -123,8 +163,9 @@ def Sources():
     )
 
 @app.route("/current-sources")
-def get():
+def get(session):
     """Return current sources panel content"""
+    current_sources = sessions.get(session_id(session)).current_sources
     kb_sources = [format_source(s, "search_knowledge_base") 
                  for s in current_sources["knowledge_base"]]
     doc_sources = [format_source(s, "search_doctors") 
@@ -140,21 +181,33 @@ def get():
     )
 
 @app.route("/history")
-def get():
+def get(session):
     """Return history panel content"""
-    return HistoryPanel()
+    return HistoryPanel(sessions.get(session_id(session)).search_history)
+
+def SourcesSection(current_sources):
+    """Sources panel as an out-of-band swap, sent over SSE while and after answering"""
+    return Div(Sources(current_sources), id="sources-section", hx_swap_oob="innerHTML")
 
-def ChatMessage(msg_idx, **kwargs):
-    """Render a chat message with polling if still generating"""
+def ChatMessage(msg_idx, messages, **kwargs):
+    """Render a chat message, streaming its content over SSE while it is generating"""
     msg = messages[msg_idx]
     is_user = msg['role'] == 'user'
     generating = 'generating' in msg and msg['generating']
     
-    # Add polling attributes if message is still generating
-    poll_attrs = {
-        "hx_trigger": "every 0.1s",
-        "hx_swap": "outerHTML",
-        "hx_get": f"/chat_message/{msg_idx}"
+    # While generating, new tokens are pushed over SSE and appended to the
+    # content div; the "done" event swaps in the final message. The
+    # subscription replays everything generated so far, so the div starts empty.
+    stream_attrs = {
+        "hx_ext": "sse",
+        "sse_connect": f"/chat_stream/{msg_idx}",
+        "sse_swap": "done",
+        "sse_close": "done",
+        "hx_swap": "outerHTML"
+    } if generating else {}
+    content_attrs = {
+        "sse_swap": "delta",
+        "hx_swap": "beforeend"
     } if generating else {}
     
     # Style classes based on message role
@@ -164,22 +217,50 @@ def ChatMessage(msg_idx, **kwargs):
     return Div(
         Div(
             P(msg['role'], cls="text-xs text-gray-500 mb-1"),
-            Div(msg['content'] if msg['content'] else "...",
-                cls=f"{bubble_cls} markdown prose"),
+            Div("" if generating else msg['content'] or "...",
+                cls=f"{bubble_cls} markdown prose",
+                **content_attrs),
+            # Receives "sources" events; their only content is the out-of-band panel
+            Div(sse_swap="sources", hx_swap="none") if generating else "",
             cls="flex flex-col"
         ),
         id=f"chat-message-{msg_idx}",
         cls=container_cls,
-        **poll_attrs,
+        **stream_attrs,
         **kwargs
     )
 
 @app.get("/chat_message/{msg_idx}")
-def get_chat_message(msg_idx: int):
-    """Route that gets polled while streaming"""
+def get_chat_message(msg_idx: int, session):
+    """Current state of a message"""
+    messages = sessions.get(session_id(session)).messages
     if msg_idx >= len(messages):
         return ""
-    return ChatMessage(msg_idx)
+    return ChatMessage(msg_idx, messages)
+
+@app.get("/chat_stream/{msg_idx}")
+async def chat_stream(msg_idx: int, session):
+    """Server-Sent Events stream of a generating message: the content so far, then new deltas"""
+    sid = session_id(session)
+    state = sessions.get(sid)
+
+    async def events():
+        stream = streams.get((sid, msg_idx))
+        if stream is not None:
+            # Deltas that pile up while this client is slow are merged into one event
+            async for event, data in stream.subscribe():
+                # Deltas are raw text; other events carry rendered HTML
+                yield sse_message(Span(data) if event == "delta" else NotStr(data), event=event)
+        if msg_idx >= len(state.messages):
+            yield sse_message("", event="done")
+            return
+        # The final message, plus the sources gathered while answering
+        yield sse_message((
+            ChatMessage(msg_idx, state.messages),
+            SourcesSection(state.current_sources)
+        ), event="done")
+
+    return EventStream(events())
 
 def ChatInput():
     """Render the chat input field"""
@@ -203,8 +284,10 @@ def LoadingIndicator():
     )
 
 @app.route("/")
-def get():
+def get(session):
     """Main page route"""
+    state = sessions.get(session_id(session))
+    messages = state.messages
     page = Body(
         Div(
             # Header
@@ -218,7 +301,7 @@ def get():
             Div(
                 # Chat section
                 Div(
-                    Div(*[ChatMessage(i) for i in range(len(messages))],
+                    Div(*[ChatMessage(i, messages) for i in range(len(messages))],
                         id="chatlist",
                         cls="h-[70vh] overflow-y-auto px-4 py-6"),
                     LoadingIndicator(),
@@ -238,7 +321,8 @@ def get():
                 ),
                 # Sources section
                 Div(
-                    Sources(),
+                    Sources(state.current_sources),
+                    id="sources-section",
                     cls="bg-white rounded-lg shadow-lg"
                 ),
                 cls="grid grid-cols-2 gap-8 max-w-7xl mx-auto px-4"
@@ -249,35 +333,55 @@ def get():
     )
     return Title('Health Assistant'), page
 
-def process_stream_response(response_stream, msg_idx):
-    """Process streaming response in a separate thread"""
-    def process():
-        action_status = None
-        for line in response_stream.iter_lines():
-            if not line.strip():
-                continue
-            
-            data = json.loads(line)
-            
-            if data["type"] == "stream":
-                messages[msg_idx]["content"] += data["content"]
-            elif data["type"] == "sources":
-                if data["fn_name"] == "search_knowledge_base":
-                    current_sources["knowledge_base"] = data["sources"]
-                    search_history.append((data["sources"], datetime.now()))
-                else:
-                    current_sources["doctors"] = data["sources"]
-            elif data["type"] == "final_answer":
-                messages[msg_idx]["content"] = data["content"]
-                messages[msg_idx]["generating"] = False
-                
+async def proxy_stream(state, sid, msg_idx, payload):
+    """
+    Relay the NDJSON answer of API_URI into messages[msg_idx] and its MessageStream.
+
+    Runs as a background task, so the /send request returns at once and the
+    browser receives tokens as they arrive over /chat_stream.
+    """
+    messages = state.messages
+    stream = streams[(sid, msg_idx)]
+    try:
+        async with asyncio.timeout(API_STREAM_TIMEOUT):
+            async with upstream.stream("POST", API_URI, json=payload) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line.strip():
+                        continue
+
+                    data = json.loads(line)
+                    if not isinstance(data, dict):
+                        raise ValueError(f"Unexpected event {line!r}")
+
+                    if data.get("type") == "stream":
+                        messages[msg_idx]["content"] += data.get("content", "")
+                        stream.publish(data.get("content", ""))
+                    elif data.get("type") == "sources":
+                        if data.get("fn_name") == "search_knowledge_base":
+                            state.add_source(data.get("sources", []), "knowledge_base")
+                        else:
+                            state.add_source(data.get("sources", []), "doctors")
+                        # Swapped into the sources panel right away, not only once the answer is done
+                        stream.publish(to_xml(SourcesSection(state.current_sources)), event="sources")
+                    elif data.get("type") == "final_answer":
+                        messages[msg_idx]["content"] = data.get("content", messages[msg_idx]["content"])
+    except (httpx.HTTPError, TimeoutError, ValueError, KeyError, TypeError) as e:
+        print(f"Answer stream from {API_URI} failed: {e!r}")
+        messages[msg_idx]["content"] += "\n\nSorry, the answer could not be completed. Please try again."
+    finally:
         messages[msg_idx]["generating"] = False
-    
-    process()
+        stream.close()
+        streams.pop((sid, msg_idx), None)
+        sessions.enforce(sid)
 
 @app.post("/send")
-def post(msg: str):
+async def post(msg: str, session):
     """Handle message submission"""
+    sid = session_id(session)
+    state = sessions.get(sid)
+    messages = state.messages
+
     # Add user message
     messages.append({"role": "user", "content": msg.rstrip()})
     user_msg_idx = len(messages) - 1
@@ -291,19 +395,17 @@ def post(msg: str):
     assistant_msg_idx = len(messages) - 1
     
     # Start processing in background
-    api_uri = os.getenv("API_URI", "")
-    client = httpx.Client()
-    response = client.stream(
-        'POST',
-        api_uri,
-        json={"text": msg, "history": messages},
-        timeout=30.0
-    )
-    process_stream_response(response, assistant_msg_idx)
+    sessions.enforce(sid)
+    streams[(sid, assistant_msg_idx)] = MessageStream()
+    task = asyncio.create_task(proxy_stream(
+        state, sid, assistant_msg_idx, {"text": msg, "history": list(messages)}
+    ))
+    proxy_tasks.add(task)
+    task.add_done_callback(proxy_tasks.discard)
     
     return (
-        ChatMessage(user_msg_idx),
-        ChatMessage(assistant_msg_idx),
+        ChatMessage(user_msg_idx, messages),
+        ChatMessage(assistant_msg_idx, messages),
         ChatInput()
     )
 
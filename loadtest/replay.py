@@ -0,0 +1,178 @@
+"""
+Record real LLM and embedding traffic once, then serve it back offline.
+
+Recording is a pass-through proxy: the app talks to it instead of the real
+APIs (set UPSTREAM_OVERRIDE_URL to its address) and every exchange is
+appended to a JSONL file with the response chunks and their timing.
+
+    python -m loadtest.replay record traffic.jsonl --chat-upstream https://api.x.ai/v1
+    UPSTREAM_OVERRIDE_URL=http://127.0.0.1:8920 uvicorn grok_app:app
+
+Replaying serves the recorded responses for identical requests, at the
+recorded speed or scaled by --speed (0 sends everything at once):
+
+    python -m loadtest.replay serve traffic.jsonl --speed 2
+
+Requests that were never recorded get the next recording of the same
+endpoint in turn, or a 404 with --strict.
+"""
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import itertools
+import json
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+CHAT_PATH = "/v1/chat/completions"
+EMBEDDING_PATH = "/api/v1/services/embeddings/text-embedding/text-embedding"
+
+# Not forwarded; httpx sets them for the upstream request
+HOP_HEADERS = {"host", "content-length", "accept-encoding", "connection"}
+
+
+def request_key(path: str, body: bytes) -> str:
+    """Identity of a request, independent of JSON key order and whitespace"""
+    try:
+        normalized = json.dumps(json.loads(body), sort_keys=True, separators=(",", ":"))
+    except ValueError:
+        normalized = body.decode(errors="replace")
+    return hashlib.sha256(f"{path}\n{normalized}".encode()).hexdigest()
+
+
+def create_recorder(path: str, chat_upstream: str, embedding_upstream: str) -> Starlette:
+    upstreams = {CHAT_PATH: chat_upstream.rstrip("/") + "/chat/completions",
+                 EMBEDDING_PATH: embedding_upstream.rstrip("/") + "/services/embeddings/text-embedding/text-embedding"}
+    http = httpx.AsyncClient(timeout=httpx.Timeout(120.0, connect=10.0))
+    out = open(path, "a")
+
+    async def proxy(request: Request):
+        body = await request.body()
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in HOP_HEADERS}
+        start = time.perf_counter()
+        upstream = await http.send(
+            http.build_request("POST", upstreams[request.url.path], content=body, headers=headers), stream=True
+        )
+        record = {
+            "key": request_key(request.url.path, body),
+            "path": request.url.path,
+            "request": json.loads(body or b"null"),
+            "status": upstream.status_code,
+            "content_type": upstream.headers.get("content-type", "application/json"),
+            "chunks": [],
+        }
+
+        async def relay():
+            try:
+                async for text in upstream.aiter_text():
+                    record["chunks"].append([round(time.perf_counter() - start, 4), text])
+                    yield text
+            finally:
+                await upstream.aclose()
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+
+        return StreamingResponse(relay(), status_code=upstream.status_code, media_type=record["content_type"])
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        yield
+        await http.aclose()
+        out.close()
+
+    return Starlette(
+        routes=[Route(CHAT_PATH, proxy, methods=["POST"]), Route(EMBEDDING_PATH, proxy, methods=["POST"])],
+        lifespan=lifespan,
+    )
+
+
+class Recordings:
+    """Recorded exchanges by request key, each key's recordings served in turn"""
+
+    def __init__(self, path: str):
+        by_key: Dict[str, List[dict]] = defaultdict(list)
+        by_path: Dict[str, List[dict]] = defaultdict(list)
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    by_key[record["key"]].append(record)
+                    by_path[record["path"]].append(record)
+        self._by_key = {key: itertools.cycle(records) for key, records in by_key.items()}
+        self._by_path = {path: itertools.cycle(records) for path, records in by_path.items()}
+        self.size = sum(len(records) for records in by_key.values())
+        self.hits = 0
+        self.misses = 0
+
+    def find(self, path: str, body: bytes, strict: bool):
+        records = self._by_key.get(request_key(path, body))
+        if records is not None:
+            self.hits += 1
+            return next(records)
+        self.misses += 1
+        if strict or path not in self._by_path:
+            return None
+        return next(self._by_path[path])
+
+
+def create_replayer(path: str, speed: float = 1.0, strict: bool = False) -> Starlette:
+    recordings = Recordings(path)
+    print(f"Replaying {recordings.size} recorded responses from {path}")
+
+    async def replay(request: Request):
+        record = recordings.find(request.url.path, await request.body(), strict)
+        if record is None:
+            return JSONResponse({"error": "no recording for this request"}, status_code=404)
+
+        async def chunks():
+            elapsed = 0.0
+            for offset, text in record["chunks"]:
+                if speed > 0 and offset > elapsed:
+                    await asyncio.sleep((offset - elapsed) / speed)
+                elapsed = offset
+                yield text
+
+        return StreamingResponse(chunks(), status_code=record["status"], media_type=record["content_type"])
+
+    async def stats(request: Request):
+        return JSONResponse({"recordings": recordings.size, "hits": recordings.hits, "misses": recordings.misses})
+
+    return Starlette(routes=[
+        Route(CHAT_PATH, replay, methods=["POST"]),
+        Route(EMBEDDING_PATH, replay, methods=["POST"]),
+        Route("/", stats),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=["record", "serve"])
+    parser.add_argument("file", help="JSONL file of recorded exchanges")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8920)
+    parser.add_argument("--chat-upstream", default="https://dashscope-intl.aliyuncs.com/compatible-mode/v1",
+                        help="OpenAI-compatible base URL to record from")
+    parser.add_argument("--embedding-upstream", default="https://dashscope-intl.aliyuncs.com/api/v1",
+                        help="DashScope API base URL to record from")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed factor, 0 for no delays")
+    parser.add_argument("--strict", action="store_true", help="404 on requests that were not recorded")
+    args = parser.parse_args()
+
+    if args.mode == "record":
+        app = create_recorder(args.file, args.chat_upstream, args.embedding_upstream)
+    else:
+        app = create_replayer(args.file, speed=args.speed, strict=args.strict)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+"""
+Drive concurrent chat sessions against one of the apps, with every upstream
+replaced by loadtest.stubs, and report what users would experience.
+
+    python -m loadtest.run grok --sessions 50 --turns 3
+    python -m loadtest.run qwen --sessions 20 --max-ttft-p95-ms 800 --json-out report.json
+
+Targets: grok (grok_app.py, websockets), qwen (app.py, HTTP + SSE) and
+hello (hello.py, HTTP + SSE). Reports time to first token, end-to-end latency
+percentiles, tokens/s delivered to each client, and the app server's CPU
+and RSS. Any --max-*/--min-* gate that is not met makes the exit status 1,
+so the run can gate a release.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, asdict, field
+from typing import List, Optional
+
+import httpx
+import numpy as np
+import psutil
+import websockets
+
+from loadtest.stubs import QUESTIONS, TOKEN_MARKER, seed_collections
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+TARGETS = {"grok": "grok_app", "qwen": "app", "hello": "hello"}
+
+# Required by config.settings; the values are never used against real services
+PLACEHOLDER_ENV = (
+    "ALIBABA_CLOUD_AK", "ALIBABA_CLOUD_SK", "ALIBABA_REGION_ID", "ANALYTIC_DB_HOST",
+    "ANALYTIC_DB_DATABASE", "ANALYTIC_DB_USER", "ANALYTIC_DB_PASSWORD", "NEO4J_URL",
+    "NEO4J_PASSWORD", "API_HOST",
+)
+
+
+@dataclass
+class Turn:
+    ttft_ms: float
+    e2e_ms: float
+    tokens: int
+    # Delivery rate after the first token
+    tokens_per_s: Optional[float]
+    error: Optional[str] = None
+
+
+@dataclass
+class ResourceUsage:
+    cpu_percent: List[float] = field(default_factory=list)
+    rss_bytes: List[int] = field(default_factory=list)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{process.args} exited with status {process.returncode}")
+        try:
+            httpx.get(url, timeout=2)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+
+def finish(start: float, first: Optional[float], tokens: int, error: Optional[str] = None) -> Turn:
+    end = time.perf_counter()
+    first = first or end
+    streamed = end - first
+    return Turn(
+        ttft_ms=(first - start) * 1000,
+        e2e_ms=(end - start) * 1000,
+        tokens=tokens,
+        tokens_per_s=tokens / streamed if streamed > 0 and tokens else None,
+        error=error,
+    )
+
+
+async def grok_session(base_url: str, questions: List[str], think_s: float) -> List[Turn]:
+    """grok_app.py: one websocket per session, frames are htmx out-of-band swaps"""
+    turns = []
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as http:
+        await http.get("/")
+        cookie = "; ".join(f"{name}={value}" for name, value in http.cookies.items())
+        ws_url = base_url.replace("http://", "ws://") + "/ws"
+        async with websockets.connect(ws_url, additional_headers={"Cookie": cookie}, max_size=None) as ws:
+            for question in questions:
+                start = time.perf_counter()
+                first, tokens, error = None, 0, None
+                await ws.send(json.dumps({"msg": question}))
+                while True:
+                    frame = await asyncio.wait_for(ws.recv(), timeout=120)
+                    if first is None and TOKEN_MARKER in frame:
+                        first = time.perf_counter()
+                    if "chat-message-" in frame and TOKEN_MARKER in frame:
+                        # Full renders carry the whole message so far
+                        tokens = max(tokens, frame.count(TOKEN_MARKER))
+                    if "encountered an error" in frame:
+                        error = "app reported an error"
+                        break
+                    if 'id="suggestions-container"' in frame:
+                        break
+                turns.append(finish(start, first, tokens, error))
+                await asyncio.sleep(think_s)
+    return turns
+
+
+async def sse_session(base_url: str, questions: List[str], think_s: float, path: str, field: str) -> List[Turn]:
+    """The POST returns the message shell, tokens arrive over SSE from /chat_stream"""
+    turns = []
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as http:
+        await http.get("/")
+        for question in questions:
+            start = time.perf_counter()
+            first, tokens = None, 0
+            response = await http.post(path, data={field: question})
+            match = re.search(r'sse-connect="/chat_stream/(\d+)"', response.text)
+            if match is None:
+                # Answered from cache, nothing to stream
+                turns.append(finish(start, None, response.text.count(TOKEN_MARKER)))
+                continue
+            async with http.stream("GET", f"/chat_stream/{match.group(1)}") as stream:
+                event = None
+                async for line in stream.aiter_lines():
+                    if line.startswith("event:"):
+                        event = line.split(":", 1)[1].strip()
+                    elif line.startswith("data:"):
+                        if event == "delta" and first is None:
+                            first = time.perf_counter()
+                        if event == "done":
+                            tokens = max(tokens, line.count(TOKEN_MARKER))
+                    elif not line and event == "done":
+                        break
+            turns.append(finish(start, first, tokens))
+            await asyncio.sleep(think_s)
+    return turns
+
+
+async def qwen_session(base_url: str, questions: List[str], think_s: float) -> List[Turn]:
+    """app.py"""
+    return await sse_session(base_url, questions, think_s, "/", "text")
+
+
+async def hello_session(base_url: str, questions: List[str], think_s: float) -> List[Turn]:
+    """hello.py, proxying the NDJSON backend"""
+    return await sse_session(base_url, questions, think_s, "/send", "msg")
+
+
+SESSIONS = {"grok": grok_session, "qwen": qwen_session, "hello": hello_session}
+
+
+async def run_sessions(target: str, base_url: str, sessions: int, turns: int, ramp_s: float, think_s: float):
+    rng = random.Random(0)
+    run_session = SESSIONS[target]
+
+    async def one(i: int):
+        await asyncio.sleep(ramp_s * i / max(sessions, 1))
+        questions = [rng.choice(QUESTIONS) for _ in range(turns)]
+        try:
+            return await run_session(base_url, questions, think_s)
+        except Exception as e:
+            return [Turn(0, 0, 0, None, error=f"{type(e).__name__}: {e}")]
+
+    results = await asyncio.gather(*(one(i) for i in range(sessions)))
+    return [turn for session_turns in results for turn in session_turns]
+
+
+def sample_resources(pid: int, usage: ResourceUsage, stop: threading.Event, interval: float = 0.25):
+    """CPU (percent of one core) and RSS of the server and its children"""
+    root = psutil.Process(pid)
+    processes = {}
+    while not stop.is_set():
+        try:
+            current = [root] + root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return
+        cpu, rss = 0.0, 0
+        for process in current:
+            # cpu_percent measures since the previous call on the same object
+            process = processes.setdefault(process.pid, process)
+            try:
+                cpu += process.cpu_percent(None)
+                rss += process.memory_info().rss
+            except psutil.NoSuchProcess:
+                continue
+        usage.cpu_percent.append(cpu)
+        usage.rss_bytes.append(rss)
+        stop.wait(interval)
+
+
+def percentiles(values: List[float]) -> dict:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    return {f"p{p}": round(float(np.percentile(values, p)), 1) for p in (50, 95, 99)}
+
+
+def summarize(turns: List[Turn], usage: ResourceUsage, wall_s: float) -> dict:
+    ok = [t for t in turns if t.error is None]
+    rates = [t.tokens_per_s for t in ok if t.tokens_per_s]
+    return {
+        "turns": len(turns),
+        "errors": len(turns) - len(ok),
+        "error_samples": sorted({t.error for t in turns if t.error})[:5],
+        "ttft_ms": percentiles([t.ttft_ms for t in ok]),
+        "e2e_ms": percentiles([t.e2e_ms for t in ok]),
+        "tokens_per_s_per_session": percentiles(rates),
+        "tokens_per_s_total": round(sum(t.tokens for t in ok) / wall_s, 1) if wall_s else None,
+        "server_cpu_percent": {
+            "mean": round(float(np.mean(usage.cpu_percent)), 1) if usage.cpu_percent else None,
+            "max": round(max(usage.cpu_percent), 1) if usage.cpu_percent else None,
+        },
+        "server_rss_mb": {
+            "start": round(usage.rss_bytes[0] / 2 ** 20, 1) if usage.rss_bytes else None,
+            "max": round(max(usage.rss_bytes) / 2 ** 20, 1) if usage.rss_bytes else None,
+        },
+        "wall_s": round(wall_s, 1),
+    }
+
+
+def check_gates(report: dict, args) -> List[str]:
+    failures = []
+
+    def gate(value, limit, label, lower_is_better=True):
+        if limit is None:
+            return
+        if value is None or (value > limit if lower_is_better else value < limit):
+            failures.append(f"{label} = {value} (limit {limit})")
+
+    gate(report["ttft_ms"]["p95"], args.max_ttft_p95_ms, "TTFT p95 ms")
+    gate(report["e2e_ms"]["p95"], args.max_e2e_p95_ms, "end-to-end p95 ms")
+    gate(report["tokens_per_s_per_session"]["p50"], args.min_tokens_per_s, "tokens/s p50", lower_is_better=False)
+    gate(report["server_rss_mb"]["max"], args.max_rss_mb, "peak RSS MB")
+    gate(report["errors"], args.max_errors, "errors")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("target", choices=TARGETS)
+    parser.add_argument("--sessions", type=int, default=20, help="concurrent simulated users")
+    parser.add_argument("--turns", type=int, default=3, help="questions per session")
+    parser.add_argument("--ramp-s", type=float, default=5.0, help="spread session starts over this many seconds")
+    parser.add_argument("--think-s", type=float, default=1.0, help="pause between a reply and the next question")
+    parser.add_argument("--ttft-ms", type=float, default=300.0, help="stub LLM time to first token")
+    parser.add_argument("--tokens-per-s", type=float, default=40.0, help="stub LLM generation speed")
+    parser.add_argument("--answer-tokens", type=int, default=120)
+    parser.add_argument("--no-tool-calls", action="store_true")
+    parser.add_argument("--embedding-ms", type=float, default=20.0, help="stub embedding latency")
+    parser.add_argument("--replay", help="serve LLM and embedding calls from this loadtest.replay recording")
+    parser.add_argument("--replay-speed", type=float, default=1.0)
+    parser.add_argument("--qdrant-url", help="seed and use a real local Qdrant instead of the in-memory stand-in")
+    parser.add_argument("--cache", action="store_true", help="leave the semantic answer cache enabled")
+    parser.add_argument("--json-out", help="write the report to this file")
+    parser.add_argument("--max-ttft-p95-ms", type=float)
+    parser.add_argument("--max-e2e-p95-ms", type=float)
+    parser.add_argument("--min-tokens-per-s", type=float)
+    parser.add_argument("--max-rss-mb", type=float)
+    parser.add_argument("--max-errors", type=int, default=0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    stub_port, replay_port, app_port = free_port(), free_port(), free_port()
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    # Recorded traffic replaces the stub LLM and embeddings; Qdrant stays on the stub
+    upstream_url = f"http://127.0.0.1:{replay_port}" if args.replay else stub_url
+    app_url = f"http://127.0.0.1:{app_port}"
+
+    stub_cmd = [
+        sys.executable, "-m", "loadtest.stubs", "--port", str(stub_port),
+        "--ttft-ms", str(args.ttft_ms), "--tokens-per-s", str(args.tokens_per_s),
+        "--answer-tokens", str(args.answer_tokens), "--embedding-ms", str(args.embedding_ms),
+    ]
+    if args.no_tool_calls:
+        stub_cmd.append("--no-tool-calls")
+
+    if args.qdrant_url:
+        from qdrant_client import QdrantClient
+        seed_collections(QdrantClient(url=args.qdrant_url), int(os.getenv("EMBEDDING_DIMENSION", 1024)))
+
+    env = {name: "stub" for name in PLACEHOLDER_ENV}
+    env.update(os.environ)
+    env.update({
+        "DASHSCOPE_API_KEY": "stub",
+        "XAI_API_KEY": "stub",
+        "UPSTREAM_OVERRIDE_URL": upstream_url,
+        "QWEN_MODEL": "stub",
+        "API_URI": f"{stub_url}/chat",
+        "QDRANT_URL": args.qdrant_url or stub_url,
+        "EMBEDDING_MODEL": "",
+        "ENABLE_CACHE": str(args.cache),
+        # Keep every on-disk cache of the run out of the project
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embeddings.sqlite3"),
+        "COLLECTION_VERSIONS_PATH": os.path.join(workdir, "collection_versions.json"),
+        "EMBEDDED_SEARCH_DIR": os.path.join(workdir, "embedded"),
+    })
+    app_cmd = [
+        sys.executable, "-m", "uvicorn", f"{TARGETS[args.target]}:app",
+        "--host", "127.0.0.1", "--port", str(app_port), "--log-level", "warning",
+    ]
+
+    logs = open(os.path.join(workdir, "servers.log"), "w")
+    stub = subprocess.Popen(stub_cmd, cwd=PROJECT_ROOT, stdout=logs, stderr=subprocess.STDOUT)
+    replay, server = None, None
+    try:
+        wait_until_up(stub_url + "/", stub)
+        if args.replay:
+            replay_cmd = [
+                sys.executable, "-m", "loadtest.replay", "serve", os.path.abspath(args.replay),
+                "--port", str(replay_port), "--speed", str(args.replay_speed),
+            ]
+            replay = subprocess.Popen(replay_cmd, cwd=PROJECT_ROOT, stdout=logs, stderr=subprocess.STDOUT)
+            wait_until_up(upstream_url + "/", replay)
+        server = subprocess.Popen(app_cmd, cwd=PROJECT_ROOT, env=env, stdout=logs, stderr=subprocess.STDOUT)
+        wait_until_up(app_url + "/", server)
+
+        usage = ResourceUsage()
+        stop = threading.Event()
+        sampler = threading.Thread(target=sample_resources, args=(server.pid, usage, stop), daemon=True)
+        sampler.start()
+
+        start = time.perf_counter()
+        turns = asyncio.run(run_sessions(args.target, app_url, args.sessions, args.turns, args.ramp_s, args.think_s))
+        wall_s = time.perf_counter() - start
+        stop.set()
+        sampler.join()
+    finally:
+        for process in (server, replay, stub):
+            if process is not None:
+                process.terminate()
+                process.wait(timeout=10)
+        logs.close()
+
+    report = {
+        "target": args.target,
+        "sessions": args.sessions,
+        "stub": {"ttft_ms": args.ttft_ms, "tokens_per_s": args.tokens_per_s, "answer_tokens": args.answer_tokens},
+        **summarize(turns, usage, wall_s),
+    }
+    print(json.dumps(report, indent=2))
+    print(f"Server logs: {logs.name}")
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump({**report, "raw_turns": [asdict(t) for t in turns]}, f, indent=2)
+
+    failures = check_gates(report, args)
+    for failure in failures:
+        print(f"GATE FAILED: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
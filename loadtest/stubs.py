@@ -0,0 +1,283 @@
+"""
+Local stand-ins for every upstream the chat apps talk to:
+
+- an OpenAI-compatible /v1/chat/completions with configurable time to first
+  token and tokens/s, emitting tool calls when the app offers search tools,
+- the DashScope text-embedding endpoint, returning bag-of-words vectors so a
+  query finds the stored passage with the same words,
+- the NDJSON /chat backend hello.py proxies,
+- the subset of the Qdrant REST API the search services use, served from an
+  in-memory qdrant-client seeded with synthetic articles and doctors.
+
+    python -m loadtest.stubs --port 8900 --ttft-ms 300 --tokens-per-s 40
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+import uuid
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+import uvicorn
+from qdrant_client import QdrantClient, models
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+# Every generated token carries this prefix, so clients can count what they received
+TOKEN_MARKER = "zq"
+
+QUESTIONS = [
+    "What is diabetes?",
+    "What are the early signs of breast cancer?",
+    "How is cataract surgery done?",
+    "Which doctor treats thyroid problems?",
+    "Is high blood pressure hereditary?",
+    "What causes blurred vision?",
+    "What should I eat with type 2 diabetes?",
+    "When should I get a mammogram?",
+]
+
+DOCTORS = [
+    ("Dr Hoh Hon Bing", "Ophthalmology", "eye vision cataract blurred surgery", True),
+    ("Dr Azlina Firzah", "Breast and Endocrinology", "breast cancer mammogram signs", True),
+    ("Dr Vijay Ananda Paramasvaran", "Endocrinology", "diabetes thyroid blood pressure diet", False),
+]
+
+
+@dataclass
+class StubConfig:
+    ttft_ms: float = 300.0
+    tokens_per_s: float = 40.0
+    answer_tokens: int = 120
+    tool_calls: bool = True
+    embedding_ms: float = 20.0
+    dimension: int = 1024
+    jitter: float = 0.1
+
+
+def embed(text: str, dimension: int) -> List[float]:
+    """Hashed bag of words; texts sharing words get a high cosine similarity"""
+    vector = np.zeros(dimension, dtype=np.float32)
+    for word in re.findall(r"\w+", text.lower()):
+        vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % dimension] += 1.0
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).tolist()
+
+
+def seed_collections(client: QdrantClient, dimension: int):
+    """Synthetic knowledge base passages and doctors, shaped like the ingestion scripts' output"""
+    for name in ("knowledge_base_collection", "doctor_collection"):
+        if client.collection_exists(name):
+            client.delete_collection(name)
+        client.create_collection(
+            collection_name=name,
+            vectors_config=models.VectorParams(size=dimension, distance=models.Distance.COSINE),
+        )
+
+    points = []
+    for i, question in enumerate(QUESTIONS):
+        parent_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"https://example.com/article/{i}"))
+        for chunk in range(2):
+            text = question if chunk == 0 else f"{question} More detail on the topic."
+            points.append(models.PointStruct(
+                id=str(uuid.uuid5(uuid.NAMESPACE_URL, f"https://example.com/article/{i}#{chunk}")),
+                vector=embed(f"Title: {question}\n{text}", dimension),
+                payload={
+                    "parent_id": parent_id, "chunk_index": chunk,
+                    "char_start": chunk * 100, "char_end": chunk * 100 + len(text),
+                    "title": question, "source_link": f"https://example.com/article/{i}", "text": text,
+                },
+            ))
+    client.upsert("knowledge_base_collection", points=points, wait=True)
+
+    client.upsert("doctor_collection", points=[
+        models.PointStruct(
+            id=i,
+            vector=embed(description, dimension),
+            payload={
+                "doctor_name": name, "doctor_field": field, "doctor_description": description,
+                "availability": available, "appointment_link": f"https://example.com/doctor/{i}",
+            },
+        )
+        for i, (name, field, description, available) in enumerate(DOCTORS)
+    ], wait=True)
+
+
+def create_app(config: StubConfig, qdrant: QdrantClient) -> Starlette:
+    rng = random.Random(0)
+
+    def jittered(seconds: float) -> float:
+        return max(0.0, seconds * (1 + rng.uniform(-config.jitter, config.jitter)))
+
+    def answer_tokens():
+        return [f"{TOKEN_MARKER}{i % 100} " for i in range(config.answer_tokens)]
+
+    def wants_tool_call(body) -> bool:
+        tools = {t["function"]["name"] for t in body.get("tools") or []}
+        last = body["messages"][-1]
+        return config.tool_calls and "search_knowledge_base" in tools and last["role"] == "user"
+
+    # OpenAI-compatible chat completions
+
+    async def chat_completions(request: Request):
+        body = await request.json()
+        created = int(time.time())
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+
+        def chunk(delta, finish_reason=None):
+            return "data: " + json.dumps({
+                "id": completion_id, "object": "chat.completion.chunk", "created": created,
+                "model": body.get("model", "stub"),
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }) + "\n\n"
+
+        if not body.get("stream"):
+            await asyncio.sleep(jittered(config.ttft_ms / 1000))
+            return JSONResponse({
+                "id": completion_id, "object": "chat.completion", "created": created,
+                "model": body.get("model", "stub"),
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {
+                    "role": "assistant", "content": '["What are the symptoms?", "How is it treated?"]'
+                }}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+
+        async def events():
+            await asyncio.sleep(jittered(config.ttft_ms / 1000))
+            if wants_tool_call(body):
+                query = body["messages"][-1]["content"]
+                yield chunk({"role": "assistant", "content": None, "tool_calls": [{
+                    "index": 0, "id": f"call_{uuid.uuid4().hex[:8]}", "type": "function",
+                    "function": {"name": "search_knowledge_base", "arguments": ""},
+                }]})
+                yield chunk({"tool_calls": [{"index": 0, "function": {"arguments": json.dumps({"query": query})}}]})
+                yield chunk({}, "tool_calls")
+            else:
+                yield chunk({"role": "assistant", "content": ""})
+                for token in answer_tokens():
+                    yield chunk({"content": token})
+                    await asyncio.sleep(jittered(1 / config.tokens_per_s))
+                yield chunk({}, "stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    # DashScope embeddings
+
+    async def text_embedding(request: Request):
+        body = await request.json()
+        texts = body["input"]["texts"]
+        if isinstance(texts, str):
+            texts = [texts]
+        dimension = (body.get("parameters") or {}).get("dimension") or config.dimension
+        await asyncio.sleep(jittered(config.embedding_ms / 1000))
+        return JSONResponse({
+            "output": {"embeddings": [
+                {"text_index": i, "embedding": embed(text, dimension)} for i, text in enumerate(texts)
+            ]},
+            "usage": {"total_tokens": sum(len(t.split()) for t in texts)},
+            "request_id": uuid.uuid4().hex,
+        })
+
+    # NDJSON backend of hello.py
+
+    async def hello_chat(request: Request):
+        await request.json()
+
+        async def lines():
+            await asyncio.sleep(jittered(config.ttft_ms / 1000))
+            content = ""
+            for token in answer_tokens():
+                content += token
+                yield json.dumps({"type": "stream", "content": token}) + "\n"
+                await asyncio.sleep(jittered(1 / config.tokens_per_s))
+            yield json.dumps({"type": "final_answer", "content": content}) + "\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    # Qdrant REST subset, backed by the in-memory client
+
+    def qdrant_result(result):
+        if hasattr(result, "model_dump"):
+            result = result.model_dump(mode="json", exclude_none=True)
+        return JSONResponse({"result": result, "status": "ok", "time": 0.0})
+
+    async def qdrant_root(request: Request):
+        return JSONResponse({"title": "qdrant - vector search engine (stub)", "version": "1.12.1"})
+
+    async def collection_exists(request: Request):
+        return qdrant_result({"exists": qdrant.collection_exists(request.path_params["name"])})
+
+    async def count(request: Request):
+        body = models.CountRequest(**await request.json())
+        return qdrant_result(qdrant.count(request.path_params["name"], count_filter=body.filter, exact=True))
+
+    async def scroll(request: Request):
+        body = models.ScrollRequest(**await request.json())
+        points, offset = qdrant.scroll(
+            request.path_params["name"], scroll_filter=body.filter, limit=body.limit or 10,
+            offset=body.offset, with_payload=body.with_payload, with_vectors=body.with_vector or False,
+        )
+        return qdrant_result({
+            "points": [p.model_dump(mode="json", exclude_none=True) for p in points],
+            "next_page_offset": offset,
+        })
+
+    async def query(request: Request):
+        body = models.QueryRequest(**await request.json())
+        return qdrant_result(qdrant.query_points(
+            request.path_params["name"], query=body.query, query_filter=body.filter,
+            limit=body.limit or 10, with_payload=body.with_payload, score_threshold=body.score_threshold,
+        ))
+
+    async def query_groups(request: Request):
+        body = models.QueryGroupsRequest(**await request.json())
+        return qdrant_result(qdrant.query_points_groups(
+            request.path_params["name"], group_by=body.group_by, query=body.query, query_filter=body.filter,
+            limit=body.limit or 10, group_size=body.group_size or 3, with_payload=body.with_payload,
+            score_threshold=body.score_threshold,
+        ))
+
+    return Starlette(routes=[
+        Route("/v1/chat/completions", chat_completions, methods=["POST"]),
+        Route("/api/v1/services/embeddings/text-embedding/text-embedding", text_embedding, methods=["POST"]),
+        Route("/chat", hello_chat, methods=["POST"]),
+        Route("/", qdrant_root),
+        Route("/collections/{name}/exists", collection_exists),
+        Route("/collections/{name}/points/count", count, methods=["POST"]),
+        Route("/collections/{name}/points/scroll", scroll, methods=["POST"]),
+        Route("/collections/{name}/points/query", query, methods=["POST"]),
+        Route("/collections/{name}/points/query/groups", query_groups, methods=["POST"]),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--ttft-ms", type=float, default=StubConfig.ttft_ms)
+    parser.add_argument("--tokens-per-s", type=float, default=StubConfig.tokens_per_s)
+    parser.add_argument("--answer-tokens", type=int, default=StubConfig.answer_tokens)
+    parser.add_argument("--no-tool-calls", action="store_true", help="answer directly instead of searching first")
+    parser.add_argument("--embedding-ms", type=float, default=StubConfig.embedding_ms)
+    parser.add_argument("--dimension", type=int, default=StubConfig.dimension)
+    args = parser.parse_args()
+
+    config = StubConfig(
+        ttft_ms=args.ttft_ms, tokens_per_s=args.tokens_per_s, answer_tokens=args.answer_tokens,
+        tool_calls=not args.no_tool_calls, embedding_ms=args.embedding_ms, dimension=args.dimension,
+    )
+    qdrant = QdrantClient(":memory:")
+    seed_collections(qdrant, config.dimension)
+    uvicorn.run(create_app(config, qdrant), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
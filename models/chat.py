@@ -2,43 +2,98 @@
 from typing import List, Dict, Any, Optional
 from pydantic import BaseModel
 from datetime import datetime
+import json
 
 class Message(BaseModel):
     role: str
     content: str
     tool_calls: Optional[List[Dict[str, Any]]] = None
 
+def _message_bytes(msg: Dict[str, Any]) -> int:
+    return sum(len(v) if isinstance(v, str) else len(json.dumps(v, default=str)) for v in msg.values())
+
 class ChatState:
-    def __init__(self):
+    def __init__(self, system_prompt: Optional[str] = None):
         # Regular attributes, not Pydantic fields
-        self._messages = []  
+        self._system_prompt = system_prompt
+        self._messages = []
         self._current_sources = {
             "knowledge_base": [],
             "doctors": []
         }
         self._search_history = []
-    
+        self.current_message_idx = 0
+        self.reset()
+
     @property
     def messages(self):
         return self._messages
-    
+
     @property
     def current_sources(self):
         return self._current_sources
-    
+
     @property
     def search_history(self):
         return self._search_history
 
+    def reset(self):
+        """Start a fresh conversation, keeping only the system prompt"""
+        self._messages.clear()
+        if self._system_prompt:
+            self._messages.append({"role": "system", "content": self._system_prompt})
+        self._current_sources["knowledge_base"] = []
+        self._current_sources["doctors"] = []
+        self._search_history.clear()
+        self.current_message_idx = 0
+
     def add_message(self, role: str, content: str) -> int:
         """Add a message and return its index"""
         self._messages.append({"role": role, "content": content})
         return len(self._messages) - 1
-    
+
     def add_source(self, results: List[Dict[str, Any]], source_type: str):
         """Add search results"""
         if source_type == "knowledge_base":
             self._current_sources["knowledge_base"] = results
             self._search_history.append((results, datetime.now()))
         else:
-            self._current_sources["doctors"] = results
\ No newline at end of file
+            self._current_sources["doctors"] = results
+
+    def approx_bytes(self) -> int:
+        """Rough size of the conversation: message text plus serialized sources"""
+        size = sum(_message_bytes(msg) for msg in self._messages)
+        for results in self._current_sources.values():
+            size += len(json.dumps(results))
+        for results, _ in self._search_history:
+            size += len(json.dumps(results))
+        return size
+
+    def trim(self, max_bytes: int, keep_last: int = 2) -> int:
+        """
+        Free memory until the state fits in max_bytes.
+
+        The oldest search history goes first, then the content of the oldest
+        messages is dropped. Message dicts stay in place so indexes used by the
+        UI keep pointing at the same messages; the system prompt, the last
+        `keep_last` messages and anything still generating are never touched.
+        Returns the resulting size.
+        """
+        size = self.approx_bytes()
+        while size > max_bytes and self._search_history:
+            results, _ = self._search_history.pop(0)
+            size -= len(json.dumps(results))
+
+        trimmable = range(1 if self._system_prompt else 0, max(len(self._messages) - keep_last, 0))
+        for idx in trimmable:
+            if size <= max_bytes:
+                break
+            msg = self._messages[idx]
+            if msg.get('evicted') or msg.get('generating'):
+                continue
+            before = _message_bytes(msg)
+            kept = {k: msg[k] for k in ('role', 'tool_call_id', 'tool_calls') if k in msg}
+            msg.clear()
+            msg.update(kept, content="", evicted=True)
+            size -= before - _message_bytes(msg)
+        return size
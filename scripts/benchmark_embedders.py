@@ -0,0 +1,94 @@
+"""
+Compare query latency and batch throughput of the remote and local embedders.
+
+    python scripts/benchmark_embedders.py --local BAAI/bge-small-en-v1.5 --quantize
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(PROJECT_ROOT)
+
+from services.embedders import LOCAL_PREFIX, create_embedder
+
+
+QUERIES = [
+    "What is diabetes?",
+    "early symptoms of breast cancer",
+    "how is cataract surgery done",
+    "which doctor treats thyroid problems",
+    "is high blood pressure hereditary",
+    "what causes blurred vision",
+    "diet for type 2 diabetes",
+    "when should I get a mammogram",
+]
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def benchmark(embedder, rounds: int, batch_size: int):
+    embedder.warm_up()
+
+    latencies = []
+    for _ in range(rounds):
+        for query in QUERIES:
+            start = time.perf_counter()
+            embedder.embed_one(query)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    texts = (QUERIES * (batch_size // len(QUERIES) + 1))[:batch_size]
+    batches = [texts[i:i + embedder.max_batch_size] for i in range(0, len(texts), embedder.max_batch_size)]
+    start = time.perf_counter()
+    for batch in batches:
+        embedder.embed(batch)
+    throughput = len(texts) / (time.perf_counter() - start)
+
+    print(
+        f"{embedder.name:<50} query p50 {statistics.median(latencies):7.1f}ms"
+        f"  p95 {percentile(latencies, 0.95):7.1f}ms  batch {throughput:7.1f} texts/s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--local", default="BAAI/bge-small-en-v1.5", help="sentence-transformers model to compare")
+    parser.add_argument("--backend", default="torch", choices=["torch", "onnx"])
+    parser.add_argument("--quantize", action="store_true", help="also benchmark the int8 variant")
+    parser.add_argument("--rounds", type=int, default=5, help="passes over the sample queries")
+    parser.add_argument("--batch", type=int, default=256, help="texts embedded for the throughput run")
+    parser.add_argument("--skip-remote", action="store_true", help="only benchmark local models (offline)")
+    args = parser.parse_args()
+
+    # The configured DashScope model, text-embedding-v3 when a local one is configured
+    remote_model = os.getenv("EMBEDDING_MODEL", "")
+    if remote_model.startswith(LOCAL_PREFIX):
+        remote_model = ""
+
+    embedders = []
+    if not args.skip_remote:
+        embedders.append(lambda: create_embedder(
+            remote_model,
+            api_key=os.getenv("DASHSCOPE_API_KEY", ""),
+            dimension=int(os.getenv("EMBEDDING_DIMENSION", 1024)),
+            base_url=os.getenv("DASHSCOPE_EMBEDDING_BASE_URL", "https://dashscope-intl.aliyuncs.com/api/v1"),
+        ))
+    embedders.append(lambda: create_embedder(LOCAL_PREFIX + args.local, backend=args.backend))
+    if args.quantize:
+        embedders.append(lambda: create_embedder(LOCAL_PREFIX + args.local, backend=args.backend, quantize=True))
+
+    for build in embedders:
+        benchmark(build(), args.rounds, args.batch)
+
+
+if __name__ == "__main__":
+    main()
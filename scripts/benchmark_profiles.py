@@ -0,0 +1,156 @@
+"""
+Measure recall@k, query latency and RAM of each Qdrant collection profile.
+
+Every profile gets a scratch collection on a local Qdrant filled with the
+same vectors; recall is measured against exact (brute force) search. RAM is
+measured as the growth of the resident memory Qdrant reports on /metrics
+while the profile's collection is loaded and queried, next to the
+profile's own estimate. Run it against an otherwise idle Qdrant.
+
+    python scripts/benchmark_profiles.py --points 50000
+    python scripts/benchmark_profiles.py --source knowledge_base_collection
+"""
+import argparse
+import os
+import sys
+import time
+from typing import Optional
+
+import httpx
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(PROJECT_ROOT)
+
+from qdrant_client import QdrantClient
+from qdrant_client.models import PointStruct
+
+from services.qdrant_profiles import PROFILES
+
+
+def synthetic_vectors(count: int, size: int, seed: int = 0) -> np.ndarray:
+    """Clustered random vectors, closer to real embeddings than uniform noise"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(count // 100, 1), size))
+    vectors = centers[rng.integers(len(centers), size=count)] + 0.5 * rng.normal(size=(count, size))
+    return vectors.astype(np.float32)
+
+
+def collection_vectors(client: QdrantClient, collection_name: str) -> np.ndarray:
+    vectors = []
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection_name, limit=1000, offset=offset, with_payload=False, with_vectors=True
+        )
+        vectors.extend(point.vector for point in points)
+        if offset is None:
+            return np.asarray(vectors, dtype=np.float32)
+
+
+def wait_until_indexed(client: QdrantClient, collection_name: str, timeout: float = 600):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        info = client.get_collection(collection_name)
+        if info.status == "green" and (info.indexed_vectors_count or 0) >= (info.points_count or 0):
+            return
+        time.sleep(1)
+    print(f"{collection_name} still indexing after {timeout:.0f}s, measuring anyway")
+
+
+def resident_bytes(url: str) -> Optional[int]:
+    """Resident memory of the Qdrant process from its /metrics, None if not reported"""
+    try:
+        response = httpx.get(f"{url.rstrip('/')}/metrics", timeout=10)
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        print(f"Could not read Qdrant metrics: {e}")
+        return None
+    for line in response.text.splitlines():
+        if line.startswith("memory_resident_bytes "):
+            return int(float(line.split()[1]))
+    return None
+
+
+def benchmark(client: QdrantClient, url: str, profile, data: np.ndarray, queries: np.ndarray, truth: np.ndarray, k: int):
+    collection_name = f"benchmark_{profile.name}"
+    if client.collection_exists(collection_name):
+        client.delete_collection(collection_name)
+    baseline = resident_bytes(url)
+    client.create_collection(collection_name=collection_name, **profile.collection_kwargs(data.shape[1]))
+
+    start = time.perf_counter()
+    client.upload_points(
+        collection_name=collection_name,
+        points=(PointStruct(id=i, vector=vector.tolist()) for i, vector in enumerate(data)),
+        batch_size=256,
+        wait=True,
+    )
+    wait_until_indexed(client, collection_name)
+    build_seconds = time.perf_counter() - start
+
+    latencies = []
+    hits = 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        result = client.query_points(
+            collection_name=collection_name,
+            query=query.tolist(),
+            search_params=profile.search_params(),
+            limit=k,
+            with_payload=False,
+        )
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len({point.id for point in result.points} & set(expected.tolist()))
+
+    loaded = resident_bytes(url)
+    client.delete_collection(collection_name)
+
+    if baseline is not None and loaded is not None:
+        measured = f"{(loaded - baseline) / 2 ** 20:8.1f} MB"
+    else:
+        measured = "     n/a   "
+    estimated_mb = profile.estimated_ram_bytes(len(data), data.shape[1]) / 2 ** 20
+    print(
+        f"{profile.name:<16} recall@{k} {hits / truth.size:6.3f}"
+        f"  p50 {np.percentile(latencies, 50):6.1f}ms  p99 {np.percentile(latencies, 99):6.1f}ms"
+        f"  RAM {measured} measured (estimate {estimated_mb:.1f} MB)  build {build_seconds:6.1f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=os.getenv("QDRANT_URL") or "http://localhost:6333")
+    parser.add_argument("--source", help="copy vectors from this collection instead of generating them")
+    parser.add_argument("--points", type=int, default=20000, help="synthetic vectors to index")
+    parser.add_argument("--dimension", type=int, default=int(os.getenv("EMBEDDING_DIMENSION", 1024)))
+    parser.add_argument("--queries", type=int, default=200, help="held-out query vectors")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--profiles", default=",".join(PROFILES), help="comma separated profile names")
+    args = parser.parse_args()
+
+    client = QdrantClient(url=args.url, timeout=120)
+
+    if args.source:
+        vectors = collection_vectors(client, args.source)
+    else:
+        vectors = synthetic_vectors(args.points + args.queries, args.dimension)
+    rng = np.random.default_rng(1)
+    rng.shuffle(vectors)
+    queries, data = vectors[:args.queries], vectors[args.queries:]
+
+    # Exact cosine neighbours for recall
+    normalized = data / np.linalg.norm(data, axis=1, keepdims=True)
+    scores = (queries / np.linalg.norm(queries, axis=1, keepdims=True)) @ normalized.T
+    truth = np.argsort(-scores, axis=1)[:, :args.k]
+
+    print(f"{len(data)} vectors of {data.shape[1]} dimensions, {len(queries)} queries")
+    for name in args.profiles.split(","):
+        benchmark(client, args.url, PROFILES[name.strip()], data, queries, truth, args.k)
+
+
+if __name__ == "__main__":
+    main()
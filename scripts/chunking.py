@@ -0,0 +1,56 @@
+import re
+from dataclasses import dataclass
+from typing import List, Tuple
+
+import tiktoken
+
+
+@dataclass
+class Passage:
+    index: int
+    # Character offsets into the cleaned article text
+    start: int
+    end: int
+    text: str
+
+
+class Chunker:
+    """
+    Splits text into token-bounded passages that overlap by a few tokens, so
+    a sentence cut at a boundary is still whole in one of the two passages.
+    """
+
+    def __init__(self, max_tokens: int = 256, overlap: int = 32, encoding_name: str = "cl100k_base"):
+        if not 0 <= overlap < max_tokens:
+            raise ValueError("overlap must be smaller than max_tokens")
+        self.max_tokens = max_tokens
+        self.overlap = overlap
+        try:
+            self._encoding = tiktoken.get_encoding(encoding_name)
+        except Exception as e:
+            # tiktoken downloads encodings on first use; fall back to words offline
+            print(f"Could not load tiktoken encoding {encoding_name} ({e}), chunking by words")
+            self._encoding = None
+
+    def _token_spans(self, text: str) -> List[Tuple[int, int]]:
+        """Character span of every token"""
+        if self._encoding is None:
+            return [m.span() for m in re.finditer(r"\S+\s*", text)]
+        tokens = self._encoding.encode(text, disallowed_special=())
+        _, starts = self._encoding.decode_with_offsets(tokens)
+        ends = starts[1:] + [len(text)]
+        return list(zip(starts, ends))
+
+    def split(self, text: str) -> List[Passage]:
+        spans = self._token_spans(text)
+        passages = []
+        step = self.max_tokens - self.overlap
+        for first in range(0, len(spans), step):
+            window = spans[first:first + self.max_tokens]
+            start, end = window[0][0], window[-1][1]
+            passage = text[start:end].strip()
+            if passage:
+                passages.append(Passage(index=len(passages), start=start, end=end, text=passage))
+            if first + self.max_tokens >= len(spans):
+                break
+        return passages
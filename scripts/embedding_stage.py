@@ -0,0 +1,60 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from services.embedders import Embedder, EmbeddingError
+
+DEFAULT_MAX_RETRIES = 3
+
+
+def _embed_with_retry(texts: List[str], embedder: Embedder, max_retries: int, backoff: float):
+    for attempt in range(max_retries + 1):
+        try:
+            return embedder.embed(texts)
+        except Exception as e:
+            if attempt == max_retries:
+                raise EmbeddingError(f"Batch of {len(texts)} failed after {max_retries + 1} attempts: {e}") from e
+            delay = backoff * 2 ** attempt
+            print(f"Embedding batch failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def embed_texts(
+    texts: List[str],
+    embedder: Embedder,
+    batch_size: Optional[int] = None,
+    max_concurrency: Optional[int] = None,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    backoff: float = 1.0,
+) -> List[List[float]]:
+    """
+    Embed texts in multi-input batches with a bounded number of batches in flight.
+
+    Args:
+        texts: texts to embed.
+        embedder: remote or local embedding backend.
+        batch_size: inputs per batch, the embedder's maximum by default.
+        max_concurrency: batches embedded at the same time, the embedder's
+            preference by default (a local model already uses every core).
+        max_retries: retries per batch before giving up.
+    Returns:
+        One vector per input text, in input order.
+    Raises:
+        EmbeddingError: if any batch fails after all retries, so no missing
+        vector is ever written to a collection.
+    """
+    batch_size = batch_size or embedder.max_batch_size
+    max_concurrency = max_concurrency or embedder.max_concurrency
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        results = pool.map(
+            lambda batch: _embed_with_retry(batch, embedder, max_retries, backoff),
+            batches
+        )
+        vectors = [vector for batch_vectors in results for vector in batch_vectors]
+
+    elapsed = time.perf_counter() - start
+    print(f"Embedded {len(texts)} texts in {len(batches)} batches in {elapsed:.1f}s")
+    return vectors
@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+import uuid
+from typing import Dict, Iterable, List
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+MANIFEST_DIR = os.getenv("INGEST_MANIFEST_DIR", os.path.join(PROJECT_ROOT, ".cache", "manifests"))
+
+
+def stable_point_id(source_key: str) -> str:
+    """Point ID derived from the item's source (e.g. its link), stable across feed reorderings"""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, source_key))
+
+
+def content_hash(*parts) -> str:
+    """Hash of everything that ends up in a point's vector or payload"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(json.dumps(part, sort_keys=True, default=str).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class Manifest:
+    """
+    Content hash of every point in a collection, as of the last committed batch.
+
+    An ingestion run only embeds items whose hash changed, and deletes points
+    whose items are gone from the source. Saved after every batch, it also
+    lets an interrupted run resume without redoing committed work.
+    """
+
+    def __init__(self, collection_name: str, directory: str = MANIFEST_DIR):
+        self.path = os.path.join(directory, f"{collection_name}.json")
+        self.exists = os.path.exists(self.path)
+        self.hashes: Dict[str, str] = {}
+        if self.exists:
+            with open(self.path) as f:
+                self.hashes = json.load(f)
+
+    def is_current(self, point_id: str, digest: str) -> bool:
+        return self.hashes.get(point_id) == digest
+
+    def update(self, point_id: str, digest: str):
+        self.hashes[point_id] = digest
+
+    def reset(self):
+        """Forget every hash, e.g. when the collection was (re)created empty, so all items are embedded again"""
+        self.hashes = {}
+
+    def adopt(self, point_ids: Iterable):
+        """Track points that predate the manifest; they are deleted unless the source still has them"""
+        for point_id in point_ids:
+            self.hashes.setdefault(str(point_id), "")
+
+    def stale_ids(self, seen_ids: Iterable[str]) -> List[str]:
+        seen = set(seen_ids)
+        return [point_id for point_id in self.hashes if point_id not in seen]
+
+    def remove(self, point_ids: Iterable[str]):
+        for point_id in point_ids:
+            self.hashes.pop(point_id, None)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.hashes, f)
+        os.replace(tmp_path, self.path)
+        self.exists = True
+
+
+def existing_point_ids(client, collection_name: str, parent_key: str = "") -> List:
+    """
+    IDs of every point already in a collection.
+
+    With `parent_key`, a point carrying that payload field stands for its
+    parent item (e.g. a passage for its article) and the parent's ID is
+    returned once instead; points without it are returned by their own ID.
+    """
+    point_ids = {}
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection_name, limit=1000, offset=offset,
+            with_payload=[parent_key] if parent_key else False, with_vectors=False
+        )
+        for point in points:
+            parent_id = (point.payload or {}).get(parent_key) if parent_key else None
+            point_ids.setdefault(parent_id if parent_id is not None else point.id, None)
+        if offset is None:
+            return list(point_ids)
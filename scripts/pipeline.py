@@ -0,0 +1,93 @@
+import json
+import re
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator
+
+
+def iter_json_array(path: str, key: str, chunk_size: int = 1 << 16) -> Iterator[Any]:
+    """
+    Stream the elements of the first `"key": [...]` array in a JSON file.
+
+    Only the element being decoded is held in memory, so feeds far larger
+    than RAM can be processed one item at a time.
+    """
+    decoder = json.JSONDecoder()
+    start = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+
+    with open(path, "r", encoding="utf-8") as f:
+        buf = ""
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            buf += chunk
+            match = start.search(buf)
+            if match:
+                buf = buf[match.end():]
+                break
+            # Keep a tail in case the key is split across two chunks
+            buf = buf[-(len(key) + 64):]
+
+        eof = False
+        while True:
+            buf = buf.lstrip(" \t\r\n,")
+            if buf.startswith("]"):
+                return
+            if buf:
+                try:
+                    item, end = decoder.raw_decode(buf)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                else:
+                    yield item
+                    buf = buf[end:]
+                    continue
+            chunk = f.read(chunk_size)
+            if not chunk:
+                if eof or not buf:
+                    return
+                eof = True
+            buf += chunk
+
+
+class StageStats:
+    """Items processed and time spent per pipeline stage"""
+
+    def __init__(self):
+        self.items: Dict[str, int] = {}
+        self.seconds: Dict[str, float] = {}
+
+    def record(self, stage: str, seconds: float, items: int = 1):
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+        self.items[stage] = self.items.get(stage, 0) + items
+
+    @contextmanager
+    def track(self, stage: str, items: int = 1):
+        """Time the work done inside the block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start, items)
+
+    def iterate(self, stage: str, iterable: Iterable) -> Iterator:
+        """Pass items through, timing how long producing each one took"""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.record(stage, time.perf_counter() - start)
+            yield item
+
+    def report(self) -> str:
+        lines = []
+        for stage, count in self.items.items():
+            seconds = self.seconds[stage]
+            rate = count / seconds if seconds else float("inf")
+            lines.append(f"{stage:>8}: {count} items in {seconds:.2f}s ({rate:.1f} items/s)")
+        return "\n".join(lines)
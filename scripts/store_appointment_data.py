@@ -1,10 +1,10 @@
 from qdrant_client import QdrantClient
-from qdrant_client.models import VectorParams, Distance, PointStruct
+from qdrant_client.models import (
+    PointStruct, PointIdsList, PayloadSchemaType, TextIndexParams, TextIndexType, TokenizerType
+)
 import os
 from dotenv import load_dotenv
 from typing import Dict, List
-import dashscope
-from http import HTTPStatus
 import sys
 
 load_dotenv()
@@ -27,25 +27,49 @@ except ModuleNotFoundError:
             "DASHSCOPE_HTTP_BASE_URL", "https://dashscope-intl.aliyuncs.com/api/v1"
         )
         QDRANT_URL: str = os.getenv("QDRANT_URL", "http://localhost:6333")
+        QDRANT_PROFILE: str = os.getenv("QDRANT_PROFILE", "default")
+        QDRANT_HNSW_M: int = int(os.getenv("QDRANT_HNSW_M", 0))
+        QDRANT_HNSW_EF_CONSTRUCT: int = int(os.getenv("QDRANT_HNSW_EF_CONSTRUCT", 0))
         NVIDIA_API_KEY: str = os.getenv("NVIDIA_API_KEY", "")
         NVIDIA_BASE_URL: str = os.getenv("NVIDIA_BASE_URL", "")
         NVIDIA_EMB_MODEL: str = os.getenv("NVIDIA_EMB_MODEL", "")
+        EMBEDDING_DIMENSION: int = int(os.getenv("EMBEDDING_DIMENSION", 1024))
+        EMBEDDING_MODEL: str = os.getenv("EMBEDDING_MODEL", "")
+        EMBEDDING_BACKEND: str = os.getenv("EMBEDDING_BACKEND", "torch")
+        EMBEDDING_QUANTIZE: bool = os.getenv("EMBEDDING_QUANTIZE", "False").lower() == "true"
+        EMBEDDING_ONNX_FILE: str = os.getenv("EMBEDDING_ONNX_FILE", "")
+        EMBEDDING_BATCH_SIZE: int = int(os.getenv("EMBEDDING_BATCH_SIZE", 32))
+        DASHSCOPE_EMBEDDING_BASE_URL: str = os.getenv(
+            "DASHSCOPE_EMBEDDING_BASE_URL", "https://dashscope-intl.aliyuncs.com/api/v1"
+        )
 
     settings = Settings()
 
-dashscope.base_http_api_url = "https://dashscope-intl.aliyuncs.com/api/v1"
+from scripts.embedding_stage import embed_texts
+from services.embedders import create_embedder
+from services.qdrant_profiles import get_profile
+from scripts.manifest import Manifest, stable_point_id, content_hash, existing_point_ids
+from services.collection_versions import bump_version
 
 
-def embed_with_str(input):
-    resp = dashscope.TextEmbedding.call(
-        model=dashscope.TextEmbedding.Models.text_embedding_v3,
-        api_key=settings.DASHSCOPE_API_KEY,
-        input=input,
-    )
-    if resp.status_code == HTTPStatus.OK:
-        return resp.output["embeddings"][0]["embedding"]
-    else:
-        print(resp)
+
+embedder = create_embedder(
+    settings.EMBEDDING_MODEL,
+    api_key=settings.DASHSCOPE_API_KEY,
+    dimension=settings.EMBEDDING_DIMENSION,
+    backend=settings.EMBEDDING_BACKEND,
+    quantize=settings.EMBEDDING_QUANTIZE,
+    onnx_file=settings.EMBEDDING_ONNX_FILE,
+    batch_size=settings.EMBEDDING_BATCH_SIZE,
+    base_url=settings.DASHSCOPE_EMBEDDING_BASE_URL,
+)
+
+# Search-time parameters of the profile are applied by services.search_service
+profile = get_profile(
+    settings.QDRANT_PROFILE,
+    hnsw_m=settings.QDRANT_HNSW_M,
+    hnsw_ef_construct=settings.QDRANT_HNSW_EF_CONSTRUCT,
+)
 
 
 data: Dict[str, List[str | bool]] = {
@@ -69,40 +93,93 @@ data: Dict[str, List[str | bool]] = {
 }
 
 
+COLLECTION_NAME = "doctor_collection"
+
 client = QdrantClient(url="http://localhost:6333")
+manifest = Manifest(COLLECTION_NAME)
 
-is_collection = client.collection_exists(collection_name="doctor_collection")
+is_collection = client.collection_exists(collection_name=COLLECTION_NAME)
 
 if not is_collection:
     client.create_collection(
-        collection_name="doctor_collection",
-        vectors_config=VectorParams(size=1024, distance=Distance.COSINE),
+        collection_name=COLLECTION_NAME,
+        **profile.collection_kwargs(embedder.dimension),
     )
-
-operation_info = client.upsert(
-    collection_name="doctor_collection",
-    points=[
-        PointStruct(
-            id=idx,
-            vector=embed_with_str(data["doctor_description"][idx]),
-            payload={
-                "doctor_name": data["doctor_name"][idx],
-                "doctor_field": data["doctor_field"][idx],
-                "doctor_description": data["doctor_description"][idx],
-                "availability": data["availability"][idx],
-                "appointment_link": data["appointment_link"][idx],
-            },
-        )
-        for idx in range(len(data["doctor_description"]))
-    ],
-    wait=True,
+    # A manifest left from a dropped or wiped collection describes points that are gone
+    manifest.reset()
+elif not manifest.exists:
+    # Points written before the manifest existed used positional IDs
+    manifest.adopt(existing_point_ids(client, COLLECTION_NAME))
+
+# Indexed so search_doctors filters are applied inside the vector search
+client.create_payload_index(
+    collection_name=COLLECTION_NAME, field_name="availability", field_schema=PayloadSchemaType.BOOL
+)
+client.create_payload_index(
+    collection_name=COLLECTION_NAME,
+    field_name="doctor_field",
+    field_schema=TextIndexParams(type=TextIndexType.TEXT, tokenizer=TokenizerType.WORD, lowercase=True),
 )
 
-print(operation_info)
+doctors = [
+    {
+        "id": stable_point_id(data["appointment_link"][idx]),
+        "payload": {
+            "doctor_name": data["doctor_name"][idx],
+            "doctor_field": data["doctor_field"][idx],
+            "doctor_description": data["doctor_description"][idx],
+            "availability": data["availability"][idx],
+            "appointment_link": data["appointment_link"][idx],
+        },
+    }
+    for idx in range(len(data["doctor_description"]))
+]
+for doctor in doctors:
+    # Re-embed everything when the embedding model changes
+    doctor["hash"] = content_hash(doctor["payload"], embedder.name)
+
+# Only new or changed doctors are embedded and written
+changed = [d for d in doctors if not manifest.is_current(d["id"], d["hash"])]
+
+if changed:
+    vectors = embed_texts([d["payload"]["doctor_description"] for d in changed], embedder)
+
+    operation_info = client.upsert(
+        collection_name=COLLECTION_NAME,
+        points=[
+            PointStruct(id=d["id"], vector=vector, payload=d["payload"])
+            for d, vector in zip(changed, vectors)
+        ],
+        wait=True,
+    )
+    print(operation_info)
+    # Invalidates answers cached against the previous contents; before the
+    # manifest is saved, so a crash in between still bumps on the rerun
+    bump_version(COLLECTION_NAME)
+
+    for d in changed:
+        manifest.update(d["id"], d["hash"])
+    manifest.save()
+
+stale_ids = manifest.stale_ids(d["id"] for d in doctors)
+if stale_ids:
+    client.delete(
+        collection_name=COLLECTION_NAME,
+        points_selector=PointIdsList(points=[int(i) if i.isdigit() else i for i in stale_ids]),
+        wait=True,
+    )
+    bump_version(COLLECTION_NAME)
+    manifest.remove(stale_ids)
+    manifest.save()
+
+print(
+    f"{len(doctors)} doctors: {len(changed)} upserted, {len(stale_ids)} deleted, "
+    f"{len(doctors) - len(changed)} unchanged"
+)
 
 results = client.query_points(
-    collection_name="doctor_collection",
-    query=embed_with_str("diabetes doctor"),
+    collection_name=COLLECTION_NAME,
+    query=embedder.embed_one("diabetes doctor"),
     with_payload=True,
     limit=3,
     score_threshold=0.5,
@@ -1,11 +1,12 @@
 import os
 from qdrant_client import QdrantClient
-from qdrant_client.models import VectorParams, Distance, PointStruct
+from qdrant_client.models import (
+    PointStruct, PayloadSchemaType,
+    Filter, FilterSelector, FieldCondition, HasIdCondition, MatchAny
+)
 from dotenv import load_dotenv
-import json
+from itertools import batched
 from bs4 import BeautifulSoup
-import dashscope
-from http import HTTPStatus
 import sys
 
 load_dotenv()
@@ -26,28 +27,58 @@ except ModuleNotFoundError:
         DASHSCOPE_API_KEY: str = os.getenv("DASHSCOPE_API_KEY", "")
         DASHSCOPE_HTTP_BASE_URL: str = os.getenv("DASHSCOPE_HTTP_BASE_URL", "https://dashscope-intl.aliyuncs.com/api/v1")
         QDRANT_URL: str = os.getenv("QDRANT_URL", "http://localhost:6333")
+        QDRANT_PROFILE: str = os.getenv("QDRANT_PROFILE", "default")
+        QDRANT_HNSW_M: int = int(os.getenv("QDRANT_HNSW_M", 0))
+        QDRANT_HNSW_EF_CONSTRUCT: int = int(os.getenv("QDRANT_HNSW_EF_CONSTRUCT", 0))
         NVIDIA_API_KEY: str = os.getenv("NVIDIA_API_KEY", "")
         NVIDIA_BASE_URL: str = os.getenv("NVIDIA_BASE_URL", "")
         NVIDIA_EMB_MODEL: str = os.getenv("NVIDIA_EMB_MODEL", "")
+        EMBEDDING_DIMENSION: int = int(os.getenv("EMBEDDING_DIMENSION", 1024))
+        EMBEDDING_MODEL: str = os.getenv("EMBEDDING_MODEL", "")
+        EMBEDDING_BACKEND: str = os.getenv("EMBEDDING_BACKEND", "torch")
+        EMBEDDING_QUANTIZE: bool = os.getenv("EMBEDDING_QUANTIZE", "False").lower() == "true"
+        EMBEDDING_ONNX_FILE: str = os.getenv("EMBEDDING_ONNX_FILE", "")
+        EMBEDDING_BATCH_SIZE: int = int(os.getenv("EMBEDDING_BATCH_SIZE", 32))
+        DASHSCOPE_EMBEDDING_BASE_URL: str = os.getenv(
+            "DASHSCOPE_EMBEDDING_BASE_URL", "https://dashscope-intl.aliyuncs.com/api/v1"
+        )
+        KB_CHUNK_TOKENS: int = int(os.getenv("KB_CHUNK_TOKENS", 256))
+        KB_CHUNK_OVERLAP: int = int(os.getenv("KB_CHUNK_OVERLAP", 32))
 
     settings = Settings()
 
-dashscope.base_http_api_url = 'https://dashscope-intl.aliyuncs.com/api/v1'
+from scripts.chunking import Chunker
+from scripts.embedding_stage import embed_texts
+from services.embedders import create_embedder
+from services.qdrant_profiles import get_profile
+from scripts.pipeline import iter_json_array, StageStats
+from scripts.manifest import Manifest, stable_point_id, content_hash, existing_point_ids
+from services.collection_versions import bump_version
 
-def embed_with_str(input):
-    resp = dashscope.TextEmbedding.call(
-        model=dashscope.TextEmbedding.Models.text_embedding_v3,
-        api_key=settings.DASHSCOPE_API_KEY,
-        input=input
-    )
-    if resp.status_code == HTTPStatus.OK:
-        return resp.output['embeddings'][0]['embedding']
-    else:
-        print(resp)
 
-# Load JSON data from file
-with open("./data.json", "r") as file:
-    data = json.load(file)
+embedder = create_embedder(
+    settings.EMBEDDING_MODEL,
+    api_key=settings.DASHSCOPE_API_KEY,
+    dimension=settings.EMBEDDING_DIMENSION,
+    backend=settings.EMBEDDING_BACKEND,
+    quantize=settings.EMBEDDING_QUANTIZE,
+    onnx_file=settings.EMBEDDING_ONNX_FILE,
+    batch_size=settings.EMBEDDING_BATCH_SIZE,
+    base_url=settings.DASHSCOPE_EMBEDDING_BASE_URL,
+)
+
+# Search-time parameters of the profile are applied by services.search_service
+profile = get_profile(
+    settings.QDRANT_PROFILE,
+    hnsw_m=settings.QDRANT_HNSW_M,
+    hnsw_ef_construct=settings.QDRANT_HNSW_EF_CONSTRUCT,
+)
+
+COLLECTION_NAME = "knowledge_base_collection"
+DATA_PATH = os.getenv("KNOWLEDGE_BASE_DATA", "./data.json")
+UPSERT_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 100))
+
+chunker = Chunker(settings.KB_CHUNK_TOKENS, settings.KB_CHUNK_OVERLAP)
 
 
 # Function to clean HTML tags
@@ -56,69 +87,185 @@ def clean_html(html_content):
     return soup.get_text()
 
 
-articles = []
-metadatas = []
-# Iterate over items and extract title and clean content
-items = data["rss"]["channel"]["item"]
-for item in items:
+def read_item(item):
+    """Extract title, link and raw HTML content from one RSS item"""
     # Handle title
-    if item != "":
-        title = item.get("title", "")
-        link = item.get("link", "")
-        if isinstance(title, dict):
-            title = title.get("__cdata", title)
-
-        # Handle encoded content
-        content = item.get("encoded", "")
-        if isinstance(content, list):
-            content = content[
-                0
-            ]  # Assuming we are interested in the first item if it's a list
-        if isinstance(content, dict):
-            content = content.get("__cdata", content)
-
-        # Clean the content
-        clean_content = clean_html(content)
-        full_article = f"Title: {title}\nContent: {clean_content}"
-        metadata = {"title": title, "link": link, "content": clean_content}
-
-        # Append to the list
-        articles.append(full_article)
-        metadatas.append(metadata)
-        # Print the results
-
-len(articles)
-
-client = QdrantClient(url="http://localhost:6333")
-
-is_collection = client.collection_exists(collection_name="knowledge_base_collection")
-
-if not is_collection:
-    client.create_collection(
-        collection_name="knowledge_base_collection",
-        vectors_config=VectorParams(size=1024, distance=Distance.COSINE)
+    title = item.get("title", "")
+    link = item.get("link", "")
+    if isinstance(title, dict):
+        title = title.get("__cdata", title)
+
+    # Handle encoded content
+    content = item.get("encoded", "")
+    if isinstance(content, list):
+        content = content[
+            0
+        ]  # Assuming we are interested in the first item if it's a list
+    if isinstance(content, dict):
+        content = content.get("__cdata", content)
+
+    return {
+        "id": stable_point_id(link or title),
+        # Chunking parameters and the model are part of the hash so changing them re-indexes everything
+        "hash": content_hash(title, link, content, chunker.max_tokens, chunker.overlap, embedder.name),
+        "title": title,
+        "link": link,
+        "html": content,
+    }
+
+
+def clean_item(item):
+    """Clean the HTML content of an item read by read_item and split it into passages"""
+    clean_content = clean_html(item["html"])
+    return {
+        **item,
+        "content": clean_content,
+        "passages": chunker.split(clean_content),
+    }
+
+
+def passage_points(item, vectors):
+    """One point per passage; the payload holds the passage, not the whole article"""
+    return [
+        PointStruct(
+            id=stable_point_id(f"{item['link'] or item['title']}#{passage.index}"),
+            vector=vector,
+            payload={
+                "parent_id": item["id"],
+                "chunk_index": passage.index,
+                "char_start": passage.start,
+                "char_end": passage.end,
+                "title": item["title"],
+                "source_link": item["link"],
+                "text": passage.text,
+            },
+        )
+        for passage, vector in zip(item["passages"], vectors)
+    ]
+
+
+def _point_ids(ids):
+    # Points from before the manifest may have integer IDs
+    return [int(i) if isinstance(i, str) and i.isdigit() else i for i in ids]
+
+
+def delete_articles(client, article_ids, keep_ids=()):
+    """
+    Delete the points of the given articles, except `keep_ids`.
+
+    Covers both passage points (matched by parent_id) and whole-article
+    points written before the index was chunked (matched by ID).
+    """
+    passages = Filter(must=[FieldCondition(key="parent_id", match=MatchAny(any=list(article_ids)))])
+    if keep_ids:
+        passages.must_not = [HasIdCondition(has_id=list(keep_ids))]
+    client.delete(
+        collection_name=COLLECTION_NAME,
+        points_selector=FilterSelector(filter=Filter(should=[
+            HasIdCondition(has_id=_point_ids(article_ids)),
+            passages,
+        ])),
+        wait=True
     )
 
-operation_info = client.upsert(
-    collection_name="knowledge_base_collection",
-    points=[
-        PointStruct(id=idx, vector=embed_with_str(articles[idx]), payload={
-            "title": metadatas[idx]["title"], "source_link": metadatas[idx]["link"],
-            "content": metadatas[idx]["content"]
-        }) for idx in range(len(articles))
-    ],
-    wait=True
-)
 
+def main():
+    """
+    parse -> diff -> clean/chunk -> embed -> upsert, one batch at a time.
 
-print(operation_info)
+    Items are streamed from the feed, so memory stays bounded by the batch
+    size. Point IDs come from the item link and the manifest records a hash
+    of each item's content, so only new or changed items are cleaned and
+    embedded, and points whose items left the feed are deleted. The manifest
+    is saved after every upserted batch, so a restarted run skips the work
+    that was already committed. The collection version is bumped with every
+    batch, invalidating answers and cards cached against the old contents.
+    """
+    stats = StageStats()
+    manifest = Manifest(COLLECTION_NAME)
+
+    client = QdrantClient(url="http://localhost:6333")
+
+    is_collection = client.collection_exists(collection_name=COLLECTION_NAME)
+
+    if not is_collection:
+        client.create_collection(
+            collection_name=COLLECTION_NAME,
+            **profile.collection_kwargs(embedder.dimension)
+        )
+        # A manifest left from a dropped or wiped collection describes points that are gone
+        manifest.reset()
+    elif not manifest.exists:
+        # Articles written before the manifest existed: passages by their parent_id,
+        # whole-article points (e.g. positional IDs) by their own ID
+        manifest.adopt(existing_point_ids(client, COLLECTION_NAME, parent_key="parent_id"))
+
+    # Passages are grouped and replaced by parent article
+    client.create_payload_index(
+        collection_name=COLLECTION_NAME, field_name="parent_id", field_schema=PayloadSchemaType.KEYWORD
+    )
+
+    seen_ids = set()
+
+    def changed_items():
+        for raw in stats.iterate("parse", iter_json_array(DATA_PATH, "item")):
+            if raw == "":
+                continue
+            item = read_item(raw)
+            seen_ids.add(item["id"])
+            if not manifest.is_current(item["id"], item["hash"]):
+                yield item
+
+    changed = 0
+    for batch in batched(changed_items(), UPSERT_BATCH_SIZE):
+        with stats.track("clean", len(batch)):
+            cleaned = [clean_item(item) for item in batch]
+
+        texts = [f"Title: {c['title']}\n{p.text}" for c in cleaned for p in c["passages"]]
+        with stats.track("embed", len(texts)):
+            vectors = embed_texts(texts, embedder)
+
+        points = []
+        for c in cleaned:
+            count = len(c["passages"])
+            points.extend(passage_points(c, vectors[:count]))
+            vectors = vectors[count:]
+
+        with stats.track("upsert", len(points)):
+            client.upsert(collection_name=COLLECTION_NAME, points=points, wait=True)
+            # Drop passages the new versions of these articles no longer have
+            delete_articles(client, [c["id"] for c in cleaned], keep_ids=[p.id for p in points])
+        # Before the manifest is saved, so a crash in between still bumps on the rerun
+        bump_version(COLLECTION_NAME)
+
+        for c in cleaned:
+            manifest.update(c["id"], c["hash"])
+        manifest.save()
+        changed += len(batch)
+        print(f"Committed {changed} new or changed items")
+
+    stale_ids = manifest.stale_ids(seen_ids)
+    if stale_ids:
+        with stats.track("delete", len(stale_ids)):
+            delete_articles(client, stale_ids)
+        bump_version(COLLECTION_NAME)
+        manifest.remove(stale_ids)
+        manifest.save()
+
+    print(f"{len(seen_ids)} items in feed: {changed} upserted, {len(stale_ids)} deleted, "
+          f"{len(seen_ids) - changed} unchanged")
+    print(stats.report())
+
+    results = client.query_points(
+        collection_name=COLLECTION_NAME,
+        query=embedder.embed_one("diabetes definition"),
+        with_payload=True,
+        limit=3,
+        score_threshold=0.5,
+    )
+
+    print(results.points)
 
-results = client.query_points(
-    collection_name="knowledge_base_collection",
-    query=embed_with_str("diabetes definition"),
-    with_payload=True,
-    limit=3,
-    score_threshold=0.5,
-)
 
-print(results.points)
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 from openai import OpenAI
 from typing import List, Dict, Any
 from config.settings import settings
+from services.context_builder import context_builder
+from services.tracing import span
 
 # Tool definitions
 tools = [
@@ -32,7 +34,15 @@ tools = [
                     "query": {
                         "type": "string",
                         "description": "The query submitted by the user.",
-                    }
+                    },
+                    "specialization": {
+                        "type": "string",
+                        "description": "Only doctors in this medical field, e.g. Endocrinology. Omit if the user did not ask for one.",
+                    },
+                    "available_only": {
+                        "type": "boolean",
+                        "description": "Only doctors currently taking appointments.",
+                    },
                 },
             },
             "required": ["query"],
@@ -49,12 +59,14 @@ class AIService:
 
     def get_response(self, messages: List[Dict[str, Any]], stream: bool = False):
         """Get response from the AI model"""
-        completion = self.client.chat.completions.create(
-            model=settings.QWEN_MODEL,
-            messages=messages,
-            tools=tools,
-            stream=stream
-        )
+        # For streams this only covers the request; the caller times the tokens
+        with span("completion", model=settings.QWEN_MODEL, stream=stream):
+            completion = self.client.chat.completions.create(
+                model=settings.QWEN_MODEL,
+                messages=messages,
+                tools=tools,
+                stream=stream
+            )
         if stream:
             return completion
         return completion.model_dump()
@@ -73,8 +85,8 @@ class AIService:
         # Add current message
         messages.append({"content": message, "role": "user"})
         
-        # Get initial response
-        first_response = self.get_response(messages, stream=False)
+        # Get initial response, with history fitted into the token budget
+        first_response = self.get_response(context_builder.build(messages), stream=False)
         return first_response['choices'][0]['message']
 
 ai_service = AIService()
\ No newline at end of file
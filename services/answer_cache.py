@@ -0,0 +1,130 @@
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+from config.settings import settings
+from services.collection_versions import get_versions
+from services.tracing import registry
+from services.search_service import KNOWLEDGE_BASE_COLLECTION, DOCTOR_COLLECTION
+
+
+@dataclass
+class CachedAnswer:
+    query: str
+    answer: str
+    # Whatever the caller needs to redraw the sources panel
+    sources: Dict[str, Any] = field(default_factory=dict)
+    suggestions: List[str] = field(default_factory=list)
+    collection_versions: Dict[str, int] = field(default_factory=dict)
+    created_at: float = field(default_factory=time.monotonic)
+
+
+class SemanticAnswerCache:
+    """
+    Final answers to single-turn questions, looked up by query embedding.
+
+    A lookup returns the closest earlier question whose cosine similarity is
+    at least `threshold`. Entries remember the versions of the collections
+    they were answered from and are dropped once any of them is re-ingested.
+    """
+
+    def __init__(self, collections: List[str], threshold: float = 0.95, max_entries: int = 1000, ttl: float = 86400):
+        self.collections = collections
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: List[CachedAnswer] = []
+        self._vectors: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def versions(self) -> Dict[str, int]:
+        """Snapshot of the collection versions; take it before answering and pass it to store()"""
+        current = get_versions()
+        return {name: current.get(name, 0) for name in self.collections}
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        return v / norm if norm else v
+
+    def _drop_stale(self):
+        versions = self.versions()
+        now = time.monotonic()
+        keep = [
+            i for i, entry in enumerate(self._entries)
+            if entry.collection_versions == versions and now - entry.created_at <= self.ttl
+        ]
+        if len(keep) != len(self._entries):
+            self._entries = [self._entries[i] for i in keep]
+            self._vectors = self._vectors[keep] if keep else None
+
+    def lookup(self, vector) -> Optional[CachedAnswer]:
+        """Return the cached answer for the most similar earlier question, if close enough"""
+        if vector is None:
+            return None
+        query = self._normalize(vector)
+        with self._lock:
+            self._drop_stale()
+            if self._vectors is not None:
+                scores = self._vectors @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self.hits += 1
+                    return self._entries[best]
+            self.misses += 1
+            return None
+
+    def store(self, query: str, vector, answer: str, versions: Dict[str, int], **kwargs):
+        """Remember the final answer to a single-turn question"""
+        if vector is None or not answer:
+            return
+        row = self._normalize(vector)[None, :]
+        entry = CachedAnswer(query=query, answer=answer, collection_versions=versions, **kwargs)
+        with self._lock:
+            self._entries.append(entry)
+            self._vectors = row if self._vectors is None else np.vstack([self._vectors, row])
+            if len(self._entries) > self.max_entries:
+                self._entries = self._entries[-self.max_entries:]
+                self._vectors = self._vectors[-self.max_entries:]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "entries": len(self._entries),
+            }
+
+    def register_metrics(self, registry):
+        """Export stats() on /metrics (see services.tracing)"""
+        registry.counter(
+            "chat_answer_cache_lookups_total", "Semantic answer cache lookups", labels=("result",),
+            collect=lambda: {(result,): self.stats()[key] for result, key in (("hit", "hits"), ("miss", "misses"))}
+        )
+        registry.gauge(
+            "chat_answer_cache_entries", "Answers held by the semantic answer cache",
+            collect=lambda: {(): self.stats()["entries"]}
+        )
+
+
+def is_single_turn(messages: List[Dict[str, Any]]) -> bool:
+    """True when the last message is the conversation's only user message"""
+    user_messages = [m for m in messages if m['role'] == 'user']
+    return len(user_messages) == 1 and messages[-1]['role'] == 'user'
+
+
+answer_cache = SemanticAnswerCache(
+    [KNOWLEDGE_BASE_COLLECTION, DOCTOR_COLLECTION],
+    threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+    max_entries=settings.SEMANTIC_CACHE_SIZE,
+    ttl=settings.SEMANTIC_CACHE_TTL
+)
+answer_cache.register_metrics(registry)
@@ -0,0 +1,129 @@
+from typing import List, Dict, Any, Optional
+from qdrant_client import AsyncQdrantClient
+from config.settings import settings
+from services.embedders import EmbeddingError
+from services.tracing import span
+from services.search_service import (
+    embedding_cache,
+    embedder,
+    embedded_indexes,
+    qdrant_profile,
+    embed_flights,
+    knowledge_base_flights,
+    doctor_flights,
+    embedding_key,
+    knowledge_base_key,
+    doctor_key,
+    doctor_filter,
+    format_knowledge_results,
+    format_doctor_results,
+    KNOWLEDGE_BASE_COLLECTION,
+    DOCTOR_COLLECTION,
+    SEARCH_LIMIT,
+    KNOWLEDGE_BASE_SCORE_THRESHOLD,
+    DOCTOR_SCORE_THRESHOLD,
+)
+
+
+# Async counterparts of services.search_service for the event-loop handlers.
+# Results and the embedding cache are shared with the sync API.
+client = AsyncQdrantClient(url=settings.QDRANT_URL)
+
+
+async def _aembed(query: str):
+    with span("embed", embedder=embedder.name):
+        return (await embedder.aembed([query]))[0]
+
+
+async def aembed_with_str(query: str):
+    """Embed a query without blocking the event loop"""
+    if embedding_cache is not None:
+        cached = await embedding_cache.aget(query, embedder.name, embedder.dimension)
+        if cached is not None:
+            return cached
+
+    try:
+        embedding = await embed_flights.ado(embedding_key(query), lambda: _aembed(query))
+    except EmbeddingError as e:
+        print(e)
+        return None
+    if embedding_cache is not None:
+        await embedding_cache.aput(query, embedder.name, embedder.dimension, embedding)
+    return embedding
+
+
+async def search_knowledge_base(query: str) -> List[Dict[str, Any]]:
+    """
+    Search the knowledge base for relevant information.
+
+    Args:
+        query: str -> query used to retrieve the relevant information.
+    Returns:
+        List of the formatted results with title, content preview, and source link
+    """
+    return await knowledge_base_flights.ado(knowledge_base_key(query), lambda: _search_knowledge_base(query))
+
+
+async def _search_knowledge_base(query: str) -> List[Dict[str, Any]]:
+    embed = await aembed_with_str(query)
+    index = await embedded_indexes.aget(KNOWLEDGE_BASE_COLLECTION)
+    with span("search", collection=KNOWLEDGE_BASE_COLLECTION, embedded=index is not None):
+        if index is not None:
+            return format_knowledge_results(index.query_groups(
+                embed,
+                group_by="parent_id",
+                group_size=settings.KB_PASSAGES_PER_ARTICLE,
+                limit=SEARCH_LIMIT,
+                score_threshold=KNOWLEDGE_BASE_SCORE_THRESHOLD
+            ))
+
+        results = await client.query_points_groups(
+            collection_name=KNOWLEDGE_BASE_COLLECTION,
+            query=embed,
+            group_by="parent_id",
+            group_size=settings.KB_PASSAGES_PER_ARTICLE,
+            search_params=qdrant_profile.search_params(),
+            with_payload=True,
+            limit=SEARCH_LIMIT,
+            score_threshold=KNOWLEDGE_BASE_SCORE_THRESHOLD
+        )
+    return format_knowledge_results(results.groups)
+
+
+async def search_doctors(query: str, specialization: Optional[str] = None, available_only: bool = False) -> List[Dict[str, Any]]:
+    """
+    Search for doctors based on query.
+
+    Args:
+        query: str -> description of the user's health concern.
+        specialization: only doctors whose field matches, e.g. "Endocrinology".
+        available_only: skip doctors that are not taking appointments.
+    Returns:
+        List of formatted results with doctor information
+    """
+    return await doctor_flights.ado(
+        doctor_key(query, specialization, available_only),
+        lambda: _search_doctors(query, specialization, available_only)
+    )
+
+
+async def _search_doctors(query: str, specialization: Optional[str], available_only: bool) -> List[Dict[str, Any]]:
+    embed = await aembed_with_str(query)
+    query_filter = doctor_filter(specialization, available_only)
+    index = await embedded_indexes.aget(DOCTOR_COLLECTION)
+    with span("search", collection=DOCTOR_COLLECTION, embedded=index is not None):
+        if index is not None:
+            return format_doctor_results(index.query(
+                embed, limit=SEARCH_LIMIT, score_threshold=DOCTOR_SCORE_THRESHOLD, query_filter=query_filter
+            ))
+
+        results = await client.query_points(
+            collection_name=DOCTOR_COLLECTION,
+            query=embed,
+            query_filter=query_filter,
+            search_params=qdrant_profile.search_params(),
+            with_payload=True,
+            limit=SEARCH_LIMIT,
+            score_threshold=DOCTOR_SCORE_THRESHOLD,
+        )
+    return format_doctor_results(results.points)
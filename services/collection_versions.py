@@ -0,0 +1,60 @@
+import json
+import os
+import threading
+from typing import Dict
+
+# Shared between the apps and the ingestion scripts, which run from different
+# working directories, so the registry lives at a fixed place in the project.
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+VERSIONS_PATH = os.getenv(
+    "COLLECTION_VERSIONS_PATH", os.path.join(PROJECT_ROOT, ".cache", "collection_versions.json")
+)
+
+KNOWLEDGE_BASE_COLLECTION = "knowledge_base_collection"
+DOCTOR_COLLECTION = "doctor_collection"
+
+_lock = threading.Lock()
+_cached_mtime = None
+_cached_versions: Dict[str, int] = {}
+
+
+def get_versions() -> Dict[str, int]:
+    """
+    Current version of every collection.
+
+    A collection's version is bumped each time ingestion changes it, so
+    anything derived from its points (cached answers, local copies, rendered
+    cards) can tell it went stale. The file is only re-read when it changed.
+    """
+    global _cached_mtime, _cached_versions
+    try:
+        mtime = os.stat(VERSIONS_PATH).st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    with _lock:
+        if mtime != _cached_mtime:
+            with open(VERSIONS_PATH) as f:
+                _cached_versions = json.load(f)
+            _cached_mtime = mtime
+        return dict(_cached_versions)
+
+
+def get_version(collection_name: str) -> int:
+    return get_versions().get(collection_name, 0)
+
+
+def bump_version(collection_name: str) -> int:
+    """Mark a collection as changed and return its new version"""
+    with _lock:
+        versions = {}
+        if os.path.exists(VERSIONS_PATH):
+            with open(VERSIONS_PATH) as f:
+                versions = json.load(f)
+        versions[collection_name] = versions.get(collection_name, 0) + 1
+
+        os.makedirs(os.path.dirname(VERSIONS_PATH), exist_ok=True)
+        tmp_path = f"{VERSIONS_PATH}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(versions, f)
+        os.replace(tmp_path, VERSIONS_PATH)
+        return versions[collection_name]
@@ -0,0 +1,118 @@
+import json
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any
+
+import tiktoken
+from config.settings import settings
+
+# Keys the chat completion APIs accept; UI bookkeeping such as `generating`,
+# `tool_name` or `result_length` is stripped before a request is sent.
+API_KEYS = ("role", "content", "tool_calls", "tool_call_id", "name")
+
+# Fixed per-message cost of the chat format (role markers and separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class ContextBuilder:
+    """
+    Fits conversation history into a token budget.
+
+    Token counts are cached per message, so a growing conversation is only
+    tokenized once per new message. When the history does not fit:
+    1. the system prompt and the latest turn are always kept,
+    2. tool results of older turns are replaced by a short stub, oldest first,
+    3. whole older turns are dropped, oldest first.
+    """
+
+    def __init__(self, budget: int = 6000, encoding_name: str = "cl100k_base", cache_size: int = 4096):
+        self.budget = budget
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[tuple, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        try:
+            self._encoding = tiktoken.get_encoding(encoding_name)
+        except Exception as e:
+            # tiktoken downloads encodings on first use; fall back to an estimate offline
+            print(f"Could not load tiktoken encoding {encoding_name} ({e}), estimating token counts")
+            self._encoding = None
+
+    def _encode_len(self, text: str) -> int:
+        if self._encoding is None:
+            return len(text) // 4 + 1
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+    def count(self, message: Dict[str, Any]) -> int:
+        """Token count of one API message, cached"""
+        tool_calls = json.dumps(message["tool_calls"]) if message.get("tool_calls") else ""
+        key = (message["role"], message.get("content") or "", tool_calls)
+        with self._lock:
+            tokens = self._cache.get(key)
+            if tokens is not None:
+                self._cache.move_to_end(key)
+                return tokens
+
+        tokens = MESSAGE_OVERHEAD_TOKENS + self._encode_len(key[1]) + self._encode_len(tool_calls)
+        with self._lock:
+            self._cache[key] = tokens
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return tokens
+
+    @staticmethod
+    def _api_message(message: Dict[str, Any]) -> Dict[str, Any]:
+        api_message = {k: message[k] for k in API_KEYS if k in message}
+        api_message.setdefault("content", "")
+        return api_message
+
+    @staticmethod
+    def _stub(message: Dict[str, Any]) -> Dict[str, Any]:
+        stub = dict(message)
+        stub["content"] = "[Earlier tool result omitted]"
+        return stub
+
+    def build(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Return the API messages to send, trimmed to the token budget"""
+        pinned_head = []
+        turns = []
+        for message in messages:
+            if message.get("evicted") and message["role"] != "tool" and not message.get("tool_calls"):
+                continue
+            api_message = self._api_message(message)
+            if message["role"] == "system" and not turns:
+                pinned_head.append(api_message)
+            elif message["role"] == "user" or not turns:
+                turns.append([api_message])
+            else:
+                turns[-1].append(api_message)
+
+        if not turns:
+            return pinned_head
+
+        older, latest = turns[:-1], turns[-1]
+        total = sum(self.count(m) for m in pinned_head + latest) + sum(self.count(m) for turn in older for m in turn)
+
+        # Stub old tool results first, oldest first
+        for turn in older:
+            for i, message in enumerate(turn):
+                if total <= self.budget:
+                    break
+                if message["role"] == "tool":
+                    stub = self._stub(message)
+                    total -= self.count(message) - self.count(stub)
+                    turn[i] = stub
+
+        # Then drop whole turns, oldest first
+        while older and total > self.budget:
+            total -= sum(self.count(m) for m in older.pop(0))
+
+        return pinned_head + [m for turn in older for m in turn] + latest
+
+    def total_tokens(self, messages: List[Dict[str, Any]]) -> int:
+        return sum(self.count(m) for m in messages)
+
+
+context_builder = ContextBuilder(
+    budget=settings.CONTEXT_TOKEN_BUDGET,
+    encoding_name=settings.CONTEXT_ENCODING
+)
@@ -0,0 +1,227 @@
+import abc
+import asyncio
+import time
+from http import HTTPStatus
+from typing import List, Optional
+
+import dashscope
+import httpx
+
+# Kept free of config imports so the ingestion scripts can build the same
+# embedder as the apps from their own settings.
+
+LOCAL_PREFIX = "local:"
+DEFAULT_REMOTE_MODEL = dashscope.TextEmbedding.Models.text_embedding_v3
+# Portable int8 export shipped with most sentence-transformers ONNX models
+DEFAULT_QUANTIZED_ONNX_FILE = "onnx/model_quint8_avx2.onnx"
+
+
+class EmbeddingError(RuntimeError):
+    """Raised when texts could not be embedded"""
+
+
+class Embedder(abc.ABC):
+    """
+    Turns texts into vectors.
+
+    `name` identifies the model (and its variant) in caches and ingestion
+    manifests, so switching backends never mixes vectors from two models.
+    """
+
+    name: str = ""
+    dimension: int = 0
+    # Largest batch one embed() call should be given, and how many batches
+    # callers may run at the same time
+    max_batch_size: int = 32
+    max_concurrency: int = 1
+
+    @abc.abstractmethod
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """One vector per text, in order"""
+
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.to_thread(self.embed, texts)
+
+    def embed_one(self, text: str) -> List[float]:
+        return self.embed([text])[0]
+
+    def warm_up(self):
+        """Pay one-off loading costs before the first request does"""
+
+
+class DashScopeEmbedder(Embedder):
+    """
+    text-embedding models served by DashScope.
+
+    Requests go straight to the REST endpoint over one pooled keep-alive
+    client per flavour (sync and async), so a query reuses an open
+    connection instead of paying a new TLS handshake.
+
+    Args:
+        base_url: DashScope API root, e.g. https://dashscope-intl.aliyuncs.com/api/v1
+        pool_size: connections kept open to the endpoint.
+        connect_timeout, read_timeout: seconds.
+        http2: multiplex requests over HTTP/2 (needs the h2 package).
+    """
+
+    # text-embedding-v3 accepts at most 10 inputs per request
+    max_batch_size = 10
+    max_concurrency = 4
+
+    def __init__(
+        self,
+        api_key: str,
+        model: str = DEFAULT_REMOTE_MODEL,
+        dimension: int = 1024,
+        base_url: Optional[str] = None,
+        pool_size: int = 10,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 30.0,
+        http2: bool = False,
+    ):
+        self.api_key = api_key
+        self.model = model
+        self.dimension = dimension
+        self.name = f"{model}:{dimension}"
+        self.base_url = (base_url or dashscope.base_http_api_url).rstrip("/")
+        self.url = f"{self.base_url}/services/embeddings/text-embedding/text-embedding"
+        client_kwargs = {
+            "headers": {"Authorization": f"Bearer {api_key}"},
+            "timeout": httpx.Timeout(read_timeout, connect=connect_timeout),
+            "limits": httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            "http2": http2,
+        }
+        # Built up front: created lazily, concurrent first calls could each open a pool.
+        # Neither connects before its first request.
+        self._client = httpx.Client(**client_kwargs)
+        self._async_client = httpx.AsyncClient(**client_kwargs)
+
+    def _body(self, texts: List[str]) -> dict:
+        return {
+            "model": self.model,
+            "input": {"texts": texts},
+            "parameters": {"dimension": self.dimension},
+        }
+
+    @staticmethod
+    def _vectors(resp: httpx.Response, count: int) -> List[List[float]]:
+        if resp.status_code != HTTPStatus.OK:
+            raise EmbeddingError(f"DashScope returned {resp.status_code}: {resp.text}")
+        embeddings = sorted(resp.json()["output"]["embeddings"], key=lambda e: e["text_index"])
+        if len(embeddings) != count:
+            raise EmbeddingError(f"Expected {count} embeddings, got {len(embeddings)}")
+        return [e["embedding"] for e in embeddings]
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        try:
+            resp = self._client.post(self.url, json=self._body(texts))
+        except httpx.HTTPError as e:
+            raise EmbeddingError(f"DashScope request failed: {e!r}") from e
+        return self._vectors(resp, len(texts))
+
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        """Embed without blocking the event loop"""
+        try:
+            resp = await self._async_client.post(self.url, json=self._body(texts))
+        except httpx.HTTPError as e:
+            raise EmbeddingError(f"DashScope request failed: {e!r}") from e
+        return self._vectors(resp, len(texts))
+
+    def warm_up(self):
+        # Opens the first pooled connection (DNS, TCP, TLS) ahead of the first query
+        start = time.perf_counter()
+        try:
+            self.embed(["warm up"])
+        except EmbeddingError as e:
+            print(f"Could not warm up {self.name}: {e}")
+            return
+        print(f"Warmed up {self.name} in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+
+class LocalEmbedder(Embedder):
+    """
+    sentence-transformers model run on the CPU.
+
+    Args:
+        model_name: Hugging Face model ID or local path.
+        backend: "torch" or "onnx".
+        quantize: int8 inference; dynamic quantization of the linear layers
+            with torch, a pre-quantized export with onnx.
+        onnx_file: ONNX file inside the model repo, overriding the default.
+        batch_size: texts encoded per forward pass.
+    """
+
+    def __init__(self, model_name: str, backend: str = "torch", quantize: bool = False, onnx_file: str = "", batch_size: int = 32):
+        # Optional dependency, only needed when a local model is configured
+        from sentence_transformers import SentenceTransformer
+
+        model_kwargs = None
+        if backend == "onnx" and (onnx_file or quantize):
+            model_kwargs = {"file_name": onnx_file or DEFAULT_QUANTIZED_ONNX_FILE}
+
+        start = time.perf_counter()
+        self.model = SentenceTransformer(model_name, device="cpu", backend=backend, model_kwargs=model_kwargs)
+        if quantize and backend == "torch":
+            import torch
+            self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        print(f"Loaded {model_name} ({backend}{', int8' if quantize else ''}) in {time.perf_counter() - start:.1f}s")
+
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        self.name = f"{LOCAL_PREFIX}{model_name}:{backend}{':int8' if quantize else ''}"
+        self.max_batch_size = batch_size
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.model.encode(
+            texts,
+            batch_size=self.max_batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+        return vectors.tolist()
+
+    def warm_up(self):
+        # The first forward pass allocates buffers and picks kernels
+        start = time.perf_counter()
+        self.embed(["warm up"])
+        print(f"Warmed up {self.name} in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+
+def create_embedder(
+    model: str,
+    api_key: str = "",
+    dimension: int = 1024,
+    backend: str = "torch",
+    quantize: bool = False,
+    onnx_file: str = "",
+    batch_size: int = 32,
+    base_url: Optional[str] = None,
+    pool_size: int = 10,
+    connect_timeout: float = 5.0,
+    read_timeout: float = 30.0,
+    http2: bool = False,
+) -> Embedder:
+    """
+    Build the embedder named by EMBEDDING_MODEL.
+
+    `local:<model>` runs a sentence-transformers model on the CPU; anything
+    else names a DashScope model, text-embedding-v3 when empty.
+    """
+    if model.startswith(LOCAL_PREFIX):
+        return LocalEmbedder(
+            model[len(LOCAL_PREFIX):],
+            backend=backend,
+            quantize=quantize,
+            onnx_file=onnx_file,
+            batch_size=batch_size,
+        )
+    return DashScopeEmbedder(
+        api_key,
+        model=model or DEFAULT_REMOTE_MODEL,
+        dimension=dimension,
+        base_url=base_url,
+        pool_size=pool_size,
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        http2=http2,
+    )
@@ -0,0 +1,174 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import List, Optional, Dict, Any
+
+
+def normalize_query(text: str) -> str:
+    """Lowercase and collapse whitespace so trivially different queries share a key"""
+    return " ".join(text.lower().split())
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache for query embeddings.
+
+    Tier 1 is an in-process LRU with a size cap and a TTL. Tier 2 is a SQLite
+    table holding float32 rows, so embeddings survive restarts. Embeddings are
+    deterministic for a given model and dimension, so disk rows never expire;
+    they are only keyed apart by model and dimension.
+
+    The disk tier has its own lock, so a memory lookup never waits on SQLite;
+    aget()/aput() check memory inline and run only disk I/O in a thread.
+    """
+
+    def __init__(self, max_size: int = 4096, ttl: float = 86400, path: Optional[str] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self._memory: "OrderedDict[tuple, tuple[float, List[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "query TEXT NOT NULL, model TEXT NOT NULL, dimension INTEGER NOT NULL, "
+                "vector BLOB NOT NULL, created_at REAL NOT NULL, "
+                "PRIMARY KEY (query, model, dimension))"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def _key(query: str, model: str, dimension: int) -> tuple:
+        return (normalize_query(query), model, dimension)
+
+    def get(self, query: str, model: str, dimension: int) -> Optional[List[float]]:
+        """Return the cached embedding or None, checking memory first and then disk"""
+        key = self._key(query, model, dimension)
+        vector = self._get_memory(key)
+        if vector is None and self._db is not None:
+            vector = self._get_disk(key)
+        if vector is None:
+            self._miss()
+        return vector
+
+    async def aget(self, query: str, model: str, dimension: int) -> Optional[List[float]]:
+        """get() without blocking the event loop on the disk tier"""
+        key = self._key(query, model, dimension)
+        vector = self._get_memory(key)
+        if vector is None and self._db is not None:
+            vector = await asyncio.to_thread(self._get_disk, key)
+        if vector is None:
+            self._miss()
+        return vector
+
+    def put(self, query: str, model: str, dimension: int, vector: List[float]):
+        """Store an embedding in both tiers"""
+        key = self._key(query, model, dimension)
+        with self._lock:
+            self._remember(key, vector, time.monotonic())
+        if self._db is not None:
+            self._put_disk(key, vector)
+
+    async def aput(self, query: str, model: str, dimension: int, vector: List[float]):
+        """put() without blocking the event loop on the disk tier"""
+        key = self._key(query, model, dimension)
+        with self._lock:
+            self._remember(key, vector, time.monotonic())
+        if self._db is not None:
+            await asyncio.to_thread(self._put_disk, key, vector)
+
+    def _get_memory(self, key: tuple) -> Optional[List[float]]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            stored_at, vector = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            return vector
+
+    def _get_disk(self, key: tuple) -> Optional[List[float]]:
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT vector FROM embeddings WHERE query = ? AND model = ? AND dimension = ?",
+                key
+            ).fetchone()
+        if row is None:
+            return None
+        vector = array("f", row[0]).tolist()
+        with self._lock:
+            self._remember(key, vector, time.monotonic())
+            self.disk_hits += 1
+        return vector
+
+    def _put_disk(self, key: tuple, vector: List[float]):
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?)",
+                (*key, array("f", vector).tobytes(), time.time())
+            )
+            self._db.commit()
+
+    def _miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def _remember(self, key: tuple, vector: List[float], now: float):
+        self._memory[key] = (now, vector)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def clear(self):
+        """Drop every entry from both tiers and reset the counters"""
+        with self._lock, self._db_lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM embeddings")
+                self._db.commit()
+            self.memory_hits = self.disk_hits = self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit and miss counters; every hit is one embedding round trip saved"""
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / total, 3) if total else 0.0,
+                "memory_entries": len(self._memory),
+            }
+
+    def register_metrics(self, registry):
+        """Export stats() on /metrics (see services.tracing)"""
+        registry.counter(
+            "search_embedding_cache_lookups_total", "Query embedding cache lookups", labels=("result",),
+            collect=lambda: {
+                (result,): self.stats()[key]
+                for result, key in (("memory_hit", "memory_hits"), ("disk_hit", "disk_hits"), ("miss", "misses"))
+            }
+        )
+        registry.gauge(
+            "search_embedding_cache_entries", "Query embeddings held in memory",
+            collect=lambda: {(): self.stats()["memory_entries"]}
+        )
@@ -0,0 +1,72 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+from fasthtml.common import NotStr, to_xml
+
+from services.collection_versions import get_versions
+
+
+class FragmentCache:
+    """
+    Rendered HTML of source cards, so a popular article or doctor is turned
+    into markup once instead of on every request.
+
+    An entry is keyed by the caller, typically the source's identity plus
+    whatever else its card shows, and remembers the versions of the
+    collections it was rendered from. Once ingestion bumps one of them (see
+    services/collection_versions.py), the entry is rendered again. The
+    least recently used entries are evicted beyond `max_entries`.
+    """
+
+    def __init__(self, max_entries: int = 2048):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[Tuple[int, ...], NotStr]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, key: Hashable, collections: Tuple[str, ...], build: Callable[[], Any]) -> NotStr:
+        """HTML of build(), reused for the same key while `collections` are unchanged"""
+        current = get_versions()
+        versions = tuple(current.get(name, 0) for name in collections)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == versions:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        html = NotStr(to_xml(build()))
+        with self._lock:
+            self._entries[key] = (versions, html)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return html
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "entries": len(self._entries),
+            }
+
+    def register_metrics(self, registry):
+        """Export stats() on /metrics (see services.tracing)"""
+        registry.counter(
+            "chat_fragment_cache_lookups_total", "Rendered source card cache lookups", labels=("result",),
+            collect=lambda: {(result,): self.stats()[key] for result, key in (("hit", "hits"), ("miss", "misses"))}
+        )
+        registry.gauge(
+            "chat_fragment_cache_entries", "Rendered source cards held in memory",
+            collect=lambda: {(): self.stats()["entries"]}
+        )
+
+
+fragment_cache = FragmentCache(max_entries=int(os.getenv("FRAGMENT_CACHE_SIZE", 2048)))
@@ -0,0 +1,90 @@
+import asyncio
+import threading
+from typing import Callable, Dict, Optional
+
+from services.tracing import registry
+
+cancellations = registry.counter(
+    "chat_generation_cancellations_total",
+    "Answers stopped before they finished, by reason (new_message, disconnect, reset)",
+    labels=("app", "reason")
+)
+
+
+class Generation:
+    """
+    One answer being generated. cancel() may be called from any thread: it
+    cancels the asyncio task running the answer, or, for answers generated
+    in a worker thread, sets `cancelled` and runs the registered closers so
+    a blocked read of the upstream stream returns at once.
+    """
+
+    def __init__(self, task: Optional[asyncio.Task] = None, owner=None):
+        self.task = task
+        # What started the answer (e.g. its websocket), see Generations.cancel
+        self.owner = owner
+        self.cancelled = threading.Event()
+        self._closers = []
+        self._lock = threading.Lock()
+
+    def on_cancel(self, close: Callable[[], None]):
+        """Run `close` on cancellation, or right away if already cancelled"""
+        with self._lock:
+            if not self.cancelled.is_set():
+                self._closers.append(close)
+                return
+        close()
+
+    def cancel(self) -> bool:
+        with self._lock:
+            if self.cancelled.is_set():
+                return False
+            self.cancelled.set()
+            closers, self._closers = self._closers, []
+        if self.task is not None:
+            self.task.get_loop().call_soon_threadsafe(self.task.cancel)
+        for close in closers:
+            try:
+                close()
+            except Exception as e:
+                print(f"Error closing a cancelled generation: {e}")
+        return True
+
+    async def wait(self):
+        """Wait until a cancelled task has finished cleaning up"""
+        if self.task is not None and self.task is not asyncio.current_task():
+            await asyncio.wait({self.task})
+
+
+class Generations:
+    """The generation each session is running; starting a new one cancels the previous"""
+
+    def __init__(self, app: str):
+        self.app = app
+        self._running: Dict[str, Generation] = {}
+        self._lock = threading.Lock()
+
+    def start(self, sid: str, generation: Generation) -> Optional[Generation]:
+        """Make `generation` the session's current one; returns the previous one, now cancelled"""
+        with self._lock:
+            previous = self._running.get(sid)
+            self._running[sid] = generation
+        if previous is not None and previous.cancel():
+            cancellations.inc(app=self.app, reason="new_message")
+        return previous
+
+    def cancel(self, sid: str, reason: str, owner=None):
+        """Cancel the session's generation, only if started by `owner` when given"""
+        with self._lock:
+            generation = self._running.get(sid)
+            if generation is None or (owner is not None and generation.owner is not owner):
+                return
+            del self._running[sid]
+        if generation.cancel():
+            cancellations.inc(app=self.app, reason=reason)
+
+    def finish(self, sid: str, generation: Generation):
+        """Forget a generation that is done, unless another one replaced it already"""
+        with self._lock:
+            if self._running.get(sid) is generation:
+                del self._running[sid]
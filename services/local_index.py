@@ -0,0 +1,266 @@
+import asyncio
+import glob
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.models import FieldCondition, Filter, MatchAny, MatchText, MatchValue, PointGroup, ScoredPoint
+
+from services.collection_versions import get_version
+
+
+def _words(text) -> set:
+    # Same split as Qdrant's lowercase word tokenizer
+    return set(re.findall(r"\w+", str(text).lower()))
+
+
+def _matches_condition(payload: Dict[str, Any], condition) -> bool:
+    if isinstance(condition, Filter):
+        return matches_filter(payload, condition)
+    if not isinstance(condition, FieldCondition):
+        raise ValueError(f"Unsupported condition for in-process search: {condition!r}")
+
+    value = payload.get(condition.key)
+    values = value if isinstance(value, list) else [value]
+    match = condition.match
+    if isinstance(match, MatchValue):
+        return match.value in values
+    if isinstance(match, MatchAny):
+        return any(v in match.any for v in values)
+    if isinstance(match, MatchText):
+        return any(_words(match.text) <= _words(v) for v in values if v is not None)
+    raise ValueError(f"Unsupported match for in-process search: {match!r}")
+
+
+def matches_filter(payload: Dict[str, Any], query_filter: Filter) -> bool:
+    """Evaluate the subset of Qdrant filters used by the search services against a payload"""
+    def as_list(conditions):
+        if conditions is None:
+            return []
+        return conditions if isinstance(conditions, list) else [conditions]
+
+    must, should, must_not = as_list(query_filter.must), as_list(query_filter.should), as_list(query_filter.must_not)
+    return (
+        all(_matches_condition(payload, c) for c in must)
+        and (not should or any(_matches_condition(payload, c) for c in should))
+        and not any(_matches_condition(payload, c) for c in must_not)
+    )
+
+
+class LocalIndex:
+    """
+    In-process copy of a small collection for exact cosine search.
+
+    Vectors are normalized once and stored as a memory-mapped `.npy` matrix
+    with the point IDs and payloads in a JSON sidecar. Both are named after
+    the collection version they were copied at, so every worker shares one
+    snapshot per version and a re-ingested collection gets a fresh copy.
+    A snapshot whose point count no longer matches the collection is copied
+    again, since the collection can change without its version being bumped
+    here (e.g. ingestion ran on another host).
+    """
+
+    def __init__(self, collection_name: str, version: int, directory: str):
+        self.collection_name = collection_name
+        self.version = version
+        base = os.path.join(directory, f"{collection_name}.v{version}")
+        self.vectors_path = f"{base}.npy"
+        self.payloads_path = f"{base}.json"
+        self.vectors: Optional[np.ndarray] = None
+        self.points: List[Dict[str, Any]] = []
+
+    def load(self, client: QdrantClient, count: int, reuse: bool = True):
+        """
+        Map the snapshot of this version, copying it from Qdrant first unless
+        a snapshot on disk can be reused and has the collection's `count` points.
+        """
+        if reuse and os.path.exists(self.vectors_path) and os.path.exists(self.payloads_path):
+            self._map()
+            if len(self.points) == count:
+                return
+            print(f"Snapshot of {self.collection_name} v{self.version} has {len(self.points)} points, "
+                  f"the collection {count}; copying it again")
+        self._snapshot(client)
+        self._map()
+
+    def _map(self):
+        self.vectors = np.load(self.vectors_path, mmap_mode="r")
+        with open(self.payloads_path) as f:
+            self.points = json.load(f)
+
+    def _snapshot(self, client: QdrantClient):
+        ids, payloads, vectors = [], [], []
+        offset = None
+        while True:
+            points, offset = client.scroll(
+                collection_name=self.collection_name, limit=1000, offset=offset,
+                with_payload=True, with_vectors=True
+            )
+            for point in points:
+                ids.append(point.id)
+                payloads.append(point.payload)
+                vectors.append(point.vector)
+            if offset is None:
+                break
+
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if len(matrix):
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            matrix /= np.where(norms == 0, 1, norms)
+
+        os.makedirs(os.path.dirname(self.vectors_path), exist_ok=True)
+        # Write under temporary names so other workers never map a partial file
+        tmp_vectors = f"{self.vectors_path}.{os.getpid()}.tmp.npy"
+        tmp_payloads = f"{self.payloads_path}.{os.getpid()}.tmp"
+        np.save(tmp_vectors, matrix)
+        with open(tmp_payloads, "w") as f:
+            json.dump([{"id": i, "payload": p} for i, p in zip(ids, payloads)], f)
+        os.replace(tmp_payloads, self.payloads_path)
+        os.replace(tmp_vectors, self.vectors_path)
+
+    def remove_older_snapshots(self):
+        keep = {self.vectors_path, self.payloads_path}
+        pattern = os.path.join(os.path.dirname(self.vectors_path), f"{self.collection_name}.v*")
+        for path in glob.glob(pattern):
+            if path not in keep and ".tmp" not in path:
+                os.remove(path)
+
+    def _ranked(self, vector, score_threshold: Optional[float], query_filter: Optional[Filter] = None):
+        """Indices and scores of the points passing the filter and threshold, best first"""
+        if vector is None or self.vectors is None or not len(self.vectors):
+            return [], []
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        scores = self.vectors @ (query / norm if norm else query)
+        order = np.argsort(-scores)
+        if score_threshold is not None:
+            order = order[scores[order] >= score_threshold]
+        if query_filter is not None:
+            order = [i for i in order if matches_filter(self.points[i]["payload"], query_filter)]
+        return order, scores
+
+    def _scored_point(self, i: int, score: float) -> ScoredPoint:
+        point = self.points[i]
+        return ScoredPoint(id=point["id"], version=self.version, score=float(score), payload=point["payload"])
+
+    def query(self, vector, limit: int = 10, score_threshold: Optional[float] = None,
+              query_filter: Optional[Filter] = None) -> List[ScoredPoint]:
+        """Same results as client.query_points(...).points with exact search"""
+        order, scores = self._ranked(vector, score_threshold, query_filter)
+        return [self._scored_point(i, scores[i]) for i in order[:limit]]
+
+    def query_groups(self, vector, group_by: str, limit: int = 10, group_size: int = 3,
+                     score_threshold: Optional[float] = None, query_filter: Optional[Filter] = None) -> List[PointGroup]:
+        """Same results as client.query_points_groups(...).groups with exact search"""
+        order, scores = self._ranked(vector, score_threshold, query_filter)
+        groups: Dict[Any, List[ScoredPoint]] = {}
+        for i in order:
+            key = self.points[i]["payload"].get(group_by)
+            if key is None:
+                continue
+            if key not in groups:
+                if len(groups) == limit:
+                    continue
+                groups[key] = []
+            if len(groups[key]) < group_size:
+                groups[key].append(self._scored_point(i, scores[i]))
+        return [PointGroup(id=key, hits=hits) for key, hits in groups.items()]
+
+
+class EmbeddedIndexes:
+    """
+    Chooses, per collection, between Qdrant and an in-process LocalIndex.
+
+    Collections with at most `max_points` points are served locally. The
+    choice and the copy are redone whenever the collection version changes,
+    and when a check against Qdrant, every `recheck_interval` seconds, finds
+    a different point count than the copy has.
+
+    Version 0 means no ingestion was recorded on this host, so nothing says
+    whether a snapshot left on disk is still current; it is not reused
+    across restarts.
+    """
+
+    def __init__(self, client: QdrantClient, max_points: int = 10000, directory: str = ".cache/embedded",
+                 recheck_interval: float = 60):
+        self.client = client
+        self.max_points = max_points
+        self.directory = directory
+        self.recheck_interval = recheck_interval
+        self._indexes: Dict[str, Optional[LocalIndex]] = {}
+        self._versions: Dict[str, int] = {}
+        self._checked_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _is_current(self, collection_name: str) -> bool:
+        return (
+            self._versions.get(collection_name) == get_version(collection_name)
+            and time.monotonic() - self._checked_at.get(collection_name, 0) < self.recheck_interval
+        )
+
+    def get(self, collection_name: str) -> Optional[LocalIndex]:
+        """The local index of a collection, or None if it should be searched in Qdrant"""
+        if self.max_points <= 0:
+            return None
+        if self._is_current(collection_name):
+            return self._indexes[collection_name]
+
+        with self._lock:
+            if self._is_current(collection_name):
+                return self._indexes[collection_name]
+            version = get_version(collection_name)
+            try:
+                if self._versions.get(collection_name) != version or not self._unchanged(collection_name):
+                    self._indexes[collection_name] = self._load(collection_name, version)
+            except Exception as e:
+                if self._versions.get(collection_name) == version:
+                    # Keep serving the copy, the check is retried after the interval
+                    print(f"Could not check {collection_name} against Qdrant ({e})")
+                    self._checked_at[collection_name] = time.monotonic()
+                    return self._indexes[collection_name]
+                # Retried on the next search; Qdrant serves it meanwhile
+                print(f"Could not load {collection_name} in process ({e}), searching it in Qdrant")
+                return None
+            self._versions[collection_name] = version
+            self._checked_at[collection_name] = time.monotonic()
+            return self._indexes[collection_name]
+
+    async def aget(self, collection_name: str) -> Optional[LocalIndex]:
+        """Like get(), loading a new snapshot off the event loop"""
+        if self.max_points <= 0:
+            return None
+        if self._is_current(collection_name):
+            return self._indexes[collection_name]
+        return await asyncio.to_thread(self.get, collection_name)
+
+    def _count(self, collection_name: str) -> Optional[int]:
+        if not self.client.collection_exists(collection_name):
+            return None
+        return self.client.count(collection_name=collection_name, exact=True).count
+
+    def _unchanged(self, collection_name: str) -> bool:
+        """Whether the loaded copy (or the choice of Qdrant) still fits the collection's point count"""
+        index = self._indexes.get(collection_name)
+        count = self._count(collection_name)
+        if index is None:
+            return count is None or count > self.max_points
+        return count == len(index.points)
+
+    def _load(self, collection_name: str, version: int) -> Optional[LocalIndex]:
+        count = self._count(collection_name)
+        if count is None:
+            return None
+        if count > self.max_points:
+            print(f"{collection_name} has {count} points, searching it in Qdrant")
+            return None
+        index = LocalIndex(collection_name, version, self.directory)
+        # A v0 snapshot may predate changes made elsewhere, so it is copied afresh once per process
+        index.load(self.client, count, reuse=version > 0 or collection_name in self._versions)
+        index.remove_older_snapshots()
+        print(f"Serving {collection_name} v{version} ({count} points) in process")
+        return index
@@ -0,0 +1,182 @@
+import asyncio
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from config.settings import settings
+from services import async_search_service, search_service
+from services.tracing import registry
+
+speculative_searches = registry.counter(
+    "chat_speculative_searches_total",
+    "Searches started from the user message before the model asked for them, by outcome (hit, miss, unused)",
+    labels=("tool", "outcome")
+)
+speculative_saved_seconds = registry.histogram(
+    "chat_speculative_saved_seconds", "Search time a tool call did not have to wait thanks to a prefetch",
+    labels=("tool",)
+)
+
+# Worker threads for the sync app; searches are I/O bound
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="prefetch")
+
+
+def _normalize(text: str) -> str:
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+
+def _similarity(a, b) -> float:
+    a, b = np.asarray(a, dtype=np.float32), np.asarray(b, dtype=np.float32)
+    norms = np.linalg.norm(a) * np.linalg.norm(b)
+    return float(a @ b / norms) if norms else 0.0
+
+
+def _reusable(fn_name: str, args: Dict[str, Any]) -> bool:
+    """Prefetches search with the user message only; filtered doctor searches need their own query"""
+    if fn_name == "search_doctors":
+        return not args.get("specialization") and not args.get("available_only")
+    return fn_name == "search_knowledge_base"
+
+
+class _Prefetch:
+    """
+    Knowledge base and doctor searches for the raw user message, started
+    while the first completion is still deciding which tools to call.
+
+    A tool call gets the prefetched results when its `query` is the user
+    message (ignoring case and punctuation) or embeds within
+    SPECULATIVE_SEARCH_THRESHOLD cosine similarity of it; otherwise they are
+    thrown away and the tool runs as usual. Call discard() once the answer
+    is done so unused searches are cancelled and counted.
+    """
+
+    tools = ("search_knowledge_base", "search_doctors")
+
+    def __init__(self, query: str):
+        self.query = query
+        self._settled = set()
+
+    def _matches(self, query: str, vector, query_vector) -> bool:
+        if _normalize(query) == _normalize(self.query):
+            return True
+        if vector is None or query_vector is None:
+            return False
+        return _similarity(vector, query_vector) >= settings.SPECULATIVE_SEARCH_THRESHOLD
+
+    def _settle(self, fn_name: str, outcome: str, took: float = 0.0, waited: float = 0.0):
+        self._settled.add(fn_name)
+        speculative_searches.inc(tool=fn_name, outcome=outcome)
+        if outcome == "hit":
+            speculative_saved_seconds.observe(max(took - waited, 0.0), tool=fn_name)
+
+    def _unsettled(self) -> List[str]:
+        return [name for name in self.tools if name not in self._settled]
+
+
+def _retrieve_exception(task: asyncio.Task):
+    # Failures of searches nobody awaits are expected, not "never retrieved"
+    if not task.cancelled():
+        task.exception()
+
+
+class AsyncPrefetch(_Prefetch):
+    """Prefetch for event-loop handlers"""
+
+    def __init__(self, query: str):
+        super().__init__(query)
+        self._vector = asyncio.create_task(async_search_service.aembed_with_str(query))
+        self._searches = {
+            "search_knowledge_base": asyncio.create_task(self._timed(async_search_service.search_knowledge_base)),
+            "search_doctors": asyncio.create_task(self._timed(async_search_service.search_doctors)),
+        }
+        for task in (self._vector, *self._searches.values()):
+            task.add_done_callback(_retrieve_exception)
+
+    async def _timed(self, search):
+        start = time.perf_counter()
+        result = await search(self.query)
+        return result, time.perf_counter() - start
+
+    async def get(self, fn_name: str, args: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+        """Prefetched result for this tool call, or None if the tool has to run"""
+        if fn_name in self._settled or not _reusable(fn_name, args):
+            return None
+        query = args.get("query", "")
+        try:
+            vector = await self._vector
+        except Exception:
+            vector = None
+        query_vector = None if _normalize(query) == _normalize(self.query) else await async_search_service.aembed_with_str(query)
+        if not self._matches(query, vector, query_vector):
+            self._searches[fn_name].cancel()
+            self._settle(fn_name, "miss")
+            return None
+
+        start = time.perf_counter()
+        try:
+            result, took = await self._searches[fn_name]
+        except Exception as e:
+            print(f"Prefetched {fn_name} failed: {e}")
+            self._settle(fn_name, "miss")
+            return None
+        self._settle(fn_name, "hit", took, time.perf_counter() - start)
+        return result
+
+    def discard(self):
+        """Cancel and count the searches no tool call asked for"""
+        for fn_name in self._unsettled():
+            self._searches[fn_name].cancel()
+            self._settle(fn_name, "unused")
+        self._vector.cancel()
+
+
+class ThreadPrefetch(_Prefetch):
+    """Prefetch for handlers running in worker threads"""
+
+    def __init__(self, query: str):
+        super().__init__(query)
+        self._vector = _executor.submit(search_service.embed_with_str, query)
+        self._searches = {
+            "search_knowledge_base": _executor.submit(self._timed, search_service.search_knowledge_base),
+            "search_doctors": _executor.submit(self._timed, search_service.search_doctors),
+        }
+
+    def _timed(self, search):
+        start = time.perf_counter()
+        result = search(self.query)
+        return result, time.perf_counter() - start
+
+    def get(self, fn_name: str, args: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+        """Prefetched result for this tool call, or None if the tool has to run"""
+        if fn_name in self._settled or not _reusable(fn_name, args):
+            return None
+        query = args.get("query", "")
+        try:
+            vector = self._vector.result()
+        except Exception:
+            vector = None
+        query_vector = None if _normalize(query) == _normalize(self.query) else search_service.embed_with_str(query)
+        if not self._matches(query, vector, query_vector):
+            self._searches[fn_name].cancel()
+            self._settle(fn_name, "miss")
+            return None
+
+        start = time.perf_counter()
+        try:
+            result, took = self._searches[fn_name].result()
+        except Exception as e:
+            print(f"Prefetched {fn_name} failed: {e}")
+            self._settle(fn_name, "miss")
+            return None
+        self._settle(fn_name, "hit", took, time.perf_counter() - start)
+        return result
+
+    def discard(self):
+        """Cancel (if not started yet) and count the searches no tool call asked for"""
+        for fn_name in self._unsettled():
+            self._searches[fn_name].cancel()
+            self._settle(fn_name, "unused")
+        self._vector.cancel()
@@ -0,0 +1,109 @@
+from dataclasses import dataclass, replace
+from typing import Any, Dict, Optional
+
+from qdrant_client.models import (
+    BinaryQuantization,
+    BinaryQuantizationConfig,
+    Distance,
+    HnswConfigDiff,
+    QuantizationSearchParams,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    SearchParams,
+    VectorParams,
+)
+
+# Kept free of config imports so the ingestion scripts can use the same
+# profiles as the apps.
+
+
+@dataclass(frozen=True)
+class CollectionProfile:
+    """
+    Storage and index layout of a collection, plus the matching search parameters.
+
+    Quantized vectors are always kept in RAM; `on_disk` moves the original
+    float32 vectors to disk, where they are only read to rescore the
+    oversampled candidates of a quantized search.
+    """
+
+    name: str
+    quantization: str = "none"  # none | scalar | binary
+    on_disk: bool = False
+    hnsw_m: int = 16
+    hnsw_ef_construct: int = 100
+    # Search time
+    hnsw_ef: Optional[int] = None
+    oversampling: Optional[float] = None
+    rescore: bool = True
+
+    def collection_kwargs(self, size: int) -> Dict[str, Any]:
+        """Arguments for client.create_collection"""
+        return {
+            "vectors_config": VectorParams(size=size, distance=Distance.COSINE, on_disk=self.on_disk),
+            "hnsw_config": HnswConfigDiff(m=self.hnsw_m, ef_construct=self.hnsw_ef_construct),
+            "quantization_config": self.quantization_config(),
+        }
+
+    def quantization_config(self):
+        if self.quantization == "scalar":
+            return ScalarQuantization(
+                scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True)
+            )
+        if self.quantization == "binary":
+            return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+        return None
+
+    def search_params(self) -> Optional[SearchParams]:
+        """Arguments for query_points(search_params=...), None for server defaults"""
+        quantization = None
+        if self.quantization != "none":
+            quantization = QuantizationSearchParams(rescore=self.rescore, oversampling=self.oversampling)
+        if self.hnsw_ef is None and quantization is None:
+            return None
+        return SearchParams(hnsw_ef=self.hnsw_ef, quantization=quantization)
+
+    def estimated_ram_bytes(self, points: int, size: int) -> int:
+        """Rough resident size of the vectors and the HNSW graph"""
+        per_point = 0 if self.on_disk else size * 4
+        if self.quantization == "scalar":
+            per_point += size
+        elif self.quantization == "binary":
+            per_point += size // 8
+        # Two link lists of m neighbours on the base layer, 4-byte IDs
+        per_point += self.hnsw_m * 2 * 4
+        return points * per_point
+
+
+PROFILES: Dict[str, CollectionProfile] = {
+    # What the scripts created before profiles existed
+    "default": CollectionProfile("default"),
+    # 4x smaller vectors in RAM, originals kept in RAM for rescoring
+    "scalar": CollectionProfile("scalar", quantization="scalar", oversampling=1.5),
+    # Only int8 vectors in RAM, originals read from disk to rescore
+    "scalar_on_disk": CollectionProfile("scalar_on_disk", quantization="scalar", on_disk=True, oversampling=2.0),
+    # 32x smaller vectors in RAM; works well from ~1024 dimensions up
+    "binary_on_disk": CollectionProfile(
+        "binary_on_disk", quantization="binary", on_disk=True, oversampling=3.0, hnsw_ef=128
+    ),
+}
+
+
+def get_profile(
+    name: str = "default",
+    hnsw_m: int = 0,
+    hnsw_ef_construct: int = 0,
+    hnsw_ef: int = 0,
+    oversampling: float = 0.0,
+) -> CollectionProfile:
+    """Look up a profile by name; non-zero arguments override its values"""
+    if name not in PROFILES:
+        raise ValueError(f"Unknown Qdrant profile {name!r}, expected one of {', '.join(PROFILES)}")
+    overrides = {
+        "hnsw_m": hnsw_m,
+        "hnsw_ef_construct": hnsw_ef_construct,
+        "hnsw_ef": hnsw_ef,
+        "oversampling": oversampling,
+    }
+    return replace(PROFILES[name], **{key: value for key, value in overrides.items() if value})
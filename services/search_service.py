@@ -1,25 +1,138 @@
 import asyncio
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Optional, Tuple
 from config.settings import settings
 from qdrant_client import QdrantClient
-import dashscope
-from http import HTTPStatus
+from qdrant_client.models import Filter, FieldCondition, MatchText, MatchValue
+from services.embedding_cache import EmbeddingCache, normalize_query
+from services.embedders import create_embedder, EmbeddingError
+from services.qdrant_profiles import get_profile
+from services.local_index import EmbeddedIndexes
+from services.collection_versions import KNOWLEDGE_BASE_COLLECTION, DOCTOR_COLLECTION
+from services.tracing import span, registry
+from services.single_flight import SingleFlight
 
 
 client = QdrantClient(url=settings.QDRANT_URL)
-
-
-dashscope.base_http_api_url = 'https://dashscope-intl.aliyuncs.com/api/v1'
+qdrant_profile = get_profile(
+    settings.QDRANT_PROFILE,
+    hnsw_m=settings.QDRANT_HNSW_M,
+    hnsw_ef_construct=settings.QDRANT_HNSW_EF_CONSTRUCT,
+    hnsw_ef=settings.QDRANT_HNSW_EF,
+    oversampling=settings.QDRANT_OVERSAMPLING,
+)
+
+# Small collections are copied into the process and searched without a round trip
+embedded_indexes = EmbeddedIndexes(
+    client,
+    max_points=settings.EMBEDDED_SEARCH_MAX_POINTS,
+    directory=settings.EMBEDDED_SEARCH_DIR,
+    recheck_interval=settings.EMBEDDED_SEARCH_RECHECK_INTERVAL
+)
+
+embedding_cache = EmbeddingCache(
+    max_size=settings.EMBEDDING_CACHE_SIZE,
+    ttl=settings.EMBEDDING_CACHE_TTL,
+    path=settings.EMBEDDING_CACHE_PATH or None
+) if settings.EMBEDDING_CACHE_ENABLED else None
+if embedding_cache is not None:
+    embedding_cache.register_metrics(registry)
+
+
+# Identical concurrent calls share one upstream request
+embed_flights = SingleFlight("embed", enabled=settings.SEARCH_SINGLE_FLIGHT)
+knowledge_base_flights = SingleFlight("search_knowledge_base", enabled=settings.SEARCH_SINGLE_FLIGHT)
+doctor_flights = SingleFlight("search_doctors", enabled=settings.SEARCH_SINGLE_FLIGHT)
+
+embedder = create_embedder(
+    settings.EMBEDDING_MODEL,
+    api_key=settings.DASHSCOPE_API_KEY,
+    dimension=settings.EMBEDDING_DIMENSION,
+    backend=settings.EMBEDDING_BACKEND,
+    quantize=settings.EMBEDDING_QUANTIZE,
+    onnx_file=settings.EMBEDDING_ONNX_FILE,
+    batch_size=settings.EMBEDDING_BATCH_SIZE,
+    base_url=settings.DASHSCOPE_EMBEDDING_BASE_URL,
+    pool_size=settings.EMBEDDING_HTTP_POOL_SIZE,
+    connect_timeout=settings.EMBEDDING_HTTP_CONNECT_TIMEOUT,
+    read_timeout=settings.EMBEDDING_HTTP_READ_TIMEOUT,
+    http2=settings.EMBEDDING_HTTP2,
+)
+
+def warm_up_embedder():
+    """App startup hook: load the model or open the embedding connection before the first query"""
+    if settings.EMBEDDING_WARMUP:
+        embedder.warm_up()
+
+def embedding_key(query: str):
+    return (embedder.name, embedder.dimension, normalize_query(query))
+
+def _embed(query: str):
+    with span("embed", embedder=embedder.name):
+        return embedder.embed_one(query)
 
 def embed_with_str(query: str):
-    resp = dashscope.TextEmbedding.call(
-        model=dashscope.TextEmbedding.Models.text_embedding_v3,
-        api_key=settings.DASHSCOPE_API_KEY,
-        input=query)
-    if resp.status_code == HTTPStatus.OK:
-        return resp.output['embeddings'][0]['embedding']
-    else:
-        print(resp)
+    if embedding_cache is not None:
+        cached = embedding_cache.get(query, embedder.name, embedder.dimension)
+        if cached is not None:
+            return cached
+
+    try:
+        embedding = embed_flights.do(embedding_key(query), lambda: _embed(query))
+    except EmbeddingError as e:
+        print(e)
+        return None
+    if embedding_cache is not None:
+        embedding_cache.put(query, embedder.name, embedder.dimension, embedding)
+    return embedding
+
+SEARCH_LIMIT = 3
+KNOWLEDGE_BASE_SCORE_THRESHOLD = 0.6
+DOCTOR_SCORE_THRESHOLD = 0.9
+
+def knowledge_base_key(query: str):
+    """Single-flight key of a knowledge base search"""
+    return (KNOWLEDGE_BASE_COLLECTION, normalize_query(query), SEARCH_LIMIT,
+            KNOWLEDGE_BASE_SCORE_THRESHOLD, settings.KB_PASSAGES_PER_ARTICLE)
+
+def doctor_key(query: str, specialization: Optional[str], available_only: bool):
+    """Single-flight key of a doctor search"""
+    return (DOCTOR_COLLECTION, normalize_query(query), SEARCH_LIMIT,
+            DOCTOR_SCORE_THRESHOLD, specialization or None, bool(available_only))
+
+def format_knowledge_results(groups) -> List[Dict[str, Any]]:
+    """
+    Turn knowledge base hits, grouped by article, into the dictionaries handed
+    to the model and the UI. Only the matching passages of each article are
+    included, in reading order.
+    """
+    formatted_results = []
+    for group in groups:
+        hits = sorted(group.hits, key=lambda hit: hit.payload["char_start"])
+        content = "\n...\n".join(hit.payload["text"] for hit in hits)
+        content_preview = content[:200] + "..." if len(content) > 200 else content
+        formatted_results.append({
+            "title": hits[0].payload["title"],
+            "content": content,
+            "content_preview": content_preview,
+            "source_link": hits[0].payload["source_link"],
+            "relevance_score": round(max(hit.score for hit in hits), 3)
+        })
+    return formatted_results
+
+def format_doctor_results(points) -> List[Dict[str, Any]]:
+    """Turn doctor hits into the dictionaries handed to the model and the UI"""
+    formatted_results = []
+    for result in points:
+        # Format dictionary result
+        formatted_results.append({
+            "doctor_name": result.payload["doctor_name"],
+            "specialization": result.payload["doctor_field"],
+            "description": result.payload["doctor_description"],
+            "availability_status": "Available" if result.payload["availability"] else "Not Available",
+            "appointment_link": result.payload["appointment_link"],
+            "relevance_score": round(result.score, 3)
+        })
+    return formatted_results
 
 def search_knowledge_base(query: str) -> List[Dict[str, Any]]:
     """
@@ -28,80 +141,89 @@ def search_knowledge_base(query: str) -> List[Dict[str, Any]]:
     Args:
         query: str -> query used to retrieve the relevant information.
     Returns:
-        Tuple containing:
-        1. List of the formatted results with title, content preview, and source link
-        2. String joining all relevant information from results
+        List of the formatted results with title, content preview, and source link
     """
+    return knowledge_base_flights.do(knowledge_base_key(query), lambda: _search_knowledge_base(query))
 
+def _search_knowledge_base(query: str) -> List[Dict[str, Any]]:
     embed = embed_with_str(query)
-    results = client.query_points(
-        collection_name="knowledge_base_collection",
-        query=embed,
-        with_payload=True,
-        limit=3,
-        score_threshold=0.6
-    )
-    formatted_results = []
-    combined_text_parts = []
-    for result in results.points:
-        # Format dictionary result
-        content_preview = result.payload["content"][:200] + "..." if len(result.payload["content"]) > 200 else result.payload["content"]
-        formatted_results.append({
-            "title": result.payload["title"],
-            "content": result.payload["content"],
-            "content_preview": content_preview,
-            "source_link": result.payload["source_link"],
-            "relevance_score": round(result.score, 3)
-        })
-
-        # # Add to combined text
-        # combined_text_parts.append(
-        #     f"Title: {result.payload['title']}\n"
-        #     f"Content: {result.payload['content']}\n"
-        #     f"Source: {result.payload['source_link']}\n"
-        # )
+    index = embedded_indexes.get(KNOWLEDGE_BASE_COLLECTION)
+    with span("search", collection=KNOWLEDGE_BASE_COLLECTION, embedded=index is not None):
+        if index is not None:
+            groups = index.query_groups(
+                embed,
+                group_by="parent_id",
+                group_size=settings.KB_PASSAGES_PER_ARTICLE,
+                limit=SEARCH_LIMIT,
+                score_threshold=KNOWLEDGE_BASE_SCORE_THRESHOLD
+            )
+        else:
+            groups = client.query_points_groups(
+                collection_name=KNOWLEDGE_BASE_COLLECTION,
+                query=embed,
+                group_by="parent_id",
+                group_size=settings.KB_PASSAGES_PER_ARTICLE,
+                search_params=qdrant_profile.search_params(),
+                with_payload=True,
+                limit=SEARCH_LIMIT,
+                score_threshold=KNOWLEDGE_BASE_SCORE_THRESHOLD
+            ).groups
+    formatted_results = format_knowledge_results(groups)
 
     print('results', formatted_results)
 
-    # combined_text = "\n".join(combined_text_parts)
     return formatted_results
 
-def search_doctors(query: str) -> List[Dict[str, Any]]:
+def doctor_filter(specialization: Optional[str] = None, available_only: bool = False) -> Optional[Filter]:
+    """
+    Qdrant filter for doctor search, None when nothing is filtered.
+
+    Both fields have payload indexes (see scripts/store_appointment_data.py),
+    so the filter is applied while walking the vector index rather than to
+    the few hits that come back.
+    """
+    conditions = []
+    if specialization:
+        # Full-text match: "endocrinology" matches "Breast and Endocrinology"
+        conditions.append(FieldCondition(key="doctor_field", match=MatchText(text=specialization)))
+    if available_only:
+        conditions.append(FieldCondition(key="availability", match=MatchValue(value=True)))
+    return Filter(must=conditions) if conditions else None
+
+def search_doctors(query: str, specialization: Optional[str] = None, available_only: bool = False) -> List[Dict[str, Any]]:
     """
     Search for doctors based on query.
+
+    Args:
+        query: str -> description of the user's health concern.
+        specialization: only doctors whose field matches, e.g. "Endocrinology".
+        available_only: skip doctors that are not taking appointments.
     Returns:
-        Tuple containing:
-        1. List of formatted results with doctor information
-        2. String joining all relevant information from results
+        List of formatted results with doctor information
     """
-    embed = embed_with_str(query)
-    results = client.query_points(
-        collection_name="doctor_collection",
-        query=embed,
-        with_payload=True,
-        limit=3,
-        score_threshold=0.9,
+    return doctor_flights.do(
+        doctor_key(query, specialization, available_only),
+        lambda: _search_doctors(query, specialization, available_only)
     )
 
-    formatted_results = []
-    combined_text_parts = []
-
-    for result in results.points:
-        # Format dictionary result
-        formatted_results.append({
-            "doctor_name": result.payload["doctor_name"],
-            "specialization": result.payload["doctor_field"],
-            "description": result.payload["doctor_description"],
-            "availability_status": "Available" if result.payload["availability"] else "Not Available",
-            "appointment_link": result.payload["appointment_link"],
-            "relevance_score": round(result.score, 3)
-        })
-
-        # Add to combined text
-        # combined_text_parts.append(
-        #     f"Specialization: {result.payload['doctor_field']}\n"
-        #     f"Description: {result.payload['doctor_description']}\n"
-        # )
-
-    # combined_text = "\n".join(combined_text_parts)
-    return formatted_results
\ No newline at end of file
+def _search_doctors(query: str, specialization: Optional[str], available_only: bool) -> List[Dict[str, Any]]:
+    embed = embed_with_str(query)
+    query_filter = doctor_filter(specialization, available_only)
+    index = embedded_indexes.get(DOCTOR_COLLECTION)
+    with span("search", collection=DOCTOR_COLLECTION, embedded=index is not None):
+        if index is not None:
+            return format_doctor_results(index.query(
+                embed, limit=SEARCH_LIMIT, score_threshold=DOCTOR_SCORE_THRESHOLD, query_filter=query_filter
+            ))
+
+        results = client.query_points(
+            collection_name=DOCTOR_COLLECTION,
+            query=embed,
+            query_filter=query_filter,
+            search_params=qdrant_profile.search_params(),
+            with_payload=True,
+            limit=SEARCH_LIMIT,
+            score_threshold=DOCTOR_SCORE_THRESHOLD,
+        )
+
+    return format_doctor_results(results.points)
@@ -0,0 +1,138 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, Any, Optional
+from models.chat import ChatState
+
+
+def session_id(session) -> str:
+    """Return the chat session id stored in the cookie session, creating one if needed"""
+    sid = session.get('sid')
+    if sid is None:
+        sid = uuid.uuid4().hex
+        session['sid'] = sid
+    return sid
+
+
+class SessionStore:
+    """
+    Session-keyed ChatState store with bounded memory.
+
+    - each session is trimmed to `max_session_bytes` (see ChatState.trim)
+    - sessions idle for longer than `idle_ttl` seconds are dropped
+    - when all sessions together exceed `max_total_bytes`, the least recently
+      used ones are evicted
+    Sessions are kept in an OrderedDict ordered by last access, so both idle
+    and LRU eviction only ever look at the front of it.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], ChatState],
+        max_session_bytes: int = 256 * 1024,
+        max_total_bytes: int = 256 * 1024 * 1024,
+        idle_ttl: float = 1800,
+    ):
+        self.factory = factory
+        self.max_session_bytes = max_session_bytes
+        self.max_total_bytes = max_total_bytes
+        self.idle_ttl = idle_ttl
+        self._sessions: "OrderedDict[str, ChatState]" = OrderedDict()
+        self._last_seen: Dict[str, float] = {}
+        self._sizes: Dict[str, int] = {}
+        self._bytes_held = 0
+        self._lock = threading.RLock()
+        self.evictions = {"idle": 0, "memory": 0}
+
+    def get(self, sid: str) -> ChatState:
+        """Return the session's state, creating it on first use"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            state = self._sessions.get(sid)
+            if state is None:
+                state = self.factory()
+                self._sessions[sid] = state
+                self._sizes[sid] = 0
+            self._sessions.move_to_end(sid)
+            self._last_seen[sid] = now
+            return state
+
+    def reset(self, sid: str) -> ChatState:
+        """Clear the session's conversation and return its state"""
+        state = self.get(sid)
+        state.reset()
+        self.enforce(sid)
+        return state
+
+    def drop(self, sid: str):
+        with self._lock:
+            self._remove(sid)
+
+    def enforce(self, sid: Optional[str] = None):
+        """
+        Re-measure a session after it changed and apply the memory caps.
+        Call this at message boundaries (new message, generation finished).
+        """
+        with self._lock:
+            if sid is not None and sid in self._sessions:
+                size = self._sessions[sid].trim(self.max_session_bytes)
+                self._bytes_held += size - self._sizes[sid]
+                self._sizes[sid] = size
+
+            while self._bytes_held > self.max_total_bytes and len(self._sessions) > 1:
+                oldest = next(iter(self._sessions))
+                if oldest == sid:
+                    break
+                self._remove(oldest)
+                self.evictions["memory"] += 1
+
+    def _expire(self, now: float):
+        while self._sessions:
+            oldest = next(iter(self._sessions))
+            if now - self._last_seen[oldest] <= self.idle_ttl:
+                break
+            self._remove(oldest)
+            self.evictions["idle"] += 1
+
+    def _remove(self, sid: str):
+        if sid in self._sessions:
+            del self._sessions[sid]
+            del self._last_seen[sid]
+            self._bytes_held -= self._sizes.pop(sid)
+
+    @property
+    def live_sessions(self) -> int:
+        return len(self._sessions)
+
+    @property
+    def bytes_held(self) -> int:
+        return self._bytes_held
+
+    def stats(self) -> Dict[str, Any]:
+        """Gauges for monitoring"""
+        with self._lock:
+            # Idle sessions are otherwise only dropped on the next get()
+            self._expire(time.monotonic())
+            return {
+                "live_sessions": len(self._sessions),
+                "bytes_held": self._bytes_held,
+                "idle_evictions": self.evictions["idle"],
+                "memory_evictions": self.evictions["memory"],
+            }
+
+    def register_metrics(self, registry, app: str):
+        """Export stats() on the app's /metrics (see services.tracing)"""
+        registry.gauge(
+            "chat_live_sessions", "Sessions held in memory", labels=("app",),
+            collect=lambda: {(app,): self.stats()["live_sessions"]}
+        )
+        registry.gauge(
+            "chat_session_bytes", "Approximate bytes held by all sessions", labels=("app",),
+            collect=lambda: {(app,): self.stats()["bytes_held"]}
+        )
+        registry.counter(
+            "chat_session_evictions_total", "Sessions dropped by the store", labels=("app", "reason"),
+            collect=lambda: {(app, reason): count for reason, count in self.evictions.items()}
+        )
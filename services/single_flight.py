@@ -0,0 +1,91 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from services.tracing import registry
+
+collapsed_calls = registry.counter(
+    "search_single_flight_collapsed_total",
+    "Calls that waited for an identical call already in flight instead of making their own",
+    labels=("operation",)
+)
+
+
+class SingleFlight:
+    """
+    Collapses concurrent identical calls into one.
+
+    The first caller of a key runs the call; callers arriving with the same
+    key while it is in flight wait for it and get its result (or exception)
+    instead of calling upstream themselves. Nothing is kept once the call
+    finishes, so this is deduplication, not caching.
+
+    Threads use do(), coroutines ado(); the two do not share calls. An async
+    call runs shielded, so one cancelled waiter does not cancel it for the
+    others.
+    """
+
+    def __init__(self, operation: str, enabled: bool = True):
+        self.operation = operation
+        self.enabled = enabled
+        self._calls: Dict[Hashable, Future] = {}
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.collapsed = 0
+
+    def _count(self, leader: bool):
+        # Called with the lock held
+        self.calls += 1
+        if not leader:
+            self.collapsed += 1
+            collapsed_calls.inc(operation=self.operation)
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        if not self.enabled:
+            return fn()
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+            self._count(leader)
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def ado(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        if not self.enabled:
+            return await fn()
+        with self._lock:
+            task = self._tasks.get(key)
+            leader = task is None
+            if leader:
+                task = self._tasks[key] = asyncio.ensure_future(fn())
+                task.add_done_callback(lambda done: self._forget(key, done))
+            self._count(leader)
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        with self._lock:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+        # Retrieve the exception, all waiters may have been cancelled
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"calls": self.calls, "collapsed": self.collapsed, "in_flight": len(self._calls) + len(self._tasks)}
@@ -0,0 +1,175 @@
+import asyncio
+import threading
+import time
+from typing import AsyncIterator, Awaitable, Callable, Tuple
+
+
+class DeltaCoalescer:
+    """
+    Groups streamed tokens into append-only frames.
+
+    Tokens are buffered and flushed as one frame once `interval` seconds have
+    passed since the last frame or `max_chars` characters are waiting, so the
+    number of frames grows with time and size rather than with token count.
+    `render` turns the buffered text into the payload that is sent.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[str], Awaitable[None]],
+        render: Callable[[str], str],
+        interval: float = 0.04,
+        max_chars: int = 1024,
+    ):
+        self.send = send
+        self.render = render
+        self.interval = interval
+        self.max_chars = max_chars
+        self._buffer = []
+        self._buffered_chars = 0
+        self._last_flush = time.monotonic()
+        self.tokens = 0
+        self.frames = 0
+        self.bytes_sent = 0
+
+    async def push(self, text: str):
+        """Buffer a token and flush if the time or size budget is used up"""
+        if not text:
+            return
+        self._buffer.append(text)
+        self._buffered_chars += len(text)
+        self.tokens += 1
+        # The first token goes out at once to keep time-to-first-token low
+        if (self.frames == 0
+                or self._buffered_chars >= self.max_chars
+                or time.monotonic() - self._last_flush >= self.interval):
+            await self.flush()
+
+    async def flush(self):
+        """Send whatever is buffered as one frame"""
+        if self._buffer:
+            await self.send_frame(self.render("".join(self._buffer)))
+            self._buffer.clear()
+            self._buffered_chars = 0
+        self._last_flush = time.monotonic()
+
+    async def send_frame(self, payload: str):
+        """Send a pre-rendered frame, counting it in the totals"""
+        await self.send(payload)
+        self.frames += 1
+        self.bytes_sent += len(payload.encode())
+
+    def summary(self) -> str:
+        return f"{self.tokens} tokens in {self.frames} frames, {self.bytes_sent} bytes"
+
+
+class MessageStream:
+    """
+    Fan-out of one generating message to any number of async subscribers.
+
+    The producer (usually a worker thread running the completion) calls
+    `publish` for each delta and `close` once generation ends. Subscribers
+    first receive everything published so far, then only new content, and
+    their iteration ends when the stream is closed.
+
+    Deltas are kept once, in the stream; a subscriber's queue only holds
+    wake-ups and other events, and is capped at `max_queued`. When a slow
+    subscriber's queue is full, new delta wake-ups are dropped, since its
+    next read picks up every delta since the last one anyway, and other
+    events push out the oldest queued one.
+    """
+
+    def __init__(self, max_queued: int = 64):
+        self._lock = threading.Lock()
+        self._chunks = []
+        self._subscribers = []
+        self.max_queued = max_queued
+        self.closed = False
+
+    def publish(self, data: str, event: str = "delta"):
+        """Push new content to every subscriber; safe to call from any thread"""
+        with self._lock:
+            if self.closed:
+                return
+            if event == "delta":
+                self._chunks.append(data)
+                data = None
+            subscribers = list(self._subscribers)
+        for loop, queue in subscribers:
+            self._notify(loop, queue, (event, data))
+
+    def close(self):
+        """Mark the stream finished and end every subscription"""
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            subscribers = list(self._subscribers)
+        for loop, queue in subscribers:
+            self._notify(loop, queue, None)
+
+    @staticmethod
+    def _notify(loop, queue, item):
+        try:
+            loop.call_soon_threadsafe(MessageStream._offer, queue, item)
+        except RuntimeError:
+            # The subscriber's event loop is already gone
+            pass
+
+    @staticmethod
+    def _offer(queue, item):
+        if queue.full():
+            if item is not None and item[0] == "delta":
+                return
+            queue.get_nowait()
+        queue.put_nowait(item)
+
+    def _since(self, offset: int) -> Tuple[str, int]:
+        """Deltas published after the first `offset` ones, and the new offset"""
+        with self._lock:
+            return "".join(self._chunks[offset:]), len(self._chunks)
+
+    @property
+    def content(self) -> str:
+        with self._lock:
+            return "".join(self._chunks)
+
+    async def subscribe(self) -> AsyncIterator[Tuple[str, str]]:
+        """Yield (event, data) pairs; deltas queued while the reader was busy are merged"""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.max_queued)
+        with self._lock:
+            backlog = "".join(self._chunks)
+            offset = len(self._chunks)
+            closed = self.closed
+            if not closed:
+                self._subscribers.append((loop, queue))
+
+        try:
+            if backlog:
+                yield "delta", backlog
+            if closed:
+                return
+
+            while True:
+                items = [await queue.get()]
+                while not queue.empty():
+                    items.append(queue.get_nowait())
+
+                for item in items:
+                    if item is not None and item[0] == "delta":
+                        continue
+                    # Content published before this event goes out first
+                    text, offset = self._since(offset)
+                    if text:
+                        yield "delta", text
+                    if item is None:
+                        return
+                    yield item
+                text, offset = self._since(offset)
+                if text:
+                    yield "delta", text
+        finally:
+            with self._lock:
+                if (loop, queue) in self._subscribers:
+                    self._subscribers.remove((loop, queue))
@@ -0,0 +1,283 @@
+import asyncio
+import contextvars
+import json
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+
+from config.settings import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+RATE_BUCKETS = (1, 5, 10, 20, 40, 80, 160, 320)
+
+
+def _label_text(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """
+    Monotonic total. With `collect`, the values are not incremented here but
+    read from it on every scrape, as {label values: value}, for totals some
+    other object already keeps.
+    """
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                 collect: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.collect = collect
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _items(self):
+        if self.collect is not None:
+            return sorted((tuple(str(v) for v in key), value) for key, value in self.collect().items())
+        with self._lock:
+            return sorted(self._values.items())
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for key, value in self._items():
+            lines.append(f"{self.name}{_label_text(self.labels, key)} {value}")
+        return "\n".join(lines)
+
+
+class Gauge(Counter):
+    """Current value of something, e.g. live sessions, read from `collect` on every scrape"""
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, collect: Callable[[], Dict[Tuple[str, ...], float]],
+                 labels: Tuple[str, ...] = ()):
+        super().__init__(name, help, labels, collect)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> (per-bucket counts, sum, count)
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            series = self._series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    le = 'le="%s"' % bound
+                    lines.append(f"{self.name}_bucket{_label_text(self.labels, key, le)} {bucket_count}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_label_text(self.labels, key, le)} {count}")
+                lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {total}")
+                lines.append(f"{self.name}_count{_label_text(self.labels, key)} {count}")
+        return "\n".join(lines)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, *args, **kwargs) -> Counter:
+        metric = Counter(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, *args, **kwargs) -> Gauge:
+        metric = Gauge(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        metric = Histogram(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.histogram(
+    "chat_stage_seconds", "Time spent in each stage of answering a message", labels=("stage",)
+)
+ttft_seconds = registry.histogram(
+    "chat_time_to_first_token_seconds", "Time from receiving a message to its first answer token", labels=("app",)
+)
+tokens_per_second = registry.histogram(
+    "chat_tokens_per_second", "Streaming speed of each completion after its first token",
+    labels=("app",), buckets=RATE_BUCKETS
+)
+completion_tokens = registry.counter(
+    "chat_completion_tokens_total", "Streamed completion chunks", labels=("app",)
+)
+stage_errors = registry.counter(
+    "chat_stage_errors_total", "Stages that ended with an exception", labels=("stage",)
+)
+
+
+class FileSpanExporter:
+    """
+    Appends finished spans to a file as OTLP/JSON export requests, one per
+    line, the format the OpenTelemetry Collector's otlpjsonfile receiver reads.
+    """
+
+    def __init__(self, path: str, service_name: str = "teleme-chat-app"):
+        self.path = path
+        self.service_name = service_name
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def _attribute(key, value):
+        if isinstance(value, bool):
+            return {"key": key, "value": {"boolValue": value}}
+        if isinstance(value, int):
+            return {"key": key, "value": {"intValue": str(value)}}
+        if isinstance(value, float):
+            return {"key": key, "value": {"doubleValue": value}}
+        return {"key": key, "value": {"stringValue": str(value)}}
+
+    def export(self, span: "Span"):
+        record = {"resourceSpans": [{
+            "resource": {"attributes": [self._attribute("service.name", self.service_name)]},
+            "scopeSpans": [{
+                "scope": {"name": "services.tracing"},
+                "spans": [{
+                    "traceId": span.trace_id,
+                    "spanId": span.span_id,
+                    "parentSpanId": span.parent_id or "",
+                    "name": span.name,
+                    "kind": 1,
+                    "startTimeUnixNano": str(span.start_ns),
+                    "endTimeUnixNano": str(span.end_ns),
+                    "attributes": [self._attribute(k, v) for k, v in span.attributes.items()],
+                    "status": {"code": 2 if span.error else 1},
+                }],
+            }],
+        }]}
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(line)
+
+
+exporter = FileSpanExporter(settings.TRACE_EXPORT_PATH) if settings.TRACE_EXPORT_PATH else None
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    def __init__(self, name: str, attributes: dict):
+        parent = _current_span.get()
+        self.name = name
+        self.attributes = attributes
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.parent_id = parent.span_id if parent else None
+        self.span_id = secrets.token_hex(8)
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = False
+        self._start = time.perf_counter()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._start
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Time a stage of answering a message.
+
+    The duration goes to the chat_stage_seconds histogram under `name`; with
+    TRACE_EXPORT_PATH set, the span is also written out together with its
+    attributes and parent, so nested stages of one message form one trace.
+    """
+    current = Span(name, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except asyncio.CancelledError:
+        # Stopped on purpose (see services/generations.py), not a failure
+        current.set(cancelled=True)
+        raise
+    except BaseException:
+        current.error = True
+        stage_errors.inc(stage=name)
+        raise
+    finally:
+        _current_span.reset(token)
+        stage_seconds.observe(current.elapsed, stage=name)
+        current.end_ns = time.time_ns()
+        if exporter is not None:
+            try:
+                exporter.export(current)
+            except OSError as e:
+                print(f"Could not export span {name}: {e}")
+
+
+class StreamTimer:
+    """Time to first token and tokens/s of the answer to one message"""
+
+    def __init__(self, app: str, started: Optional[float] = None):
+        self.app = app
+        # perf_counter() of when the user's message arrived
+        self.started = started if started is not None else time.perf_counter()
+        self.first_token: Optional[float] = None
+        self.last_token: Optional[float] = None
+        self.tokens = 0
+
+    def token(self):
+        now = time.perf_counter()
+        if self.first_token is None:
+            self.first_token = now
+            ttft_seconds.observe(now - self.started, app=self.app)
+        self.last_token = now
+        self.tokens += 1
+
+    def finish(self):
+        if self.first_token is None:
+            return
+        completion_tokens.inc(self.tokens, app=self.app)
+        streamed = self.last_token - self.first_token
+        if streamed > 0:
+            tokens_per_second.observe((self.tokens - 1) / streamed, app=self.app)
+
+
+def metrics_text() -> str:
+    return registry.render()
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+# Manifests and collection versions of the test runs go to a scratch directory
+SCRATCH_DIR = tempfile.mkdtemp()
+os.environ["INGEST_MANIFEST_DIR"] = os.path.join(SCRATCH_DIR, "manifests")
+os.environ["COLLECTION_VERSIONS_PATH"] = os.path.join(SCRATCH_DIR, "collection_versions.json")
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from qdrant_client import QdrantClient
+from qdrant_client.models import PointStruct
+
+from scripts import store_knowledge_base
+from scripts.chunking import Chunker
+from services.embedders import Embedder
+
+
+class HashEmbedder(Embedder):
+    """Deterministic vectors, so ingestion runs without a model or network"""
+
+    name = "test-hash"
+    dimension = 8
+
+    def embed(self, texts):
+        return [[b / 255 for b in hashlib.sha256(text.encode()).digest()[:self.dimension]] for text in texts]
+
+
+def feed(articles):
+    return {"rss": {"channel": {"item": [
+        {"title": title, "link": f"https://blog.example.com/{i}", "encoded": {"__cdata": f"<p>{body}</p>"}}
+        for i, (title, body) in enumerate(articles)
+    ]}}}
+
+
+class StoreKnowledgeBaseTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(dir=SCRATCH_DIR)
+        self.data_path = os.path.join(self.directory, "data.json")
+        with open(self.data_path, "w") as f:
+            json.dump(feed([
+                ("Diabetes", " ".join(f"diabetes sentence {i}." for i in range(60))),
+                ("Asthma", " ".join(f"asthma sentence {i}." for i in range(60))),
+            ]), f)
+
+        self.client = QdrantClient(":memory:")
+        patches = [
+            mock.patch.object(store_knowledge_base, "QdrantClient", lambda url: self.client),
+            mock.patch.object(store_knowledge_base, "DATA_PATH", self.data_path),
+            mock.patch.object(store_knowledge_base, "embedder", HashEmbedder()),
+            mock.patch.object(store_knowledge_base, "chunker", Chunker(32, 4)),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def count(self):
+        return self.client.count(store_knowledge_base.COLLECTION_NAME).count
+
+    def manifest_path(self):
+        return store_knowledge_base.Manifest(store_knowledge_base.COLLECTION_NAME).path
+
+    def test_rerun_without_manifest_keeps_passages(self):
+        store_knowledge_base.main()
+        points = self.count()
+        self.assertGreater(points, 2)
+
+        # A manifest lost while the collection survives must not read passages as stale articles
+        os.remove(self.manifest_path())
+        store_knowledge_base.main()
+        self.assertEqual(self.count(), points)
+
+    def test_legacy_article_points_are_replaced(self):
+        store_knowledge_base.main()
+        points = self.count()
+        os.remove(self.manifest_path())
+
+        # Whole-article point with a positional ID, written before the index was chunked
+        self.client.upsert(
+            store_knowledge_base.COLLECTION_NAME,
+            points=[PointStruct(id=7, vector=[0.1] * HashEmbedder.dimension, payload={"title": "Old"})],
+            wait=True,
+        )
+        store_knowledge_base.main()
+        self.assertEqual(self.count(), points)
+
+
+if __name__ == "__main__":
+    unittest.main()
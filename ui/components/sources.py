@@ -1,6 +1,8 @@
 from fasthtml.common import *
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Callable, Optional
 from datetime import datetime
+from services.fragment_cache import fragment_cache
+from services.collection_versions import KNOWLEDGE_BASE_COLLECTION, DOCTOR_COLLECTION
 
 def format_historical_source(source: Dict[str, Any], timestamp: datetime):
     """Format a historical source result"""
@@ -18,8 +20,26 @@ def format_historical_source(source: Dict[str, Any], timestamp: datetime):
         cls="bg-white rounded-lg shadow-sm hover:shadow-md transition-shadow duration-200"
     )
 
-def format_source(source: Dict[str, Any], source_type: str):
-    """Format source information for display"""
+def format_source(source: Dict[str, Any], source_type: str, card: Optional[Callable[[Dict[str, Any], str], Any]] = None):
+    """
+    Format source information for display, rendered once per source and collection version.
+
+    `card` builds the markup, source_card by default; apps with their own
+    card layout pass theirs and share this caching.
+    """
+    card = card or source_card
+    if source_type == "search_knowledge_base":
+        # Preview and relevance depend on the query, so they are part of the key
+        key = ('kb', source['source_link'], source['title'], source['content_preview'], source['relevance_score'])
+        collection = KNOWLEDGE_BASE_COLLECTION
+    else:
+        key = ('doctor', source['appointment_link'], source['doctor_name'], source['specialization'],
+               source['description'], source['availability_status'], source['relevance_score'])
+        collection = DOCTOR_COLLECTION
+    return fragment_cache.render((card.__module__, card.__qualname__) + key, (collection,), lambda: card(source, source_type))
+
+def source_card(source: Dict[str, Any], source_type: str):
+    """Card of a knowledge base article or doctor"""
     if source_type == "search_knowledge_base":
         return Div(
             Div(